@@ -0,0 +1,91 @@
+#!/usr/bin/python
+'''
+Module: benchmark_omi_decode.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To compare the peak memory and run time of the original SDS decode with the
+block-by-block decode in omi_decode.py
+
+A temporary synthetic OMNO2 granule is written with generate_synthetic_omi_he5.py (no real
+granule is needed) and each decode is run under tracemalloc, which counts NumPy allocations, so the peak is what the decode itself
+allocates on top of what was already in memory.
+
+Example:
+	python benchmark_omi_decode.py --rows 20000 --cols 60
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from generate_synthetic_omi_he5 import write_granule
+from omi_decode import decode, decode_many
+from omi_reader import Granule
+
+SDS_NAMES=['ColumnAmountNO2','ColumnAmountNO2Std','ColumnAmountNO2Trop']
+
+def original_decode(sds):
+	#the decode the location tool used before omi_decode
+	fv=sds.attrs['_FillValue']
+	mv=sds.attrs['MissingValue']
+	dataArray=sds[:].astype(float)
+	dataArray[dataArray==float(fv[0])]=np.nan
+	dataArray[dataArray==float(mv[0])]=np.nan
+	return sds.attrs['ScaleFactor'] * (dataArray - sds.attrs['Offset'])
+
+def measure(function):
+	#peak bytes allocated and seconds taken by one call; the result is kept until the peak is read
+	tracemalloc.start()
+	start=time.perf_counter()
+	result=function()
+	seconds=time.perf_counter()-start
+	peak=tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	del result
+	return peak,seconds
+
+def run(FILE_NAME):
+	'''
+	Runs every decode on the test file and returns (name, peak bytes, seconds) rows.
+	'''
+	granule=Granule(FILE_NAME)
+	handles=[granule[SDS_NAME] for SDS_NAME in SDS_NAMES]
+	dataFields=granule.dataFields
+	cases=[('original, 1 SDS',lambda: original_decode(dataFields[SDS_NAMES[0]])),
+		('decode float64, 1 SDS',lambda: decode(handles[0])),
+		('decode float32, 1 SDS',lambda: decode(handles[0],dtype=np.float32)),
+		('decode float32 masked, 1 SDS',lambda: decode(handles[0],dtype=np.float32,masked=True)),
+		('original, 3 SDS',lambda: [original_decode(dataFields[SDS_NAME]) for SDS_NAME in SDS_NAMES]),
+		('decode_many float32, 3 SDS',lambda: decode_many(handles,dtype=np.float32))]
+	rows=[(name,)+measure(function) for name,function in cases]
+	granule.close()
+	return rows
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Compare the memory use of the original and block-by-block SDS decode.')
+	parser.add_argument('--rows',type=int,default=20000,help='scanlines in the test SDS (default 20000)')
+	parser.add_argument('--cols',type=int,default=60,help='cross-track pixels (default 60)')
+	options=parser.parse_args(argv)
+	directory=tempfile.mkdtemp()
+	try:
+		FILE_NAME=os.path.join(directory,'OMI-Aura_L2-OMNO2_benchmark.he5')
+		write_granule(FILE_NAME,'NO2',options.rows,options.cols)
+		print('SDS of {0} x {1} float32 values ({2:.1f} MB raw each)\n'.format(options.rows,options.cols,options.rows*options.cols*4/1e6))
+		print('{0:<32}{1:>12}{2:>10}'.format('decode','peak MB','seconds'))
+		for name,peak,seconds in run(FILE_NAME):
+			print('{0:<32}{1:>12.1f}{2:>10.3f}'.format(name,peak/1e6,seconds))
+	finally:
+		shutil.rmtree(directory)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
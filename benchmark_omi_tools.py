@@ -0,0 +1,181 @@
+#!/usr/bin/python
+'''
+Module: benchmark_omi_tools.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To time the main stages of the OMI tools (read, decode, time conversion, ascii dump,
+location query, map and rasterized map) on synthetic granules of several sizes and counts
+
+The granules are written by generate_synthetic_omi_he5.py into a temporary folder, so no
+real data is needed. Each stage runs over all granules of a case in a fresh process, so
+its peak resident memory (RSS) is its own. Throughput is reported in granules, megabytes
+of he5 file and millions of pixels per second.
+
+The map and render stages need matplotlib and basemap and are reported as skipped without them.
+
+Example:
+	python benchmark_omi_tools.py --counts 1 8 --scanlines 400 1644 --json benchmark.json
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from generate_synthetic_omi_he5 import generate_granules
+
+STAGES=('read','decode','time','dump','location','map','render')
+
+def _peak_rss():
+	#peak resident memory of this process in bytes (None where the resource module is missing)
+	try:
+		import resource
+	except ImportError:
+		return None
+	peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	#Linux reports kilobytes, macOS bytes
+	return peak if sys.platform == 'darwin' else peak*1024
+
+def _read(FILE_NAME,options):
+	from omi_reader import Granule
+	with Granule(FILE_NAME) as granule:
+		granule.lat
+		granule.lon
+		granule[granule.schema.main_sds].raw()
+
+def _decode(FILE_NAME,options):
+	from omi_reader import Granule
+	with Granule(FILE_NAME) as granule:
+		for SDS_NAME in granule.schema.dump_sds:
+			granule[SDS_NAME].read()
+
+def _time(FILE_NAME,options):
+	from omi_reader import Granule
+	from omi_time import calendar_columns
+	with Granule(FILE_NAME) as granule:
+		calendar_columns(granule.scan_dates())
+
+def _dump(FILE_NAME,options):
+	from read_omi_no2_so2_and_dump_ascii import dump_granule
+	os.remove(dump_granule(FILE_NAME,options['format']))
+
+def _location(FILE_NAME,options):
+	from read_omi_no2_so2_at_a_location import locations_report
+	random=np.random.default_rng(0)
+	lats=random.uniform(-60,60,options['sites']).tolist()
+	lons=random.uniform(-180,180,options['sites']).tolist()
+	locations_report(FILE_NAME,lats,lons)
+
+def _map(FILE_NAME,options):
+	from read_and_map_omi_no2_so2 import map_granule
+	import matplotlib.pyplot as plt
+	pngfile=os.path.splitext(FILE_NAME)[0]+'.png'
+	map_granule(FILE_NAME,pngfile=pngfile)
+	plt.close('all')
+	os.remove(pngfile)
+
+def _render(FILE_NAME,options):
+	from omi_render import render_swath
+	pngfile=os.path.splitext(FILE_NAME)[0]+'.png'
+	render_swath(FILE_NAME,pngfile)
+	os.remove(pngfile)
+
+STAGE_FUNCTIONS={'read':_read,'decode':_decode,'time':_time,'dump':_dump,'location':_location,'map':_map,'render':_render}
+
+def run_stage(stage,file_names,options):
+	'''
+	Runs one stage over a list of granules in the current process.
+
+	Returns
+	-------
+	result : dict
+		seconds, peak_rss (bytes) and error (None, or why the stage was skipped or failed)
+	'''
+	function=STAGE_FUNCTIONS[stage]
+	start=time.perf_counter()
+	try:
+		for FILE_NAME in file_names:
+			function(FILE_NAME,options)
+	except ImportError as error:
+		return {'seconds':None,'peak_rss':None,'error':'skipped ({0})'.format(error)}
+	except Exception as error:
+		return {'seconds':None,'peak_rss':None,'error':'{0}: {1}'.format(type(error).__name__,error)}
+	return {'seconds':time.perf_counter()-start,'peak_rss':_peak_rss(),'error':None}
+
+def _stage_worker(arguments):
+	return run_stage(*arguments)
+
+def benchmark(counts=(1,4),scanlines=(400,1644),pixels=60,products=('NO2',),stages=STAGES,sites=100,output_format='txt'):
+	'''
+	Times each stage for every combination of granule count and size.
+
+	Returns
+	-------
+	rows : list of dict
+		One row per case and stage: count, scanlines, pixels, stage, seconds, peak_rss
+		(bytes), granules_per_s, mb_per_s (of he5 file), mpixels_per_s and error
+	'''
+	options={'sites':sites,'format':output_format}
+	#a fresh (spawned, not forked) process per stage, so the peak RSS is that stage's own
+	context=multiprocessing.get_context('spawn')
+	rows=[]
+	for size in scanlines:
+		for count in counts:
+			directory=tempfile.mkdtemp()
+			try:
+				file_names=generate_granules(directory,count,products,size,pixels)
+				megabytes=sum(os.path.getsize(FILE_NAME) for FILE_NAME in file_names)/1e6
+				npixels=len(file_names)*size*pixels
+				for stage in stages:
+					with context.Pool(1) as pool:
+						result=pool.apply(_stage_worker,((stage,file_names,options),))
+					seconds=result['seconds']
+					row={'count':len(file_names),'scanlines':size,'pixels':pixels,'stage':stage,
+						'seconds':seconds,'peak_rss':result['peak_rss'],'error':result['error'],
+						'granules_per_s':None,'mb_per_s':None,'mpixels_per_s':None}
+					if seconds:
+						row.update({'granules_per_s':len(file_names)/seconds,'mb_per_s':megabytes/seconds,'mpixels_per_s':npixels/1e6/seconds})
+					rows.append(row)
+			finally:
+				shutil.rmtree(directory)
+	return rows
+
+def print_rows(rows):
+	print('{0:>6}{1:>10}{2:>10}{3:>10}{4:>12}{5:>10}{6:>12}{7:>12}'.format('files','scanlines','stage','seconds','granules/s','MB/s','Mpixels/s','peak RSS MB'))
+	for row in rows:
+		if row['error']:
+			print('{0:>6}{1:>10}{2:>10}  {3}'.format(row['count'],row['scanlines'],row['stage'],row['error']))
+			continue
+		rss='' if row['peak_rss'] is None else '{0:.1f}'.format(row['peak_rss']/1e6)
+		print('{0:>6}{1:>10}{2:>10}{3:>10.3f}{4:>12.2f}{5:>10.1f}{6:>12.2f}{7:>12}'.format(row['count'],row['scanlines'],row['stage'],
+			row['seconds'],row['granules_per_s'],row['mb_per_s'],row['mpixels_per_s'],rss))
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Benchmark the OMI tools on synthetic granules.')
+	parser.add_argument('--counts',type=int,nargs='+',default=[1,4],help='granules per product in each case (default 1 4)')
+	parser.add_argument('--scanlines',type=int,nargs='+',default=[400,1644],help='granule sizes in scanlines (default 400 1644)')
+	parser.add_argument('--pixels',type=int,default=60,help='cross-track pixels (default 60)')
+	parser.add_argument('--product',nargs='+',choices=('NO2','SO2'),default=['NO2'],help='products to generate (default NO2)')
+	parser.add_argument('--stages',nargs='+',choices=STAGES,default=list(STAGES),help='stages to time (default all)')
+	parser.add_argument('--sites',type=int,default=100,help='locations per granule for the location stage (default 100)')
+	parser.add_argument('--format',default='txt',help='output format of the dump stage (default txt)')
+	parser.add_argument('--json',help='also write the results to this JSON file')
+	options=parser.parse_args(argv)
+	rows=benchmark(options.counts,options.scanlines,options.pixels,options.product,options.stages,options.sites,options.format)
+	print_rows(rows)
+	if options.json:
+		with open(options.json,'w') as outfile:
+			json.dump(rows,outfile,indent=1)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+'''
+Module: generate_synthetic_omi_he5.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To write fake OMNO2 and OMSO2 Level 2 granules for testing and benchmarking the
+tools when real granules are not available
+
+The files have the layout of the real products: the HDFEOS/SWATHS/<swath>/Data Fields and
+Geolocation Fields groups, float32 SDS with _FillValue, MissingValue, ScaleFactor, Offset,
+Units and ValidRange attributes, uint16 quality flags, uint8 row anomaly flags, TAI93 scan
+times, and chunked, gzip-compressed datasets. The values are random but plausible
+(a daylight orbit from south to north with a ~2600 km wide swath), with fill values
+scattered through the data. The same seed always gives the same files.
+
+Example:
+	python generate_synthetic_omi_he5.py --count 14 --product NO2 SO2 --out synthetic
+
+This writes 14 orbits of each product to the synthetic folder and lists them in
+synthetic/fileList.txt.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import os
+import sys
+import h5py
+import numpy as np
+from omi_time import TAI93_EPOCH
+
+#fill value of the OMI float fields
+FLOAT_FILL=-1.2676506e30
+
+#time between scanlines (seconds) and between orbits (minutes)
+SCAN_SECONDS=2.0
+ORBIT_MINUTES=98.8
+
+#half width of the swath on the ground (km)
+SWATH_HALF_WIDTH=1300.0
+
+#swath name and fields of each product: (name, dtype, units, valid range, value range)
+SWATHS={'NO2':'ColumnAmountNO2','SO2':'OMI Total Column Amount SO2'}
+FIELDS={
+	'NO2':[('ColumnAmountNO2','f4','molec/cm2',(-1e30,1e30),(5e14,8e15)),
+		('ColumnAmountNO2Std','f4','molec/cm2',(-1e30,1e30),(1e14,1e15)),
+		('ColumnAmountNO2Trop','f4','molec/cm2',(-1e30,1e30),(1e14,5e15))],
+	'SO2':[('ColumnAmountSO2_PBL','f4','DU',(-10.0,2000.0),(-1.0,3.0)),
+		('ColumnAmountO3','f4','DU',(0.0,700.0),(220.0,420.0)),
+		('ColumnAmountSO2_TRL','f4','DU',(-10.0,2000.0),(-0.5,1.5))]}
+#quality flag field of each product
+QUALITY_FIELDS={'NO2':'VcdQualityFlags','SO2':'QualityFlags_PBL'}
+
+def granule_name(product,start,orbit):
+	'''
+	File name in the style of the real granules, e.g.
+	OMI-Aura_L2-OMNO2_2019m0501t0012-o78650_v003-2019m0501t0512.he5
+	'''
+	start=np.datetime64(start,'m').item()
+	stamp='{0:%Y}m{0:%m%d}t{0:%H%M}'.format(start)
+	return 'OMI-Aura_L2-OM{0}_{1}-o{2:05d}_v003-{1}.he5'.format(product,stamp,orbit)
+
+def _geolocation(scanlines,pixels,start_lon):
+	#lat/lon of a south to north orbit; the ground track drifts west as the Earth turns
+	along=np.linspace(-84.0,84.0,scanlines)
+	across=np.linspace(-SWATH_HALF_WIDTH,SWATH_HALF_WIDTH,pixels)
+	lat=np.repeat(along[:,None],pixels,axis=1)
+	track_lon=start_lon-np.linspace(0.0,12.0,scanlines)
+	#111.32 km per degree of longitude at the equator, fewer towards the poles
+	km_per_degree=111.32*np.maximum(np.cos(np.radians(along)),0.05)
+	lon=track_lon[:,None]+across[None,:]/km_per_degree[:,None]
+	lon=(lon+180.0)%360.0-180.0
+	return lat.astype(np.float32),lon.astype(np.float32)
+
+def _add_sds(group,name,values,units,valid_range,fill,chunks):
+	sds=group.create_dataset(name,data=values,chunks=chunks,compression='gzip',compression_opts=5,shuffle=True)
+	sds.attrs['_FillValue']=np.array([fill],dtype=values.dtype)
+	sds.attrs['MissingValue']=np.array([fill],dtype=values.dtype)
+	sds.attrs['ScaleFactor']=np.array([1.0])
+	sds.attrs['Offset']=np.array([0.0])
+	sds.attrs['Units']=np.bytes_(units)
+	sds.attrs['Title']=np.bytes_(name)
+	sds.attrs['UniqueFieldDefinition']=np.bytes_('Aura-Shared' if name in ('Latitude','Longitude','Time') else 'OMI-Specific')
+	if valid_range is not None:
+		sds.attrs['ValidRange']=np.array(valid_range,dtype=values.dtype)
+	return sds
+
+def write_granule(FILE_NAME,product='NO2',scanlines=1644,pixels=60,start='2019-05-01T00:12:00',start_lon=0.0,fill_fraction=0.1,seed=0):
+	'''
+	Writes one synthetic OMNO2 or OMSO2 granule.
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the he5 file to write
+	product : str
+		'NO2' or 'SO2'
+	scanlines, pixels : int
+		Swath size (real granules have about 1644 scanlines of 60 pixels)
+	start : str or numpy.datetime64
+		Time of the first scanline (UTC)
+	start_lon : float
+		Longitude of the ground track at the first scanline
+	fill_fraction : float
+		Fraction of pixels of each SDS set to the fill value
+	seed : int
+		Seed of the random values
+
+	Returns
+	-------
+	FILE_NAME : str
+
+	Raises
+	------
+	ValueError
+		If the product is not 'NO2' or 'SO2'
+	'''
+	if product not in SWATHS:
+		raise ValueError('Unknown product: '+str(product)+' (use NO2 or SO2)')
+	random=np.random.default_rng(seed)
+	chunks=(min(scanlines,100),pixels)
+	with h5py.File(FILE_NAME,'w') as outfile:
+		swath=outfile.create_group('HDFEOS/SWATHS/'+SWATHS[product])
+		geolocation=swath.create_group('Geolocation Fields')
+		dataFields=swath.create_group('Data Fields')
+		attributes=outfile.create_group('HDFEOS/ADDITIONAL/FILE_ATTRIBUTES').attrs
+		attributes['InstrumentName']=np.bytes_('OMI')
+		attributes['ProcessLevel']=np.bytes_('2')
+		attributes['GranuleMonth']=np.array([np.datetime64(start,'M').astype(int)%12+1],dtype=np.int32)
+
+		lat,lon=_geolocation(scanlines,pixels,start_lon)
+		_add_sds(geolocation,'Latitude',lat,'deg',(-90.0,90.0),FLOAT_FILL,chunks)
+		_add_sds(geolocation,'Longitude',lon,'deg',(-180.0,180.0),FLOAT_FILL,chunks)
+		first=(np.datetime64(start,'s')-TAI93_EPOCH).astype(np.float64)
+		scan_time=first+np.arange(scanlines)*SCAN_SECONDS+random.uniform(0,0.5,scanlines)
+		_add_sds(geolocation,'Time',scan_time,'s',None,FLOAT_FILL,(chunks[0],))
+
+		#a smooth field with noise, so the maps and neighborhoods look like data
+		shape=(scanlines,pixels)
+		pattern=0.5+0.5*np.sin(np.radians(lat*3.0))*np.cos(np.radians(lon*2.0))
+		for name,dtype,units,valid_range,(low,high) in FIELDS[product]:
+			values=low+(high-low)*np.clip(pattern+random.normal(0,0.15,shape),0,1)
+			values=values.astype(dtype)
+			values[random.random(shape)<fill_fraction]=FLOAT_FILL
+			_add_sds(dataFields,name,values,units,valid_range,FLOAT_FILL,chunks)
+
+		#quality flags: bit 0 is the summary flag, set for about one pixel in five
+		flags=(random.random(shape)<0.2).astype(np.uint16)|(random.integers(0,8,shape).astype(np.uint16)<<1)
+		flags[random.random(shape)<fill_fraction/4]=65535
+		_add_sds(dataFields,QUALITY_FIELDS[product],flags,'NoUnits',None,65535,chunks)
+		#row anomaly: a few rows are affected for the whole orbit
+		xtrack=np.zeros(shape,dtype=np.uint8)
+		xtrack[:,random.choice(pixels,max(1,pixels//10),replace=False)]=1
+		_add_sds(dataFields,'XTrackQualityFlags',xtrack,'NoUnits',None,255,chunks)
+	return FILE_NAME
+
+def generate_granules(directory,count=1,products=('NO2',),scanlines=1644,pixels=60,start='2019-05-01T00:12:00',seed=0):
+	'''
+	Writes consecutive orbits of each product to a folder and lists them in its fileList.txt.
+
+	Returns
+	-------
+	file_names : list of str
+		Paths of the granules, in the order they are listed
+	'''
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	file_names=[]
+	for product in products:
+		for i in range(count):
+			orbit_start=np.datetime64(start,'s')+np.timedelta64(int(i*ORBIT_MINUTES*60),'s')
+			FILE_NAME=os.path.join(directory,granule_name(product,orbit_start,78650+i))
+			#each orbit is about 25 degrees further west
+			write_granule(FILE_NAME,product,scanlines,pixels,orbit_start,(-24.7*i+180.0)%360.0-180.0,seed=seed+i)
+			file_names.append(FILE_NAME)
+	with open(os.path.join(directory,'fileList.txt'),'w') as fileList:
+		fileList.write('\n'.join(os.path.abspath(FILE_NAME) for FILE_NAME in file_names)+'\n')
+	return file_names
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Write synthetic OMNO2/OMSO2 granules.')
+	parser.add_argument('--out',default='synthetic',help='folder to write to (default synthetic)')
+	parser.add_argument('--count',type=int,default=1,help='orbits per product (default 1)')
+	parser.add_argument('--product',nargs='+',choices=sorted(SWATHS),default=['NO2'],help='products to write (default NO2)')
+	parser.add_argument('--scanlines',type=int,default=1644,help='scanlines per granule (default 1644)')
+	parser.add_argument('--pixels',type=int,default=60,help='cross-track pixels (default 60)')
+	parser.add_argument('--start',default='2019-05-01T00:12:00',help='time of the first orbit (default 2019-05-01T00:12:00)')
+	parser.add_argument('--seed',type=int,default=0,help='random seed (default 0)')
+	options=parser.parse_args(argv)
+	file_names=generate_granules(options.out,options.count,options.product,options.scanlines,options.pixels,options.start,options.seed)
+	print('Wrote',len(file_names),'granules to',options.out)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+'''
+Module: omi_batch.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To run the OMI NO2/SO2 tools over many granules without prompts, optionally in
+parallel worker processes
+
+Examples:
+	python omi_batch.py dump --yes --workers 4
+	python omi_batch.py stats 'data/OMI-Aura_L2-OMNO2_2019m05*.he5' --workers 8 --unordered
+	python omi_batch.py location --lat 38.9 --lon -77.0 --list fileList.txt --json results.json
+	python omi_batch.py location --lat 38.9 40.7 34.1 --lon -77.0 -74.0 -118.2 --yes --catalog omi_catalog.sqlite
+	python omi_batch.py location --lat 38.9 --lon -77.0 --windows 3 5 9 --edge pad --yes
+	python omi_batch.py map --yes --workers 4
+	python omi_batch.py map --yes --workers 8 --raster
+	python omi_batch.py region --bbox 35 45 -80 -70 --yes --catalog omi_catalog.sqlite
+	python omi_batch.py polygons --polygons counties.geojson --name-property NAME --yes --workers 4
+	python omi_batch.py stats --yes --quality
+	python omi_batch.py dump --yes --workers 4 --instrument timing.csv
+	python omi_batch.py stats --yes --cache /scratch/omi_cache
+
+Inputs are glob patterns and/or text files listing one granule per line (fileList.txt by
+default). Each granule is processed on its own: an error in one file is reported and the
+run carries on with the rest.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import glob
+import json
+import os
+import sys
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from omi_instrument import add_records, enable, granule_label, reset, stage, take_records
+
+def _dump(FILE_NAME,options):
+	from read_omi_no2_so2_and_dump_ascii import dump_granule
+	return {'outfile':dump_granule(FILE_NAME,options.format,options.quality)}
+
+def _stats(FILE_NAME,options):
+	from read_and_map_omi_no2_so2 import granule_statistics
+	return granule_statistics(FILE_NAME,quality=options.quality)
+
+def _map(FILE_NAME,options):
+	from read_and_map_omi_no2_so2 import map_granule
+	pngfile='{0}.png'.format(FILE_NAME[:-3])
+	map_granule(FILE_NAME,pngfile=pngfile,quality=options.quality,raster=options.raster)
+	return {'pngfile':pngfile}
+
+def _location(FILE_NAME,options):
+	from read_omi_no2_so2_at_a_location import location_report, locations_report
+	if len(options.lat) == 1:
+		return location_report(FILE_NAME,options.lat[0],options.lon[0],options.windows,options.edge,options.quality)
+	return locations_report(FILE_NAME,options.lat,options.lon,options.windows,options.edge,options.quality)
+
+def _region(FILE_NAME,options):
+	from omi_subset import read_subset
+	subset=read_subset(FILE_NAME,options.bbox,catalog=options.catalog and _open_catalog(options.catalog),quality=options.quality)
+	if subset is None:
+		return {'count':0}
+	values=subset[subset['SDS_NAME']][subset['inside']]
+	count=int(np.count_nonzero(~np.isnan(values)))
+	if count == 0:
+		return {'count':0}
+	return {'count':count,'average':float(np.nanmean(values)),'median':float(np.nanmedian(values)),'stdev':float(np.nanstd(values)),
+		'window':[subset['window'][0].start,subset['window'][0].stop,subset['window'][1].start,subset['window'][1].stop]}
+
+_region_sets={}
+def _polygons(FILE_NAME,options):
+	from omi_regions import RegionSet, region_report
+	#each process reads the polygons once and keeps their pixel assignments between granules
+	key=(options.polygons,options.name_property)
+	if key not in _region_sets:
+		_region_sets[key]=RegionSet.from_geojson(options.polygons,options.name_property)
+	return region_report(FILE_NAME,_region_sets[key],options.quality)
+
+_catalogs={}
+def _open_catalog(path):
+	#one catalog connection per process, reused for every granule the process handles
+	from omi_catalog import Catalog
+	if path not in _catalogs:
+		_catalogs[path]=Catalog(path)
+	return _catalogs[path]
+
+#per-granule work that can be run by name from the command line
+TASKS={'dump':_dump,'stats':_stats,'map':_map,'location':_location,'region':_region,'polygons':_polygons}
+
+def expand_inputs(inputs,list_files=()):
+	'''
+	Builds the list of granules to process.
+
+	Parameters
+	----------
+	inputs : list of str
+		Granule paths or glob patterns
+	list_files : list of str
+		Text files naming one granule per line (blank lines are ignored)
+
+	Returns
+	-------
+	file_names : list of str
+		Granule paths in the order given, without duplicates
+	'''
+	file_names=[]
+	for list_file in list_files:
+		with open(list_file,'r') as fileList:
+			file_names.extend(line.strip() for line in fileList if line.strip())
+	for pattern in inputs:
+		matches=sorted(glob.glob(pattern))
+		#a pattern that matches nothing is kept so that it is reported as a missing file
+		file_names.extend(matches if matches else [pattern])
+	seen=set()
+	return [name for name in file_names if not (name in seen or seen.add(name))]
+
+def run_task(task,FILE_NAME,options):
+	'''
+	Runs one task on one granule, turning any error into a result instead of stopping the run.
+
+	Returns
+	-------
+	result : dict
+		file, ok, and either the task's result or the error message
+	'''
+	try:
+		with granule_label(FILE_NAME),stage(task):
+			return {'file':FILE_NAME,'ok':True,'result':TASKS[task](FILE_NAME,options)}
+	except Exception as error:
+		return {'file':FILE_NAME,'ok':False,'error':'{0}: {1}'.format(type(error).__name__,error),
+			'traceback':traceback.format_exc()}
+
+def _pool_task(task,FILE_NAME,options):
+	#runs in a worker process; its instrumentation records go back with the result
+	result=run_task(task,FILE_NAME,options)
+	result['instrument']=take_records()
+	return result
+
+def run_batch(task,file_names,options,workers=1,ordered=True):
+	'''
+	Runs a task over many granules, in a process pool when workers > 1.
+
+	Parameters
+	----------
+	task : str
+		Name of the task in TASKS
+	file_names : list of str
+		Granules to process
+	options : argparse.Namespace
+		Task options (format, lat, lon, ...)
+	workers : int
+		Number of worker processes; 1 runs everything in this process
+	ordered : bool
+		Yield results in input order (True) or as soon as each granule finishes (False)
+
+	Yields
+	------
+	result : dict
+		The output of run_task for each granule
+	'''
+	if workers <= 1:
+		for FILE_NAME in file_names:
+			yield run_task(task,FILE_NAME,options)
+		return
+	with ProcessPoolExecutor(max_workers=workers,initializer=reset) as pool:
+		futures=[pool.submit(_pool_task,task,FILE_NAME,options) for FILE_NAME in file_names]
+		for future in (futures if ordered else as_completed(futures)):
+			result=future.result()
+			add_records(result.pop('instrument'))
+			yield result
+
+def _to_json(value):
+	#numpy scalars and arrays in task results are written as plain numbers and lists
+	if hasattr(value,'tolist'):
+		return value.tolist()
+	return str(value)
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Run an OMI NO2/SO2 tool over many granules.')
+	parser.add_argument('task',choices=sorted(TASKS),help='per-granule work to run')
+	parser.add_argument('inputs',nargs='*',help='granule paths or glob patterns')
+	parser.add_argument('--list',action='append',default=[],help='text file listing granules (default: fileList.txt when no inputs are given)')
+	parser.add_argument('--yes','-y',action='store_true',help='process every granule without asking')
+	parser.add_argument('--workers','-j',type=int,default=1,help='number of worker processes (default 1)')
+	parser.add_argument('--unordered',action='store_true',help='report results as they finish instead of in input order')
+	parser.add_argument('--json',help='also write all results to this JSON file')
+	parser.add_argument('--format',default='txt',help='output format for dump (txt, csv, parquet or arrow)')
+	parser.add_argument('--quality',action='store_true',help='leave out pixels that fail the product\'s quality flags (see omi_quality.py)')
+	parser.add_argument('--raster',action='store_true',help='map: draw swaths rasterized onto an image grid, reusing one map per worker (see omi_render.py)')
+	parser.add_argument('--instrument',help='write per-stage timing, bytes read and memory records to this JSON (or .csv) file (see omi_instrument.py)')
+	parser.add_argument('--catalog',help='footprint catalog (see omi_catalog.py) used to skip granules that cannot match the query')
+	parser.add_argument('--cache',help='directory of memory-mapped decoded arrays reused by later runs (see omi_cache.py)')
+	parser.add_argument('--cache-mb',type=float,help='size cap of the cache in megabytes (default 2048)')
+	parser.add_argument('--start',help='with --catalog, only granules with scans on or after this time (e.g. 2019-05-01)')
+	parser.add_argument('--end',help='with --catalog, only granules with scans on or before this time')
+	parser.add_argument('--lat',type=float,nargs='+',help='latitude(s) for location (Deg. N)')
+	parser.add_argument('--lon',type=float,nargs='+',help='longitude(s) for location, one per latitude (Deg. E)')
+	parser.add_argument('--windows',type=int,nargs='+',default=[3,5],help='odd window sizes for location statistics (default 3 5)')
+	parser.add_argument('--edge',choices=('shift','pad'),default='shift',help='windows at the swath edge are shifted inside it (default) or padded with missing pixels')
+	parser.add_argument('--bbox',type=float,nargs=4,metavar=('MIN_LAT','MAX_LAT','MIN_LON','MAX_LON'),help='region for region (only that part of each granule is read)')
+	parser.add_argument('--polygons',help='GeoJSON file of regions for polygons (see omi_regions.py)')
+	parser.add_argument('--name-property',default='name',help='feature property naming each polygon (default name)')
+	options=parser.parse_args(argv)
+	if options.task == 'location' and (options.lat is None or options.lon is None or len(options.lat) != len(options.lon)):
+		parser.error('location needs --lat and --lon with the same number of values')
+	if any(size < 1 or size%2 == 0 for size in options.windows):
+		parser.error('--windows must be positive odd numbers')
+	if options.task == 'region' and options.bbox is None:
+		parser.error('region needs --bbox')
+	if options.task == 'polygons' and options.polygons is None:
+		parser.error('polygons needs --polygons')
+
+	if options.cache:
+		#worker processes inherit the environment, so every tool picks up the same cache
+		os.environ['OMI_CACHE_DIR']=options.cache
+	if options.cache_mb is not None:
+		os.environ['OMI_CACHE_MB']=str(options.cache_mb)
+	if options.instrument:
+		os.environ['OMI_INSTRUMENT']=options.instrument
+		enable(options.instrument,os.environ.get('OMI_INSTRUMENT_MEMORY','1') != '0')
+
+	list_files=options.list or ([] if options.inputs else ['fileList.txt'])
+	try:
+		file_names=expand_inputs(options.inputs,list_files)
+	except OSError as error:
+		print('Could not read the list of files:',error)
+		return 2
+	if options.catalog:
+		#select candidate granules from their stored footprints before any of them is opened
+		from omi_catalog import Catalog
+		catalog=Catalog(options.catalog)
+		points=list(zip(options.lat,options.lon)) if options.task == 'location' else None
+		bbox=options.bbox if options.task == 'region' else None
+		file_names=catalog.query(file_names,points=points,bbox=bbox,start=options.start,end=options.end)
+		catalog.close()
+	if not options.yes:
+		#keep the interactive behaviour of the single-file scripts unless --yes is given
+		selected=[]
+		for FILE_NAME in file_names:
+			user_input=input('\nWould you like to process\n' + FILE_NAME + '\n\n(Y/N)')
+			if(user_input == 'N' or user_input == 'n'):
+				print('Skipping...')
+			else:
+				selected.append(FILE_NAME)
+		file_names=selected
+
+	results=[]
+	failed=0
+	for result in run_batch(options.task,file_names,options,options.workers,not options.unordered):
+		results.append(result)
+		if result['ok']:
+			print('OK    ',result['file'],json.dumps(result['result'],default=_to_json))
+		else:
+			failed+=1
+			print('FAILED',result['file'],result['error'])
+	print('\n{0} of {1} files processed successfully.'.format(len(results)-failed,len(results)))
+	if options.json:
+		with open(options.json,'w') as outfile:
+			json.dump(results,outfile,default=_to_json,indent=1)
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+'''
+Module: omi_binning.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To bin OMI NO2/SO2 swath pixels onto a regular lat/lon grid and composite many
+granules into daily, monthly or whole-period Level-3 style products
+
+A GridAccumulator keeps three arrays the size of the grid: the sum, the count and the sum
+of squares of the values that fell in each cell. Adding a granule is a few np.bincount
+calls, and two accumulators on the same grid are merged by adding their arrays, so a month
+of orbits can be composited one granule at a time, or split across worker processes and
+merged at the end, without ever holding more than one granule in memory per worker.
+
+Example:
+	python omi_binning.py fileList.txt --resolution 0.25 --period day --workers 4 --prefix OMNO2_L3
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from omi_instrument import add_records, enable, granule_label, reset, stage, take_records
+from omi_prefetch import prefetch
+
+class LatLonGrid(object):
+	'''
+	Regular lat/lon grid.
+
+	Parameters
+	----------
+	resolution : float
+		Cell size in degrees
+	bounds : (min_lat, max_lat, min_lon, max_lon)
+		Extent of the grid (global by default)
+	'''
+	def __init__(self,resolution=0.25,bounds=(-90.0,90.0,-180.0,180.0)):
+		self.resolution=float(resolution)
+		self.bounds=tuple(float(bound) for bound in bounds)
+		min_lat,max_lat,min_lon,max_lon=self.bounds
+		self.shape=(int(round((max_lat-min_lat)/self.resolution)),int(round((max_lon-min_lon)/self.resolution)))
+
+	def __eq__(self,other):
+		return isinstance(other,LatLonGrid) and self.resolution == other.resolution and self.bounds == other.bounds
+
+	def __ne__(self,other):
+		return not self == other
+
+	@property
+	def lat(self):
+		'''Latitude of the centre of each row.'''
+		return self.bounds[0]+(np.arange(self.shape[0])+0.5)*self.resolution
+
+	@property
+	def lon(self):
+		'''Longitude of the centre of each column.'''
+		return self.bounds[2]+(np.arange(self.shape[1])+0.5)*self.resolution
+
+	def cell_index(self,lat,lon):
+		'''
+		Flat index of the grid cell holding each location, or -1 outside the grid.
+
+		Parameters
+		----------
+		lat, lon : numpy.ndarray
+			Locations (degrees), any shape
+
+		Returns
+		-------
+		index : numpy.ndarray
+			int64 array with the shape of lat
+		'''
+		min_lat,max_lat,min_lon,max_lon=self.bounds
+		lat=np.asarray(lat,dtype=np.float64)
+		lon=np.asarray(lon,dtype=np.float64)
+		with np.errstate(invalid='ignore'):
+			rows=np.floor((lat-min_lat)/self.resolution)
+			cols=np.floor((lon-min_lon)/self.resolution)
+			#locations exactly on the upper edge belong to the last row/column
+			rows[lat == max_lat]=self.shape[0]-1
+			cols[lon == max_lon]=self.shape[1]-1
+			inside=(rows>=0)&(rows<self.shape[0])&(cols>=0)&(cols<self.shape[1])
+		index=np.full(lat.shape,-1,dtype=np.int64)
+		index[inside]=rows[inside].astype(np.int64)*self.shape[1]+cols[inside].astype(np.int64)
+		return index
+
+class GridAccumulator(object):
+	'''
+	Per-cell sum, count and sum of squares of binned values.
+
+	Parameters
+	----------
+	grid : LatLonGrid
+		Grid to bin onto
+	'''
+	def __init__(self,grid):
+		self.grid=grid
+		size=grid.shape[0]*grid.shape[1]
+		self.sum=np.zeros(size)
+		self.count=np.zeros(size,dtype=np.int64)
+		self.sumsq=np.zeros(size)
+
+	def add(self,lat,lon,values,mask=None):
+		'''
+		Bins the finite values of one swath (or any set of pixels).
+
+		Parameters
+		----------
+		lat, lon, values : numpy.ndarray
+			Pixel locations and decoded values, all the same shape (NaN values are skipped)
+		mask : numpy.ndarray, optional
+			Boolean array, True for the pixels to use
+		'''
+		values=np.asarray(values,dtype=np.float64).ravel()
+		index=self.grid.cell_index(lat,lon).ravel()
+		use=(index>=0)&np.isfinite(values)
+		if mask is not None:
+			use&=np.asarray(mask,dtype=bool).ravel()
+		index=index[use]
+		values=values[use]
+		size=self.count.size
+		self.count+=np.bincount(index,minlength=size)
+		self.sum+=np.bincount(index,weights=values,minlength=size)
+		self.sumsq+=np.bincount(index,weights=values*values,minlength=size)
+		return self
+
+	def merge(self,other):
+		'''
+		Adds the totals of another accumulator on the same grid to this one.
+		'''
+		if other.grid != self.grid:
+			raise ValueError('Cannot merge accumulators on different grids')
+		self.sum+=other.sum
+		self.count+=other.count
+		self.sumsq+=other.sumsq
+		return self
+
+	def mean(self):
+		'''Mean of each cell as a 2-D array (NaN where no pixel fell).'''
+		with np.errstate(invalid='ignore',divide='ignore'):
+			return (self.sum/self.count).reshape(self.grid.shape)
+
+	def std(self):
+		'''Standard deviation of each cell (population, like np.nanstd) as a 2-D array.'''
+		with np.errstate(invalid='ignore',divide='ignore'):
+			mean=self.sum/self.count
+			variance=np.maximum(self.sumsq/self.count-mean*mean,0)
+		return np.sqrt(variance).reshape(self.grid.shape)
+
+	def counts(self):
+		'''Number of pixels in each cell as a 2-D array.'''
+		return self.count.reshape(self.grid.shape)
+
+	def save(self,path):
+		'''Saves the totals and the grid to a .npz file.'''
+		np.savez_compressed(path,sum=self.sum,count=self.count,sumsq=self.sumsq,
+			resolution=self.grid.resolution,bounds=np.array(self.grid.bounds),
+			lat=self.grid.lat,lon=self.grid.lon,mean=self.mean(),std=self.std())
+
+	@classmethod
+	def load(cls,path):
+		'''Reads an accumulator written by save.'''
+		saved=np.load(path)
+		accumulator=cls(LatLonGrid(float(saved['resolution']),tuple(saved['bounds'])))
+		accumulator.sum[:]=saved['sum']
+		accumulator.count[:]=saved['count']
+		accumulator.sumsq[:]=saved['sumsq']
+		return accumulator
+
+#how granules are grouped into composites: by the date of their first scan
+PERIODS={'day':'datetime64[D]','month':'datetime64[M]','all':None}
+
+def granule_period(scan_dates,period):
+	'''
+	Label of the composite period ('2019-05-01', '2019-05' or 'all') a granule belongs to,
+	from the datetime64 dates of its scanlines (None if it has no valid date).
+	'''
+	if PERIODS[period] is None:
+		return 'all'
+	times=scan_dates[~np.isnat(scan_dates)]
+	if times.size == 0:
+		return None
+	return str(times.min().astype(PERIODS[period]))
+
+def bin_granules(file_names,grid,period='all',quality=False,depth=2,max_bytes=None):
+	'''
+	Bins the main SDS of several granules, one granule in memory at a time.
+
+	Parameters
+	----------
+	file_names : list of str
+		OMI (or TROPOMI) NO2/SO2 granules
+	grid : LatLonGrid
+		Grid to bin onto
+	period : str
+		One of PERIODS
+	quality : bool
+		Leave out pixels that fail the product's quality rules (see omi_quality)
+	depth, max_bytes :
+		How many granules, and at most how many bytes of them, are read ahead (see
+		omi_prefetch.prefetch)
+
+	Returns
+	-------
+	accumulators : dict
+		GridAccumulator per period label
+	errors : list of (str, str)
+		Files that could not be binned and why
+	'''
+	from omi_reader import read_swath
+	from omi_subset import read_subset
+	regional=grid.bounds != (-90.0,90.0,-180.0,180.0)
+	accumulators={}
+	errors=[]
+	def load(FILE_NAME):
+		if regional:
+			#only the window of the swath that covers the grid is read
+			swath=read_subset(FILE_NAME,grid.bounds,quality=quality)
+			if swath is not None:
+				swath['dataArray']=swath[swath['SDS_NAME']]
+			return swath
+		return read_swath(FILE_NAME,quality=quality)
+	#the next granules are read in a background thread while this one is binned
+	for FILE_NAME,swath,error in prefetch(file_names,load,depth,max_bytes):
+		with granule_label(FILE_NAME):
+			if error is not None:
+				errors.append((FILE_NAME,'{0}: {1}'.format(type(error).__name__,error)))
+				continue
+			if swath is None:
+				continue
+			label=granule_period(swath['scan_dates'],period)
+			if label is None:
+				errors.append((FILE_NAME,'no valid scan time'))
+				continue
+			if label not in accumulators:
+				accumulators[label]=GridAccumulator(grid)
+			with stage('bin'):
+				accumulators[label].add(swath['lat'],swath['lon'],swath['dataArray'])
+	return accumulators,errors
+
+def _bin_worker(arguments):
+	#the instrumentation records of the worker go back with its accumulators
+	accumulators,errors=bin_granules(*arguments)
+	return accumulators,errors,take_records()
+
+def composite(file_names,grid,period='all',workers=1,quality=False,depth=2,max_bytes=None):
+	'''
+	Bins many granules, splitting them across worker processes and merging the results.
+
+	Returns
+	-------
+	accumulators : dict
+		GridAccumulator per period label
+	errors : list of (str, str)
+		Files that could not be binned and why
+	'''
+	if workers <= 1 or len(file_names) < 2:
+		return bin_granules(file_names,grid,period,quality,depth,max_bytes)
+	#each worker composites an interleaved share of the files and sends back one accumulator per period
+	shares=[(file_names[i::workers],grid,period,quality,depth,max_bytes) for i in range(workers) if file_names[i::workers]]
+	accumulators={}
+	errors=[]
+	with ProcessPoolExecutor(max_workers=len(shares),initializer=reset) as pool:
+		for partial,partial_errors,records in pool.map(_bin_worker,shares):
+			errors.extend(partial_errors)
+			add_records(records)
+			for label,accumulator in partial.items():
+				if label in accumulators:
+					accumulators[label].merge(accumulator)
+				else:
+					accumulators[label]=accumulator
+	return accumulators,errors
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Composite OMI NO2/SO2 granules onto a regular lat/lon grid.')
+	parser.add_argument('lists',nargs='*',default=['fileList.txt'],help='text files listing granules (default fileList.txt)')
+	parser.add_argument('--resolution',type=float,default=0.25,help='grid cell size in degrees (default 0.25)')
+	parser.add_argument('--bbox',type=float,nargs=4,default=(-90.0,90.0,-180.0,180.0),metavar=('MIN_LAT','MAX_LAT','MIN_LON','MAX_LON'),help='grid extent (default global)')
+	parser.add_argument('--period',choices=sorted(PERIODS),default='all',help='one composite per day, per month or for everything (default all)')
+	parser.add_argument('--workers','-j',type=int,default=1,help='number of worker processes (default 1)')
+	parser.add_argument('--prefetch',type=int,default=2,help='granules read ahead in the background, per worker (default 2, 0 for none)')
+	parser.add_argument('--prefetch-mb',type=float,help='stop reading ahead while the granules read ahead hold this many megabytes')
+	parser.add_argument('--quality',action='store_true',help='leave out pixels that fail the quality flags (see omi_quality.py)')
+	parser.add_argument('--instrument',help='write per-stage timing and memory records to this JSON (or .csv) file (see omi_instrument.py)')
+	parser.add_argument('--prefix',default='omi_l3',help='output files are named PREFIX_PERIOD.npz')
+	options=parser.parse_args(argv)
+	if options.instrument:
+		#spawned worker processes turn instrumentation on from the environment
+		os.environ['OMI_INSTRUMENT']=options.instrument
+		enable(options.instrument,os.environ.get('OMI_INSTRUMENT_MEMORY','1') != '0')
+	file_names=[]
+	for list_file in options.lists:
+		with open(list_file,'r') as fileList:
+			file_names.extend(line.strip() for line in fileList if line.strip())
+	grid=LatLonGrid(options.resolution,options.bbox)
+	accumulators,errors=composite(file_names,grid,options.period,options.workers,options.quality,
+		options.prefetch,None if options.prefetch_mb is None else options.prefetch_mb*1e6)
+	for FILE_NAME,error in errors:
+		print('FAILED',FILE_NAME,error)
+	for label in sorted(accumulators):
+		outfilename='{0}_{1}.npz'.format(options.prefix,label)
+		accumulators[label].save(outfilename)
+		print('Saved',outfilename,'with',int(accumulators[label].count.sum()),'pixels')
+	return 1 if errors else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+'''
+Module: omi_cache.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To keep decoded SDS and lat/lon arrays in a cache directory as .npy files that
+are memory-mapped on later runs, so repeated runs over the same granules skip HDF5
+decompression and only page in the pixels they use
+
+The cache is opt-in: set the OMI_CACHE_DIR environment variable (and optionally
+OMI_CACHE_MB, the size cap in megabytes, 2048 by default), or pass a FieldCache to
+omi_reader.Granule. Entries are keyed by the granule's absolute path, modification time
+and size, the field name and how it was decoded, so a changed file is never served stale
+data. When the cache grows past its cap the least recently used entries are deleted.
+
+Arrays served from the cache are read-only memory maps; copy them before changing them.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+#default size cap of the cache in megabytes
+CACHE_MB=2048
+
+class FieldCache(object):
+	'''
+	Directory of memory-mappable decoded fields with a size cap and LRU eviction.
+
+	Parameters
+	----------
+	directory : str
+		Cache directory (created if needed)
+	max_bytes : int, optional
+		Size cap (CACHE_MB megabytes by default)
+	'''
+	def __init__(self,directory,max_bytes=None):
+		self.directory=directory
+		self.max_bytes=CACHE_MB*1024*1024 if max_bytes is None else int(max_bytes)
+		self.hits=0
+		self.misses=0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def key(self,FILE_NAME,field):
+		'''
+		Cache file name of one field of one granule (changes whenever the granule changes).
+		'''
+		stat=os.stat(FILE_NAME)
+		text='\n'.join((os.path.abspath(FILE_NAME),str(stat.st_mtime_ns),str(stat.st_size),field))
+		return hashlib.sha1(text.encode()).hexdigest()+'.npy'
+
+	def get(self,FILE_NAME,field):
+		'''
+		Memory-mapped array of a cached field, or None if it is not cached.
+		'''
+		path=os.path.join(self.directory,self.key(FILE_NAME,field))
+		try:
+			array=np.load(path,mmap_mode='r')
+		except (OSError,ValueError):
+			self.misses+=1
+			return None
+		#touching the file marks it as recently used for eviction
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+		self.hits+=1
+		return array
+
+	def put(self,FILE_NAME,field,array):
+		'''
+		Stores a field and returns it memory-mapped from the cache (the array itself if it
+		cannot be stored, e.g. when it is larger than the cap).
+		'''
+		array=np.asarray(array)
+		if array.nbytes > self.max_bytes:
+			return array
+		path=os.path.join(self.directory,self.key(FILE_NAME,field))
+		#write to a temporary file and rename it, so other processes never see half a file
+		handle,temporary=tempfile.mkstemp(dir=self.directory,suffix='.tmp')
+		try:
+			with os.fdopen(handle,'wb') as outfile:
+				np.save(outfile,array)
+			os.replace(temporary,path)
+		except OSError:
+			if os.path.exists(temporary):
+				os.remove(temporary)
+			return array
+		self.evict()
+		try:
+			return np.load(path,mmap_mode='r')
+		except (OSError,ValueError):
+			return array
+
+	def get_or_compute(self,FILE_NAME,field,compute):
+		'''
+		Cached field, or compute() stored in the cache.
+		'''
+		array=self.get(FILE_NAME,field)
+		if array is None:
+			array=self.put(FILE_NAME,field,compute())
+		return array
+
+	def size(self):
+		'''Total size of the cached fields in bytes.'''
+		return sum(size for path,size,used in self._entries())
+
+	def _entries(self):
+		entries=[]
+		for name in os.listdir(self.directory):
+			if name.endswith('.npy'):
+				try:
+					stat=os.stat(os.path.join(self.directory,name))
+				except OSError:
+					continue
+				entries.append((os.path.join(self.directory,name),stat.st_size,stat.st_mtime))
+		return entries
+
+	def evict(self):
+		'''
+		Deletes the least recently used fields until the cache is under its cap.
+		'''
+		entries=sorted(self._entries(),key=lambda entry: entry[2])
+		total=sum(entry[1] for entry in entries)
+		for path,size,used in entries:
+			if total <= self.max_bytes:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				#another process may have removed it already
+				pass
+			total-=size
+
+	def clear(self):
+		'''Deletes every cached field.'''
+		for path,size,used in self._entries():
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+def default_cache():
+	'''
+	FieldCache in $OMI_CACHE_DIR (capped at $OMI_CACHE_MB megabytes), or None if the
+	variable is not set.
+	'''
+	directory=os.environ.get('OMI_CACHE_DIR')
+	if not directory:
+		return None
+	megabytes=float(os.environ.get('OMI_CACHE_MB',CACHE_MB))
+	return FieldCache(directory,int(megabytes*1024*1024))
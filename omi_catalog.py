@@ -0,0 +1,314 @@
+#!/usr/bin/python
+'''
+Module: omi_catalog.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To keep a local SQLite catalog of OMI granule footprints so that point, region and
+time queries only open the granules that can contain them
+
+For every granule the catalog stores the product (NO2/SO2, as recognized by omi_reader),
+the lat/lon range of its pixels, its first and last scan time, its list of SDS and a
+coarse footprint mask (which cells of a CELL_SIZE degree global grid its pixels fall in),
+plus the lat/lon range of each scanline for regional subsetting (see omi_subset.py). Only
+the Geolocation Fields are read to build an entry. Entries are keyed by path and refreshed whenever a file's
+modification time or size changes, so the catalog is built up as files are first seen.
+
+Example:
+	python omi_catalog.py fileList.txt --point 38.9 -77.0 --start 2019-05-01 --end 2019-06-01 > subset.txt
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import numpy as np
+from omi_reader import Granule, PRODUCTS
+
+#default location of the catalog database
+CATALOG_FILE='omi_catalog.sqlite'
+
+#size (degrees) of the cells of the footprint mask
+CELL_SIZE=2.0
+_NROWS=int(180/CELL_SIZE)
+_NCOLS=int(360/CELL_SIZE)
+
+_SCHEMA='''CREATE TABLE IF NOT EXISTS granules (
+	path TEXT PRIMARY KEY,
+	mtime REAL NOT NULL,
+	size INTEGER NOT NULL,
+	product TEXT,
+	min_lat REAL, max_lat REAL, min_lon REAL, max_lon REAL,
+	start_time TEXT, end_time TEXT,
+	sds TEXT,
+	footprint BLOB
+);
+--lat/lon range of every scanline of each granule, used by omi_subset to find a region's window
+CREATE TABLE IF NOT EXISTS row_extents (
+	path TEXT PRIMARY KEY,
+	extents BLOB
+);'''
+
+def _cells(lat,lon):
+	#footprint-mask row and column of each location
+	rows=np.clip(np.floor((np.asarray(lat,dtype=np.float64)+90)/CELL_SIZE).astype(int),0,_NROWS-1)
+	#locations on the upper edge (90N, 180E) belong to the last row/column, as in omi_binning.LatLonGrid
+	cols=np.clip(np.floor((np.asarray(lon,dtype=np.float64)+180)/CELL_SIZE).astype(int),0,_NCOLS-1)
+	return rows,cols
+
+def footprint_mask(lat,lon):
+	'''
+	Marks the footprint-mask cells that contain a pixel centre, grown by one cell on every
+	side so that locations near the edge of a pixel are not missed.
+
+	Returns
+	-------
+	mask : numpy.ndarray
+		Boolean (180/CELL_SIZE, 360/CELL_SIZE) array
+	'''
+	mask=np.zeros((_NROWS,_NCOLS),dtype=bool)
+	rows,cols=_cells(lat,lon)
+	mask[rows,cols]=True
+	#longitude wraps around, latitude does not
+	mask=mask|np.roll(mask,1,axis=1)|np.roll(mask,-1,axis=1)
+	mask[1:]|=mask[:-1].copy()
+	mask[:-1]|=mask[1:].copy()
+	return mask
+
+def read_footprint(FILE_NAME):
+	'''
+	Reads the catalog entry of one granule (Geolocation Fields and SDS names only).
+
+	Returns
+	-------
+	entry : dict
+		product, min_lat, max_lat, min_lon, max_lon, start_time, end_time, sds and footprint
+		(the packed footprint mask) and row_extents (see row_extents); product is None if
+		the file is not a recognized NO2/SO2 granule
+	'''
+	try:
+		granule=Granule(FILE_NAME)
+	except ValueError:
+		return {'product':None}
+	try:
+		lat=granule.lat
+		lon=granule.lon
+		times=granule.scan_dates()
+		sds=sorted(granule.sds_names)
+	finally:
+		granule.close()
+	product=granule.schema.product
+	#fill values (-1.0E30) are left out of the ranges
+	valid=np.isfinite(lat)&np.isfinite(lon)&(np.abs(lat)<=90)&(np.abs(lon)<=180)
+	times=times[~np.isnat(times)]
+	if not valid.any():
+		return {'product':product,'sds':sds}
+	return {'product':product,
+		'min_lat':float(lat[valid].min()),'max_lat':float(lat[valid].max()),
+		'min_lon':float(lon[valid].min()),'max_lon':float(lon[valid].max()),
+		'start_time':str(times.min()) if times.size else None,
+		'end_time':str(times.max()) if times.size else None,
+		'sds':sds,
+		'footprint':np.packbits(footprint_mask(lat[valid],lon[valid])).tobytes(),
+		'row_extents':row_extents(lat,lon)}
+
+def row_extents(lat,lon):
+	'''
+	Latitude and longitude range of each scanline, ignoring fill values.
+
+	Parameters
+	----------
+	lat, lon : numpy.ndarray
+		2-D (scanline, cross-track) pixel latitudes and longitudes
+
+	Returns
+	-------
+	extents : numpy.ndarray
+		float32 (scanline, 4) array of min_lat, max_lat, min_lon, max_lon (NaN for scanlines
+		without a valid pixel)
+	'''
+	valid=np.isfinite(lat)&np.isfinite(lon)&(np.abs(lat)<=90)&(np.abs(lon)<=180)
+	extents=np.full((lat.shape[0],4),np.nan,dtype=np.float32)
+	rows=valid.any(axis=1)
+	if rows.any():
+		lat=np.where(valid,lat,np.nan)[rows]
+		lon=np.where(valid,lon,np.nan)[rows]
+		extents[rows]=np.column_stack((np.nanmin(lat,axis=1),np.nanmax(lat,axis=1),np.nanmin(lon,axis=1),np.nanmax(lon,axis=1)))
+	return extents
+
+def _time_text(value):
+	#accepts strings, datetime64 or datetime values and returns the ISO text stored in the catalog
+	if value is None:
+		return None
+	return str(np.datetime64(value,'s'))
+
+class Catalog(object):
+	'''
+	SQLite catalog of granule footprints.
+
+	Parameters
+	----------
+	path : str
+		Database file (created if it does not exist)
+	'''
+	def __init__(self,path=CATALOG_FILE):
+		self.path=path
+		self.connection=sqlite3.connect(path)
+		self.connection.executescript(_SCHEMA)
+
+	def close(self):
+		self.connection.close()
+
+	def update(self,file_names):
+		'''
+		Adds new granules and refreshes changed ones. Files that cannot be read are reported
+		on stderr and left out.
+
+		Returns
+		-------
+		added : int
+			Number of entries (re)built
+		'''
+		added=0
+		for FILE_NAME in file_names:
+			try:
+				stat=os.stat(FILE_NAME)
+				row=self.connection.execute('SELECT mtime,size FROM granules WHERE path=?',(FILE_NAME,)).fetchone()
+				if row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size:
+					continue
+				entry=read_footprint(FILE_NAME)
+			except (OSError,KeyError) as error:
+				print('Could not catalog',FILE_NAME,':',error,file=sys.stderr)
+				continue
+			self.connection.execute('INSERT OR REPLACE INTO granules VALUES (?,?,?,?,?,?,?,?,?,?,?,?)',
+				(FILE_NAME,stat.st_mtime,stat.st_size,entry['product'],
+				entry.get('min_lat'),entry.get('max_lat'),entry.get('min_lon'),entry.get('max_lon'),
+				entry.get('start_time'),entry.get('end_time'),json.dumps(entry.get('sds',[])),entry.get('footprint')))
+			if 'row_extents' in entry:
+				self.connection.execute('INSERT OR REPLACE INTO row_extents VALUES (?,?)',(FILE_NAME,entry['row_extents'].tobytes()))
+			added+=1
+		self.connection.commit()
+		return added
+
+	def entry(self,FILE_NAME):
+		'''
+		Returns the stored entry of one granule as a dict (None if it is not cataloged).
+		'''
+		cursor=self.connection.execute('SELECT * FROM granules WHERE path=?',(FILE_NAME,))
+		row=cursor.fetchone()
+		if row is None:
+			return None
+		entry=dict(zip([column[0] for column in cursor.description],row))
+		entry['sds']=json.loads(entry['sds'])
+		return entry
+
+	def row_extents(self,FILE_NAME):
+		'''
+		Returns the cached lat/lon range of each scanline of a granule (see row_extents),
+		cataloging the granule first if needed; None if it has no valid pixels.
+		'''
+		self.update([FILE_NAME])
+		row=self.connection.execute('SELECT extents FROM row_extents WHERE path=?',(FILE_NAME,)).fetchone()
+		if row is None:
+			return None
+		return np.frombuffer(row[0],dtype=np.float32).reshape(-1,4)
+
+	def query(self,file_names=None,points=None,bbox=None,start=None,end=None,product=None):
+		'''
+		Selects the granules that can contain the given locations, region and time range.
+
+		Parameters
+		----------
+		file_names : list of str, optional
+			Limit the search to these granules (they are added to the catalog first)
+		points : list of (lat, lon), optional
+			Keep granules whose footprint contains at least one of the locations
+		bbox : (min_lat, max_lat, min_lon, max_lon), optional
+			Keep granules whose footprint overlaps the region (a box with max_lon < min_lon
+			crosses the antimeridian)
+		start, end : str or numpy.datetime64, optional
+			Keep granules with scans in this time range
+		product : str, optional
+			'NO2' or 'SO2'
+
+		Returns
+		-------
+		file_names : list of str
+			Candidate granules, in the order given (or by start time)
+		'''
+		if file_names is not None:
+			self.update(file_names)
+		sql='SELECT path,min_lat,max_lat,min_lon,max_lon,footprint FROM granules WHERE product IS NOT NULL AND footprint IS NOT NULL'
+		arguments=[]
+		if product is not None:
+			sql+=' AND product=?'
+			arguments.append(product)
+		if start is not None:
+			sql+=' AND end_time>=?'
+			arguments.append(_time_text(start))
+		if end is not None:
+			sql+=' AND start_time<=?'
+			arguments.append(_time_text(end))
+		if bbox is not None:
+			min_lat,max_lat,min_lon,max_lon=bbox
+			if min_lon <= max_lon:
+				sql+=' AND max_lat>=? AND min_lat<=? AND max_lon>=? AND min_lon<=?'
+			else:
+				#a box crossing the antimeridian covers lon >= min_lon and lon <= max_lon
+				sql+=' AND max_lat>=? AND min_lat<=? AND (max_lon>=? OR min_lon<=?)'
+			arguments.extend([min_lat,max_lat,min_lon,max_lon])
+		sql+=' ORDER BY start_time'
+		if points is not None:
+			points=np.asarray(points,dtype=np.float64).reshape(-1,2)
+			point_cells=_cells(points[:,0],points[:,1])
+		if bbox is not None:
+			bbox_mask=np.zeros((_NROWS,_NCOLS),dtype=bool)
+			(row0,row1),(col0,col1)=_cells(bbox[:2],bbox[2:])
+			if min_lon <= max_lon:
+				bbox_mask[row0:row1+1,col0:col1+1]=True
+			else:
+				bbox_mask[row0:row1+1,col0:]=True
+				bbox_mask[row0:row1+1,:col1+1]=True
+		selected=[]
+		for path,min_lat,max_lat,min_lon,max_lon,footprint in self.connection.execute(sql,arguments):
+			mask=np.unpackbits(np.frombuffer(footprint,dtype=np.uint8))[:_NROWS*_NCOLS].reshape(_NROWS,_NCOLS).astype(bool)
+			if points is not None:
+				#a location must lie in the lat/lon range of the pixels (as the location tool requires) and in the footprint
+				inside=(points[:,0]>=min_lat)&(points[:,0]<=max_lat)&(points[:,1]>=min_lon)&(points[:,1]<=max_lon)
+				if not (inside&mask[point_cells]).any():
+					continue
+			if bbox is not None and not (mask&bbox_mask).any():
+				continue
+			selected.append(path)
+		if file_names is not None:
+			keep=set(selected)
+			return [name for name in file_names if name in keep]
+		return selected
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='List the OMI granules whose footprint and time range match a query.')
+	parser.add_argument('lists',nargs='*',default=['fileList.txt'],help='text files listing granules (default fileList.txt)')
+	parser.add_argument('--catalog',default=CATALOG_FILE,help='catalog database (default '+CATALOG_FILE+')')
+	parser.add_argument('--point',type=float,nargs=2,action='append',metavar=('LAT','LON'),help='location that must be covered (repeatable)')
+	parser.add_argument('--bbox',type=float,nargs=4,metavar=('MIN_LAT','MAX_LAT','MIN_LON','MAX_LON'),help='region that must be overlapped')
+	parser.add_argument('--start',help='start of the time range (e.g. 2019-05-01)')
+	parser.add_argument('--end',help='end of the time range')
+	parser.add_argument('--product',choices=sorted(set(schema.product for schema in PRODUCTS.values())))
+	options=parser.parse_args(argv)
+	file_names=[]
+	for list_file in options.lists:
+		with open(list_file,'r') as fileList:
+			file_names.extend(line.strip() for line in fileList if line.strip())
+	catalog=Catalog(options.catalog)
+	for FILE_NAME in catalog.query(file_names,options.point,options.bbox,options.start,options.end,options.product):
+		print(FILE_NAME)
+	catalog.close()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,359 @@
+#!/usr/bin/python
+'''
+Module: omi_climatology.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To build a multi-year per-cell climatology (count, mean, standard deviation and
+approximate quantiles) of OMI NO2/SO2 one granule at a time, and to compute the anomalies
+of new granules against it
+
+A Climatology keeps, for every cell of a LatLonGrid, the running count, mean and sum of
+squared differences from the mean (Welford's method, updated for a whole granule at a time
+and merged with Chan's formula, so it stays accurate over years of data), and a histogram
+of the values with a fixed number of bins between two limits, from which medians and other
+quantiles are estimated. Memory does not grow with the number of granules: the histogram
+takes cells x bins x 4 bytes (about 33 MB for a 1 degree global grid with 128 bins).
+
+The state, including the names of the granules already added, is saved to a checkpoint
+file, so a run that stops can be started again and skips what it has done.
+
+Examples:
+	python omi_climatology.py update fileList.txt --checkpoint may_no2.npz --months 5 --range -1e15 2e16
+	python omi_climatology.py export --checkpoint may_no2.npz --out may_no2_climatology.npz
+	python omi_climatology.py anomaly new_granules.txt --checkpoint may_no2.npz
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import os
+import sys
+import numpy as np
+from omi_binning import LatLonGrid
+
+class Climatology(object):
+	'''
+	Per-cell running statistics and value histograms.
+
+	Parameters
+	----------
+	grid : LatLonGrid
+		Grid to aggregate onto
+	value_range : (float, float)
+		Limits of the histogram; values outside go into the first or last bin
+	bins : int
+		Number of histogram bins (0 for no quantiles)
+	months : sequence of int, optional
+		Only granules whose first scan is in one of these months (1-12) are added
+	'''
+	def __init__(self,grid,value_range=(0.0,1.0),bins=128,months=None):
+		self.grid=grid
+		size=grid.shape[0]*grid.shape[1]
+		self.count=np.zeros(size,dtype=np.int64)
+		self.mean=np.zeros(size)
+		self.m2=np.zeros(size)
+		self.edges=np.linspace(value_range[0],value_range[1],bins+1) if bins else np.zeros(0)
+		self.histogram=np.zeros((size,bins),dtype=np.uint32)
+		self.months=sorted(int(month) for month in months) if months else []
+		self.granules=[]
+		#SDS the climatology is made of (set by the first granule added by update)
+		self.SDS_NAME=''
+
+	def _combine(self,index,count,mean,m2):
+		#Chan's formula: merges (count, mean, m2) of a batch into the cells in index
+		total=self.count[index]+count
+		delta=mean-self.mean[index]
+		self.mean[index]+=delta*count/total
+		self.m2[index]+=m2+delta*delta*self.count[index]*count/total
+		self.count[index]=total
+
+	def add(self,lat,lon,values,mask=None):
+		'''
+		Adds the finite values of one swath (or any set of pixels).
+
+		Parameters
+		----------
+		lat, lon, values : numpy.ndarray
+			Pixel locations and decoded values, all the same shape (NaN values are skipped)
+		mask : numpy.ndarray, optional
+			Boolean array, True for the pixels to use
+		'''
+		values=np.asarray(values,dtype=np.float64).ravel()
+		index=self.grid.cell_index(lat,lon).ravel()
+		use=(index>=0)&np.isfinite(values)
+		if mask is not None:
+			use&=np.asarray(mask,dtype=bool).ravel()
+		index=index[use]
+		values=values[use]
+		if index.size == 0:
+			return self
+		#per-cell count, mean and m2 of this batch (two passes, so the batch itself is accurate)
+		cells,inverse=np.unique(index,return_inverse=True)
+		count=np.bincount(inverse)
+		mean=np.bincount(inverse,weights=values)/count
+		deviation=values-mean[inverse]
+		m2=np.bincount(inverse,weights=deviation*deviation)
+		self._combine(cells,count,mean,m2)
+		if self.edges.size:
+			bins=np.clip(np.searchsorted(self.edges,values,side='right')-1,0,self.edges.size-2)
+			flat,counts=np.unique(index*(self.edges.size-1)+bins,return_counts=True)
+			self.histogram.reshape(-1)[flat]+=counts.astype(np.uint32)
+		return self
+
+	def merge(self,other):
+		'''
+		Adds another climatology on the same grid and histogram bins to this one.
+		'''
+		if other.grid != self.grid or not np.array_equal(other.edges,self.edges):
+			raise ValueError('Cannot merge climatologies with different grids or histogram bins')
+		cells=np.flatnonzero(other.count)
+		self._combine(cells,other.count[cells],other.mean[cells],other.m2[cells])
+		self.histogram+=other.histogram
+		self.granules.extend(other.granules)
+		return self
+
+	def wants(self,scan_dates):
+		'''True if a granule with these scan dates belongs in the climatology (see months).'''
+		if not self.months:
+			return True
+		times=scan_dates[~np.isnat(scan_dates)]
+		if times.size == 0:
+			return False
+		return int(times.min().astype('datetime64[M]').astype(np.int64)%12+1) in self.months
+
+	def std(self):
+		'''Per-cell standard deviation as a 2-D array (NaN for empty cells).'''
+		with np.errstate(invalid='ignore',divide='ignore'):
+			return np.sqrt(self.m2/self.count).reshape(self.grid.shape)
+
+	def means(self):
+		'''Per-cell mean as a 2-D array (NaN for empty cells).'''
+		return np.where(self.count>0,self.mean,np.nan).reshape(self.grid.shape)
+
+	def quantile(self,q):
+		'''
+		Approximate per-cell quantile (0 to 1) from the histograms, interpolated linearly
+		within a bin, as a 2-D array (NaN for empty cells).
+
+		Raises
+		------
+		ValueError
+			If the climatology has no histogram
+		'''
+		if not self.edges.size:
+			raise ValueError('This climatology was built without a histogram (bins=0)')
+		cumulative=np.cumsum(self.histogram,axis=1,dtype=np.int64)
+		total=cumulative[:,-1]
+		target=q*total
+		#first bin whose cumulative count reaches the target
+		bin_index=np.minimum((cumulative<target[:,None]).sum(axis=1),self.edges.size-2)
+		rows=np.arange(cumulative.shape[0])
+		before=np.where(bin_index>0,cumulative[rows,bin_index-1],0)
+		in_bin=self.histogram[rows,bin_index]
+		with np.errstate(invalid='ignore',divide='ignore'):
+			fraction=np.where(in_bin>0,(target-before)/in_bin,0.5)
+		values=self.edges[bin_index]+fraction*(self.edges[bin_index+1]-self.edges[bin_index])
+		values[total == 0]=np.nan
+		return values.reshape(self.grid.shape)
+
+	def median(self):
+		'''Approximate per-cell median (see quantile).'''
+		return self.quantile(0.5)
+
+	def anomaly(self,lat,lon,values,min_count=1):
+		'''
+		Anomaly of pixels against the climatology.
+
+		Parameters
+		----------
+		lat, lon, values : numpy.ndarray
+			Pixel locations and decoded values
+		min_count : int
+			Cells with fewer values in the climatology give NaN
+
+		Returns
+		-------
+		anomaly, zscore : numpy.ndarray
+			values minus the cell mean, and that divided by the cell standard deviation
+			(NaN outside the grid, in thin cells or where the value is NaN)
+		'''
+		values=np.asarray(values,dtype=np.float64)
+		index=self.grid.cell_index(lat,lon)
+		known=index>=0
+		known[known]=self.count[index[known]]>=min_count
+		anomaly=np.full(values.shape,np.nan)
+		anomaly[known]=values[known]-self.mean[index[known]]
+		std=np.full(values.shape,np.nan)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			std[known]=np.sqrt(self.m2[index[known]]/self.count[index[known]])
+			zscore=anomaly/std
+		return anomaly,zscore
+
+	def save(self,path):
+		'''
+		Writes a checkpoint (the full state) to a .npz file. The file is replaced in one
+		step, so an interrupted save leaves the previous checkpoint intact.
+		'''
+		temporary=path+'.tmp.npz'
+		np.savez(temporary,count=self.count,mean=self.mean,m2=self.m2,edges=self.edges,histogram=self.histogram,
+			resolution=self.grid.resolution,bounds=np.array(self.grid.bounds),months=np.array(self.months,dtype=np.int64),
+			granules=np.array(self.granules,dtype=str),SDS_NAME=self.SDS_NAME)
+		os.replace(temporary,path)
+
+	@classmethod
+	def load(cls,path):
+		'''Reads a checkpoint written by save.'''
+		saved=np.load(path)
+		edges=saved['edges']
+		climatology=cls(LatLonGrid(float(saved['resolution']),tuple(saved['bounds'])),
+			(edges[0],edges[-1]) if edges.size else (0.0,1.0),max(edges.size-1,0),saved['months'].tolist())
+		climatology.edges=edges
+		climatology.count[:]=saved['count']
+		climatology.mean[:]=saved['mean']
+		climatology.m2[:]=saved['m2']
+		climatology.histogram[:]=saved['histogram']
+		climatology.granules=saved['granules'].tolist()
+		climatology.SDS_NAME=str(saved['SDS_NAME'])
+		return climatology
+
+	def export(self,path,quantiles=(0.1,0.5,0.9)):
+		'''Writes the per-cell count, mean, std and quantiles (as 2-D arrays) to a .npz file.'''
+		products={'lat':self.grid.lat,'lon':self.grid.lon,'count':self.count.reshape(self.grid.shape),
+			'mean':self.means(),'std':self.std()}
+		if self.edges.size:
+			for q in quantiles:
+				products['q{0:g}'.format(q*100)]=self.quantile(q)
+		np.savez_compressed(path,**products)
+
+def update(climatology,file_names,checkpoint=None,checkpoint_every=10,quality=False,depth=2,max_bytes=None):
+	'''
+	Adds granules to a climatology one at a time, skipping those already in it.
+
+	Parameters
+	----------
+	climatology : Climatology
+		Climatology to update
+	file_names : list of str
+		Granules to add
+	checkpoint : str, optional
+		Checkpoint file written every checkpoint_every granules and at the end
+	checkpoint_every : int
+		Granules between checkpoints
+	quality : bool
+		Leave out pixels that fail the product's quality rules (see omi_quality)
+	depth, max_bytes :
+		How many granules, and at most how many bytes of them, are read ahead (see
+		omi_prefetch.prefetch)
+
+	Returns
+	-------
+	added : int
+		Number of granules added
+	errors : list of (str, str)
+		Files that could not be added and why (including granules of another SDS than the
+		climatology's)
+	'''
+	from omi_prefetch import prefetch
+	from omi_reader import read_swath
+	done=set(climatology.granules)
+	#only granules not yet in the climatology are read (ahead, in a background thread)
+	todo=[]
+	for FILE_NAME in file_names:
+		if os.path.basename(FILE_NAME) not in done:
+			done.add(os.path.basename(FILE_NAME))
+			todo.append(FILE_NAME)
+	added=0
+	unsaved=0#granules added since the last checkpoint
+	errors=[]
+	for FILE_NAME,swath,error in prefetch(todo,lambda FILE_NAME: read_swath(FILE_NAME,quality=quality),depth,max_bytes):
+		name=os.path.basename(FILE_NAME)
+		if error is not None:
+			errors.append((FILE_NAME,'{0}: {1}'.format(type(error).__name__,error)))
+			continue
+		if climatology.SDS_NAME and swath['SDS_NAME'] != climatology.SDS_NAME:
+			errors.append((FILE_NAME,'holds '+swath['SDS_NAME']+', not '+climatology.SDS_NAME))
+			continue
+		climatology.SDS_NAME=swath['SDS_NAME']
+		if climatology.wants(swath['scan_dates']):
+			climatology.add(swath['lat'],swath['lon'],swath['dataArray'])
+			added+=1
+			unsaved+=1
+		#granules outside the chosen months are recorded too, so a resumed run skips them
+		climatology.granules.append(name)
+		if checkpoint and unsaved >= checkpoint_every:
+			climatology.save(checkpoint)
+			unsaved=0
+	if checkpoint:
+		climatology.save(checkpoint)
+	return added,errors
+
+def _read_lists(lists):
+	file_names=[]
+	for list_file in lists:
+		with open(list_file,'r') as fileList:
+			file_names.extend(line.strip() for line in fileList if line.strip())
+	return file_names
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Build an OMI NO2/SO2 climatology and compute anomalies against it.')
+	parser.add_argument('command',choices=('update','export','anomaly'),help='add granules, write the climatology products, or report anomalies of granules')
+	parser.add_argument('lists',nargs='*',default=['fileList.txt'],help='text files listing granules (default fileList.txt)')
+	parser.add_argument('--checkpoint',required=True,help='climatology state file (.npz), created by update if it does not exist')
+	parser.add_argument('--resolution',type=float,default=1.0,help='grid cell size in degrees for a new climatology (default 1)')
+	parser.add_argument('--bbox',type=float,nargs=4,default=(-90.0,90.0,-180.0,180.0),metavar=('MIN_LAT','MAX_LAT','MIN_LON','MAX_LON'),help='grid extent for a new climatology (default global)')
+	parser.add_argument('--range',type=float,nargs=2,default=(-1e15,2e16),metavar=('LOW','HIGH'),help='histogram limits for a new climatology (default -1e15 2e16, for NO2 in molec/cm2)')
+	parser.add_argument('--bins',type=int,default=128,help='histogram bins for a new climatology, 0 for none (default 128)')
+	parser.add_argument('--months',type=int,nargs='+',help='only add granules from these months (1-12)')
+	parser.add_argument('--every',type=int,default=10,help='granules between checkpoints (default 10)')
+	parser.add_argument('--quality',action='store_true',help='leave out pixels that fail the quality flags (see omi_quality.py)')
+	parser.add_argument('--prefetch',type=int,default=2,help='update: granules read ahead in the background (default 2, 0 for none)')
+	parser.add_argument('--prefetch-mb',type=float,help='update: stop reading ahead while the granules read ahead hold this many megabytes')
+	parser.add_argument('--min-count',type=int,default=5,help='anomaly: cells with fewer climatology values give NaN (default 5)')
+	parser.add_argument('--out',help='export: output file (default CHECKPOINT_products.npz); anomaly: also save each granule\'s anomaly to OUT_<granule>.npz')
+	options=parser.parse_args(argv)
+
+	if options.command == 'update':
+		if os.path.exists(options.checkpoint):
+			climatology=Climatology.load(options.checkpoint)
+			print('Resuming from',options.checkpoint,'with',len(climatology.granules),'granules')
+		else:
+			climatology=Climatology(LatLonGrid(options.resolution,options.bbox),options.range,options.bins,options.months)
+		added,errors=update(climatology,_read_lists(options.lists),options.checkpoint,options.every,options.quality,
+			options.prefetch,None if options.prefetch_mb is None else options.prefetch_mb*1e6)
+		for FILE_NAME,error in errors:
+			print('FAILED',FILE_NAME,error)
+		print('Added',added,'granules;',int(climatology.count.sum()),'values in',int(np.count_nonzero(climatology.count)),'cells')
+		return 1 if errors else 0
+
+	climatology=Climatology.load(options.checkpoint)
+	if options.command == 'export':
+		outfilename=options.out or os.path.splitext(options.checkpoint)[0]+'_products.npz'
+		climatology.export(outfilename)
+		print('Saved',outfilename)
+		return 0
+
+	from omi_reader import read_swath
+	failed=0
+	for FILE_NAME in _read_lists(options.lists):
+		try:
+			swath=read_swath(FILE_NAME,quality=options.quality)
+		except Exception as error:
+			print('FAILED',FILE_NAME,'{0}: {1}'.format(type(error).__name__,error))
+			failed+=1
+			continue
+		anomaly,zscore=climatology.anomaly(swath['lat'],swath['lon'],swath['dataArray'],options.min_count)
+		count=int(np.count_nonzero(np.isfinite(anomaly)))
+		if count:
+			print(FILE_NAME,'pixels:',count,'mean anomaly:',float(np.nanmean(anomaly)),'mean z-score:',float(np.nanmean(zscore)))
+		else:
+			print(FILE_NAME,'has no pixels in cells of the climatology')
+		if options.out:
+			np.savez_compressed('{0}_{1}.npz'.format(options.out,os.path.splitext(os.path.basename(FILE_NAME))[0]),
+				lat=swath['lat'],lon=swath['lon'],anomaly=anomaly,zscore=zscore)
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+'''
+Module: omi_decode.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To decode OMI/TROPOMI SDS (fill and missing values, offset and scale factor) a
+block of scanlines at a time, straight into one preallocated output array
+
+The original decode, data[:].astype(float), two NaN assignments and scale*(data-offset),
+holds the raw array plus three or four full float64 temporaries at once. Here the only
+full-size array is the output (float64, or float32 to halve it again); the raw values,
+the fill/missing test and the arithmetic are done in place one block at a time. Several
+SDS can share one validity mask, so that a pixel missing in any of them is missing in all.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import numpy as np
+
+#approximate size (bytes) of the raw values read per block
+CHUNK_BYTES=1024*1024
+
+def _window_shape(shape,window):
+	#normalizes a window (None, slice or tuple of slices) and returns it with its output shape
+	if window is None:
+		window=()
+	elif not isinstance(window,tuple):
+		window=(window,)
+	window=window+(slice(None),)*(len(shape)-len(window))
+	out_shape=tuple(len(range(*part.indices(size))) for part,size in zip(window,shape))
+	return window,out_shape
+
+def _block_rows(sds,row_bytes):
+	#rows per block: a whole number of HDF5 chunks, about CHUNK_BYTES of raw data
+	chunks=sds.chunks
+	step=chunks[0] if chunks else 1
+	rows=max(CHUNK_BYTES//max(row_bytes,1),1)
+	return max(rows//step,1)*step
+
+def decode(sds,window=None,dtype=np.float64,out=None,valid=None,invalid_value=np.nan,masked=False):
+	'''
+	Reads and decodes one SDS (or a window of it) block by block.
+
+	Parameters
+	----------
+	sds : omi_reader.SDSHandle
+		SDS to decode
+	window : tuple of slice, optional
+		Part of the SDS to read (all of it by default); steps are not supported on the first axis
+	dtype : numpy dtype
+		float64 (the default, same values as the original decode) or float32
+	out : numpy.ndarray, optional
+		Array to decode into (allocated if not given)
+	valid : numpy.ndarray, optional
+		Boolean array (shape of the output), False for pixels to treat as missing as well
+	invalid_value : float
+		Value written to fill/missing/invalid pixels (NaN by default, e.g. the fill value
+		for writing the data back out); ignored when masked is True
+	masked : bool
+		Return a numpy.ma.MaskedArray (invalid pixels masked, values left as read) instead
+
+	Returns
+	-------
+	dataArray : numpy.ndarray or numpy.ma.MaskedArray
+		Decoded values
+	'''
+	dataArray,invalid=_decode(sds,window,dtype,out,valid,None if masked else invalid_value,masked)
+	if masked:
+		return np.ma.MaskedArray(dataArray,mask=invalid,copy=False)
+	return dataArray
+
+def _decode(sds,window,dtype,out,valid,invalid_value,keep_invalid=True):
+	#decodes into out block by block and returns it with the boolean array of invalid pixels (if kept)
+	window,out_shape=_window_shape(sds.shape,window)
+	if out is None:
+		out=np.empty(out_shape,dtype=dtype)
+	invalid=np.empty(out_shape,dtype=bool) if keep_invalid else None
+	first=window[0]
+	start,stop,step=first.indices(sds.shape[0])
+	if step != 1:
+		raise ValueError('decode does not support steps along the first axis')
+	row_bytes=int(np.prod(out_shape[1:],dtype=np.int64))*sds.dtype.itemsize
+	block=_block_rows(sds,row_bytes)
+	cf=sds.schema.convention != 'omi'
+	fill_values=[float(value) for value in (sds.fill_value,sds.missing_value) if value is not None]
+	for row in range(start,stop,block):
+		rows=slice(row-start,min(row+block,stop)-start)
+		raw=sds.raw((slice(row,min(row+block,stop)),)+window[1:])
+		target=out[rows]
+		#fill/missing test on the raw block, then the arithmetic in place in the output's precision
+		bad=invalid[rows] if keep_invalid else np.empty(raw.shape,dtype=bool)
+		bad[...]=False
+		for value in fill_values:
+			bad|=raw==value
+		if valid is not None:
+			bad|=~valid[rows]
+		if cf:
+			np.multiply(raw,sds.scale,out=target,dtype=target.dtype,casting='unsafe')
+			if sds.offset:
+				np.add(target,sds.offset,out=target)
+		else:
+			np.subtract(raw,sds.offset,out=target,dtype=target.dtype,casting='unsafe')
+			if sds.scale != 1:
+				np.multiply(sds.scale,target,out=target)
+		if invalid_value is not None:
+			target[bad]=invalid_value
+	return out,invalid
+
+def decode_many(handles,window=None,dtype=np.float64,valid=None,masked=False):
+	'''
+	Decodes several SDS of the same shape so that they share one validity mask: a pixel
+	that is fill/missing in any of them (or False in valid) is invalid in all of them.
+
+	Parameters
+	----------
+	handles : list of omi_reader.SDSHandle
+		SDS to decode
+	window, dtype, valid, masked
+		As for decode
+
+	Returns
+	-------
+	arrays : dict
+		Decoded array (or MaskedArray, all sharing the same mask) per SDS name
+	invalid : numpy.ndarray
+		The shared boolean mask of invalid pixels
+	'''
+	arrays={}
+	invalid=None
+	for sds in handles:
+		arrays[sds.name],own=_decode(sds,window,dtype,None,valid,None)
+		invalid=own if invalid is None else np.logical_or(invalid,own,out=invalid)
+	for name in arrays:
+		if masked:
+			arrays[name]=np.ma.MaskedArray(arrays[name],mask=invalid,copy=False)
+		else:
+			arrays[name][invalid]=np.nan
+	return arrays,invalid
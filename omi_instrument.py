@@ -0,0 +1,220 @@
+#!/usr/bin/python
+'''
+Module: omi_instrument.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To record, per granule and per stage of the tools (open, geolocation, decode, time,
+search, neighborhood, write, plot, ...), the wall time, the bytes read from each dataset,
+the memory allocated and the peak memory
+
+Instrumentation is off unless the OMI_INSTRUMENT environment variable names an output file
+(or omi_batch.py / omi_binning.py is given --instrument FILE). The records are written
+when the program ends, as JSON, or as CSV if the file name ends in .csv. Memory is measured
+with tracemalloc, which slows Python down; set OMI_INSTRUMENT_MEMORY=0 to record only
+times and bytes. When instrumentation is off, stage() returns a shared do-nothing context
+and count_bytes() returns at once, so the tools run at full speed.
+
+Each record has: granule, stage, dataset (for bytes read from one dataset; empty for the
+stage totals), calls, seconds, bytes_read (decompressed bytes returned by HDF5),
+alloc_bytes (memory still allocated when the stage ended) and peak_bytes (highest memory
+use above the start of the stage). Times and bytes of nested stages are included in the
+stages around them.
+
+Example:
+	OMI_INSTRUMENT=timing.csv python read_omi_no2_so2_at_a_location.py
+	python omi_batch.py dump --yes --workers 4 --instrument timing.json
+
+In code, wrap work in stage('name') and per-granule work in granule_label(FILE_NAME).
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import atexit
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+
+#columns of the records, in output order
+RECORD_FIELDS=('granule','stage','dataset','calls','seconds','bytes_read','alloc_bytes','peak_bytes')
+
+ENABLED=False
+_memory=False
+_output=None
+#stage stack and granule label are kept per thread (omi_prefetch reads granules in
+#background threads); memory is traced for the whole process, so the peaks of stages that
+#run at the same time in different threads include each other
+_local=threading.local()
+_records={}
+
+def _stack():
+	if not hasattr(_local,'stack'):
+		_local.stack=[]
+	return _local.stack
+
+def _granule():
+	return getattr(_local,'granule','')
+
+class _NullStage(object):
+	#what stage() returns when instrumentation is off
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc_info):
+		return False
+
+_NULL_STAGE=_NullStage()
+
+class _Stage(object):
+	def __init__(self,name):
+		self.name=name
+
+	def __enter__(self):
+		self.bytes_read=0
+		if _memory:
+			current,peak=tracemalloc.get_traced_memory()
+			#keep the peak seen so far by the stages around this one before resetting it
+			for outer in _stack():
+				outer.peak=max(outer.peak,peak)
+			tracemalloc.reset_peak()
+			self.start_memory=current
+			self.peak=current
+		_stack().append(self)
+		self.start=time.perf_counter()
+		return self
+
+	def __exit__(self,*exc_info):
+		seconds=time.perf_counter()-self.start
+		_stack().pop()
+		record=_record(self.name,'')
+		record['calls']+=1
+		record['seconds']+=seconds
+		record['bytes_read']+=self.bytes_read
+		if _memory:
+			current,peak=tracemalloc.get_traced_memory()
+			peak=max(self.peak,peak)
+			record['alloc_bytes']+=current-self.start_memory
+			record['peak_bytes']=max(record['peak_bytes'],peak-self.start_memory)
+			stack=_stack()
+			if stack:
+				stack[-1].peak=max(stack[-1].peak,peak)
+		return False
+
+def _record(stage,dataset):
+	key=(_granule(),stage,dataset)
+	if key not in _records:
+		#setdefault, so two threads creating the same record end up sharing one
+		_records.setdefault(key,{'granule':key[0],'stage':stage,'dataset':dataset,'calls':0,'seconds':0.0,
+			'bytes_read':0,'alloc_bytes':0,'peak_bytes':0})
+	return _records[key]
+
+def stage(name):
+	'''
+	Context manager timing one stage (a shared do-nothing context when instrumentation is off).
+	'''
+	if not ENABLED:
+		return _NULL_STAGE
+	return _Stage(name)
+
+def count_bytes(dataset,nbytes):
+	'''
+	Adds bytes read from a dataset to the current stage (and the stages around it).
+	'''
+	if not ENABLED:
+		return
+	stack=_stack()
+	for outer in stack:
+		outer.bytes_read+=nbytes
+	record=_record(stack[-1].name if stack else '',dataset)
+	record['calls']+=1
+	record['bytes_read']+=nbytes
+
+class granule_label(object):
+	'''
+	Context manager labelling the records made inside it with a granule's name.
+	'''
+	def __init__(self,FILE_NAME):
+		self.FILE_NAME=FILE_NAME
+
+	def __enter__(self):
+		self.outer=_granule()
+		_local.granule=os.path.basename(self.FILE_NAME)
+		return self
+
+	def __exit__(self,*exc_info):
+		_local.granule=self.outer
+		return False
+
+def enable(output=None,memory=True):
+	'''
+	Turns instrumentation on.
+
+	Parameters
+	----------
+	output : str, optional
+		File to write the records to when the program ends (.csv for CSV, JSON otherwise);
+		nothing is written automatically if None
+	memory : bool
+		Also measure allocations and peak memory with tracemalloc
+	'''
+	global ENABLED, _memory, _output
+	ENABLED=True
+	_memory=memory
+	if memory and not tracemalloc.is_tracing():
+		tracemalloc.start()
+	if output and _output is None:
+		atexit.register(_write_at_exit)
+	_output=output
+
+def records():
+	'''The records made so far, as a list of dicts.'''
+	return [dict(record) for record in _records.values()]
+
+def take_records():
+	'''The records made so far, which are then cleared (to send them from a worker process).'''
+	taken=records()
+	_records.clear()
+	return taken
+
+def reset():
+	'''Clears the records (e.g. those a forked worker process inherited).'''
+	_records.clear()
+
+def add_records(new_records):
+	'''Merges records made elsewhere (e.g. in a worker process) into this process's records.'''
+	outer=_granule()
+	for new in new_records:
+		_local.granule=new['granule']
+		record=_record(new['stage'],new['dataset'])
+		for field in ('calls','seconds','bytes_read','alloc_bytes'):
+			record[field]+=new[field]
+		record['peak_bytes']=max(record['peak_bytes'],new['peak_bytes'])
+	_local.granule=outer
+
+def write(path,rows=None):
+	'''
+	Writes records to a JSON file, or a CSV file if the name ends in .csv.
+	'''
+	rows=records() if rows is None else rows
+	if path.lower().endswith('.csv'):
+		with open(path,'w',newline='') as outfile:
+			writer=csv.DictWriter(outfile,RECORD_FIELDS)
+			writer.writeheader()
+			writer.writerows(rows)
+	else:
+		with open(path,'w') as outfile:
+			json.dump(rows,outfile,indent=1)
+
+def _write_at_exit():
+	#worker processes send their records back to the main process instead of writing them
+	if _output and multiprocessing.parent_process() is None:
+		write(_output)
+
+if os.environ.get('OMI_INSTRUMENT'):
+	enable(os.environ['OMI_INSTRUMENT'],os.environ.get('OMI_INSTRUMENT_MEMORY','1') != '0')
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+'''
+Module: omi_neighborhood.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To compute the mean, median, standard deviation and number of valid pixels in NxN
+windows around many pixels of a swath at once
+
+Windows are taken from a strided view of the swath (numpy's sliding_window_view), so all
+sites and window sizes are handled with array operations instead of a Python loop per site.
+NaN pixels (and fill values, if given) are left out of every statistic.
+
+Windows that would extend past the edge of the swath are handled in one of two ways:
+	shift - the window is moved inside the swath so it always covers NxN pixels (the
+	        centre pixel stays inside it, but is no longer in the middle)
+	pad   - the window stays centred and pixels outside the swath count as missing
+
+Example:
+	stats=neighborhood_statistics(dataArray,xs,ys,sizes=(3,5,7))
+	stats[5]['average']   #mean of the 5x5 window around each site
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from omi_instrument import stage
+
+EDGE_MODES=('shift','pad')
+
+#names used for the windows in the location reports
+WINDOW_NAMES={3:'three_by_three',5:'five_by_five'}
+
+def window_name(size):
+	'''Report key of an NxN window ('three_by_three', 'five_by_five', '7x7', ...).'''
+	return WINDOW_NAMES.get(size,'{0}x{0}'.format(size))
+
+def extract_windows(dataArray,xs,ys,size,edge='shift'):
+	'''
+	Gathers the NxN window around each site.
+
+	Parameters
+	----------
+	dataArray : numpy.ndarray
+		2-D swath (scanline, cross-track)
+	xs, ys : array_like of int
+		Scanline and cross-track index of each site
+	size : int
+		Odd window size N
+	edge : str
+		'shift' or 'pad' (see the module description)
+
+	Returns
+	-------
+	windows : numpy.ndarray
+		float64 array of shape (number of sites, N, N)
+
+	Raises
+	------
+	ValueError
+		If the size is not a positive odd number, the edge mode is unknown, or (for 'shift')
+		the swath is smaller than the window
+	'''
+	if size < 1 or size%2 == 0:
+		raise ValueError('The window size must be a positive odd number, not '+str(size))
+	if edge not in EDGE_MODES:
+		raise ValueError('Unknown edge mode: '+str(edge)+' (use one of '+', '.join(EDGE_MODES)+')')
+	xs=np.asarray(xs,dtype=np.intp)
+	ys=np.asarray(ys,dtype=np.intp)
+	half=size//2
+	dataArray=np.asarray(dataArray)
+	if edge == 'shift':
+		nrows,ncols=dataArray.shape
+		if size > nrows or size > ncols:
+			raise ValueError('The swath '+str(dataArray.shape)+' is smaller than a '+str(size)+'x'+str(size)+' window')
+		#top-left corner of each window, clamped so the whole window is inside the swath
+		rows=np.clip(xs-half,0,nrows-size)
+		cols=np.clip(ys-half,0,ncols-size)
+	else:
+		dataArray=np.pad(dataArray.astype(np.float64),half,mode='constant',constant_values=np.nan)
+		rows=xs
+		cols=ys
+	return sliding_window_view(dataArray,(size,size))[rows,cols].astype(np.float64)
+
+def window_statistics(windows,fv=None):
+	'''
+	nan-aware statistics of a stack of windows.
+
+	Parameters
+	----------
+	windows : numpy.ndarray
+		Array of shape (number of sites, N, N)
+	fv : float, optional
+		Fill value to leave out as well as NaN
+
+	Returns
+	-------
+	stats : dict
+		count (int array), average, median and stdev (float arrays, NaN where a window has
+		no valid pixels)
+	'''
+	values=windows.reshape(windows.shape[0],-1)
+	if fv is not None:
+		values=np.where(values == float(fv),np.nan,values)
+	count=np.count_nonzero(~np.isnan(values),axis=1)
+	with warnings.catch_warnings():
+		#windows without any valid pixel give NaN, which is what we want
+		warnings.simplefilter('ignore',RuntimeWarning)
+		average=np.nanmean(values,axis=1)
+		median=np.nanmedian(values,axis=1)
+		stdev=np.nanstd(values,axis=1)
+	return {'count':count,'average':average,'median':median,'stdev':stdev}
+
+def neighborhood_statistics(dataArray,xs,ys,sizes=(3,5),edge='shift',fv=None):
+	'''
+	Statistics of the NxN windows around many sites, for several window sizes.
+
+	Parameters
+	----------
+	dataArray : numpy.ndarray
+		2-D swath (scanline, cross-track), NaN where there is no value
+	xs, ys : array_like of int
+		Scanline and cross-track index of each site
+	sizes : sequence of int
+		Odd window sizes
+	edge : str
+		'shift' (default) or 'pad' (see the module description)
+	fv : float, optional
+		Fill value to leave out as well as NaN
+
+	Returns
+	-------
+	stats : dict
+		For each size, the window_statistics of all sites (arrays in site order)
+	'''
+	with stage('neighborhood'):
+		return dict((size,window_statistics(extract_windows(dataArray,xs,ys,size,edge),fv)) for size in sizes)
+
+def site_statistics(stats,i):
+	'''
+	Statistics of site i as plain Python numbers, keyed by window_name.
+	'''
+	sites={}
+	for size,window in stats.items():
+		sites[window_name(size)]={'count':int(window['count'][i]),'average':float(window['average'][i]),
+			'median':float(window['median'][i]),'stdev':float(window['stdev'][i])}
+	return sites
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+'''
+Module: omi_prefetch.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To read and decode the next granules in background threads while the current one
+is being processed, so that disk and decompression time overlap with computation
+
+prefetch() goes through a list of granules in order and yields each one's decoded arrays
+(by default the output of omi_reader.read_swath) as soon as it is ready. Up to depth
+granules are read ahead; a memory ceiling stops it from reading further ahead while the
+granules waiting to be used already take that much memory (at least one granule is always
+read, however large it is).
+
+Example:
+	for FILE_NAME,swath,error in prefetch(file_names,depth=3,max_bytes=2e9):
+		if error is None:
+			accumulator.add(swath['lat'],swath['lon'],swath['dataArray'])
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from omi_instrument import granule_label
+
+def result_bytes(result):
+	'''Memory held by the arrays of a loaded granule (a dict of arrays, or one array).'''
+	if isinstance(result,np.ndarray):
+		return result.nbytes
+	if isinstance(result,dict):
+		return sum(value.nbytes for value in result.values() if isinstance(value,np.ndarray))
+	return 0
+
+def _load(load,FILE_NAME):
+	#runs in a background thread; errors are returned so the consumer can report them
+	with granule_label(FILE_NAME):
+		try:
+			return load(FILE_NAME),None
+		except Exception as error:
+			return None,error
+
+def prefetch(file_names,load=None,depth=2,max_bytes=None,threads=1):
+	'''
+	Reads granules ahead of use in background threads.
+
+	Parameters
+	----------
+	file_names : list of str
+		Granules, in the order they are wanted
+	load : function, optional
+		Reads one granule (FILE_NAME -> arrays); omi_reader.read_swath by default
+	depth : int
+		Most granules read ahead of the one being used (0 reads each one when it is wanted)
+	max_bytes : float, optional
+		Do not read further ahead while the granules waiting to be used hold this much memory
+	threads : int
+		Number of reading threads (h5py lets only one thread into HDF5 at a time, so more than
+		one mainly helps when load does other work too)
+
+	Yields
+	------
+	FILE_NAME : str
+	result : object
+		Output of load (None if it failed)
+	error : Exception or None
+		Why the granule could not be read
+	'''
+	if load is None:
+		from omi_reader import read_swath
+		load=read_swath
+	if depth <= 0:
+		for FILE_NAME in file_names:
+			result,error=_load(load,FILE_NAME)
+			yield FILE_NAME,result,error
+		return
+	pending=deque()
+	names=iter(file_names)
+	#size of the last granule read, used to guess the size of those still being read
+	estimate=0
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		while True:
+			#top up the queue of granules being read, within the depth and memory limits
+			while len(pending) < depth+1:
+				if pending and max_bytes is not None:
+					done=[future.result()[0] for name,future in pending if future.done()]
+					held=sum(result_bytes(result) for result in done)+(len(pending)-len(done))*estimate
+					if held >= max_bytes:
+						break
+				FILE_NAME=next(names,None)
+				if FILE_NAME is None:
+					break
+				pending.append((FILE_NAME,pool.submit(_load,load,FILE_NAME)))
+			if not pending:
+				return
+			FILE_NAME,future=pending.popleft()
+			result,error=future.result()
+			if result is not None:
+				estimate=result_bytes(result)
+			yield FILE_NAME,result,error
+			#drop our reference so the memory is freed as soon as the consumer is done with it
+			del result
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+'''
+Module: omi_quality.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To turn the quality flags of a granule (OMI quality bitfields, the OMI row anomaly
+flags, TROPOMI qa_value) into one boolean mask of good pixels
+
+Each product has a list of rules (see QUALITY_RULES). A rule either rejects pixels with
+certain bits set in an integer flag field, or rejects pixels whose decoded value is below a
+minimum. All rules are evaluated with array operations and combined into a single mask,
+which omi_reader.Granule.quality_mask keeps for the granule so that every SDS read from it
+(and every statistic computed from them) uses the same mask.
+
+The default rules are:
+	OMNO2   - VcdQualityFlags bit 0 (summary flag) clear, XTrackQualityFlags 0
+	OMSO2   - QualityFlags_PBL bit 0 (summary flag) clear, XTrackQualityFlags 0
+	S5P_NO2 - qa_value of 0.75 or more
+	S5P_SO2 - qa_value of 0.5 or more
+The XTrackQualityFlags (row anomaly) rule is skipped for files that do not have the field.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import numpy as np
+from omi_decode import _window_shape
+from omi_instrument import stage
+from omi_reader import SDSHandle
+
+class FlagRule(object):
+	'''
+	One quality test on a field of a granule.
+
+	Parameters
+	----------
+	field : str
+		Name of the SDS (or geolocation field) holding the flags
+	bad_bits : int, optional
+		Pixels with any of these bits set are bad (fill values are always bad)
+	minimum : float, optional
+		Pixels whose decoded value is below this are bad (for scaled quality values)
+	required : bool
+		If False, the rule is skipped for files without the field
+
+	Raises
+	------
+	ValueError
+		If neither or both of bad_bits and minimum are given
+	'''
+	def __init__(self,field,bad_bits=None,minimum=None,required=True):
+		if (bad_bits is None) == (minimum is None):
+			raise ValueError('A quality rule needs either bad_bits or minimum')
+		self.field=field
+		self.bad_bits=bad_bits
+		self.minimum=minimum
+		self.required=required
+
+	def __repr__(self):
+		test='bad_bits={0:#x}'.format(self.bad_bits) if self.bad_bits is not None else 'minimum={0!r}'.format(self.minimum)
+		return 'FlagRule({0!r}, {1})'.format(self.field,test)
+
+	def valid(self,granule,window=None):
+		'''
+		True for the pixels (of a window) that pass the rule, or None if the field is
+		missing and the rule is not required.
+
+		Raises
+		------
+		KeyError
+			If a required field is missing
+		'''
+		sds=_flag_field(granule,self.field)
+		if sds is None:
+			if self.required:
+				raise KeyError('Sorry, your '+granule.schema.instrument+' file does not contain the quality field: '+self.field)
+			return None
+		if self.bad_bits is not None:
+			flags=sds.read_flags(window)
+			valid=(flags & self.bad_bits) == 0
+			if sds.fill_value is not None:
+				valid&=flags != sds.fill_value
+			return valid
+		values=sds.read(window)
+		#quality values are stored to a few decimals; round off the float error of the scale factor
+		with np.errstate(invalid='ignore'):
+			return np.round(values,6) >= self.minimum
+
+def _flag_field(granule,field):
+	#flags may be stored with the data fields or with the geolocation fields; both use the granule's cache
+	if field in granule:
+		return granule[field]
+	if field in granule.geolocation:
+		return SDSHandle(granule.geolocation[field],granule.schema,granule.cache)
+	return None
+
+#quality rules per product (keyed by ProductSchema.name)
+QUALITY_RULES={}
+
+def register_quality_rules(product_name,rules):
+	'''
+	Sets the quality rules of a product (replacing any rules it had).
+	'''
+	QUALITY_RULES[product_name]=list(rules)
+	return QUALITY_RULES[product_name]
+
+#row anomaly: 0 means the pixel is not affected; 255 is the fill value
+ROW_ANOMALY_RULE=FlagRule('XTrackQualityFlags',bad_bits=0xff,required=False)
+
+register_quality_rules('OMNO2',[FlagRule('VcdQualityFlags',bad_bits=0b1),ROW_ANOMALY_RULE])
+register_quality_rules('OMSO2',[FlagRule('QualityFlags_PBL',bad_bits=0b1),ROW_ANOMALY_RULE])
+register_quality_rules('S5P_NO2',[FlagRule('qa_value',minimum=0.75)])
+register_quality_rules('S5P_SO2',[FlagRule('qa_value',minimum=0.5)])
+
+def quality_fields(schema):
+	'''Names of the fields the quality rules of a product read.'''
+	return [rule.field for rule in QUALITY_RULES.get(schema.name,[])]
+
+def quality_mask(granule,window=None,rules=None):
+	'''
+	Combines the quality rules of a granule's product into one mask.
+
+	Use Granule.quality_mask instead to compute the mask only once per granule.
+
+	Parameters
+	----------
+	granule : omi_reader.Granule
+		Open granule
+	window : tuple of slice, optional
+		Part of the swath to check
+	rules : list of FlagRule, optional
+		Rules to use instead of the product's registered ones
+
+	Returns
+	-------
+	mask : numpy.ndarray
+		bool array, True for good pixels (all True if the product has no rules)
+	'''
+	rules=QUALITY_RULES.get(granule.schema.name,[]) if rules is None else rules
+	mask=None
+	with stage('quality'):
+		for rule in rules:
+			valid=rule.valid(granule,window)
+			if valid is not None:
+				mask=valid if mask is None else mask & valid
+	if mask is None:
+		mask=np.ones(_window_shape(granule[granule.schema.main_sds].shape,window)[1],dtype=bool)
+	return mask
+
+def apply_mask(dataArray,mask,invalid_value=np.nan):
+	'''
+	Copy of decoded data with the pixels that fail the quality mask set to invalid_value
+	(or masked, for a numpy.ma.MaskedArray).
+	'''
+	if isinstance(dataArray,np.ma.MaskedArray):
+		return np.ma.masked_where(~mask,dataArray)
+	return np.where(mask,dataArray,np.asarray(invalid_value,dtype=dataArray.dtype))
@@ -0,0 +1,490 @@
+#!/usr/bin/python
+'''
+Module: omi_query_service.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To answer point, neighborhood and region queries on OMI NO2/SO2 granules from a
+long-running local HTTP service that keeps recently used granules in memory
+
+The service is started with a list of granules, which are cataloged (see omi_catalog.py)
+so that each query only opens the granules whose footprint and time range can match it.
+The decoded main SDS, lat/lon and scan dates of the granules used most recently are kept in
+a least-recently-used cache limited in bytes, together with the spatial index of their
+pixels (omi_spatial.SwathIndex) and the lat/lon range of each scanline, which are built
+the first time a granule is queried. Repeated questions about the same places and dates are
+then answered from memory in milliseconds.
+
+Queries are POSTed as JSON to /query, several at a time:
+	{"queries": [
+		{"points": [[38.9, -77.0], [40.7, -74.0]], "start": "2019-05-01", "end": "2019-05-03"},
+		{"points": [[38.9, -77.0]], "windows": [3, 5], "edge": "shift", "product": "NO2"},
+		{"bbox": [35, 45, -80, -70], "start": "2019-05-01", "end": "2019-05-02"}]}
+A point query gives the value of the nearest pixel to each location (with the statistics of
+the windows around it when windows are given, as read_omi_no2_so2_at_a_location.py does);
+a bbox query gives the count, average, median and stdev of the pixels in the box (which
+crosses the antimeridian if max_lon < min_lon). Each query can also name its granules
+("files", which must be among the granules the service was started with) instead of a time
+range, and ask for quality-filtered values ("quality": true). GET /metrics returns the
+cache hits, misses, evictions and size and the request latencies. Missing values are
+returned as null. A request with a malformed query gets HTTP status 400 and one whose query
+failed in the service gets 500; the answers of the other queries are still returned.
+
+The service only listens on localhost.
+
+Examples:
+	python omi_query_service.py serve fileList.txt --port 8642 --cache-mb 1024
+	python omi_query_service.py query --point 38.9 -77.0 --start 2019-05-01 --end 2019-05-03 --windows 3 5
+	python omi_query_service.py metrics
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from omi_catalog import CATALOG_FILE, Catalog, row_extents
+from omi_instrument import granule_label, stage
+from omi_neighborhood import EDGE_MODES
+from omi_prefetch import result_bytes
+from omi_reader import PRODUCTS
+from omi_subset import in_bbox, rows_in_bbox
+
+PORT=8642
+
+#default size cap of the granule cache in megabytes
+CACHE_MB=1024
+
+#number of recent request latencies the metrics are computed from
+LATENCY_WINDOW=1000
+
+def _json_value(value):
+	#numpy values as plain JSON values, with NaN and infinity as null
+	if isinstance(value,dict):
+		return dict((str(key),_json_value(item)) for key,item in value.items())
+	if isinstance(value,(list,tuple)):
+		return [_json_value(item) for item in value]
+	if isinstance(value,np.ndarray):
+		return _json_value(value.tolist())
+	if isinstance(value,np.generic):
+		value=value.item()
+	if isinstance(value,float) and not np.isfinite(value):
+		return None
+	return value
+
+class QueryError(ValueError):
+	'''A query that is malformed or asks for granules the service does not serve.'''
+
+def check_query(query):
+	'''
+	Checks the fields of one query.
+
+	Raises
+	------
+	QueryError
+		If the query is not a JSON object, has both or neither of points and bbox, or has
+		a field of the wrong form (including even window sizes, an unknown edge mode or
+		product, a start or end that is not a date, or a quality that is not true/false)
+	'''
+	if not isinstance(query,dict):
+		raise QueryError('a query must be a JSON object')
+	if ('points' in query) == ('bbox' in query):
+		raise QueryError('a query needs either points or bbox')
+	try:
+		if 'points' in query:
+			size=np.asarray(query['points'],dtype=np.float64).size
+			windows=[int(window) for window in query.get('windows',())]
+		else:
+			bbox=[float(bound) for bound in query['bbox']]
+	except (TypeError,ValueError) as error:
+		raise QueryError('invalid points, windows or bbox: {0}'.format(error))
+	if 'points' in query:
+		if size == 0 or size%2:
+			raise QueryError('points must be [lat, lon] pairs')
+		if any(window < 1 or window%2 == 0 for window in windows):
+			raise QueryError('windows must be positive odd numbers')
+		if query.get('edge','shift') not in EDGE_MODES:
+			raise QueryError('edge must be one of '+', '.join(EDGE_MODES))
+	if 'bbox' in query and len(bbox) != 4:
+		raise QueryError('bbox must be [min_lat, max_lat, min_lon, max_lon]')
+	for name in ('start','end'):
+		if query.get(name) is not None:
+			try:
+				np.datetime64(query[name],'s')
+			except (TypeError,ValueError) as error:
+				raise QueryError('invalid {0}: {1}'.format(name,error))
+	products=sorted(set(schema.product for schema in PRODUCTS.values()))
+	if query.get('product') is not None and query['product'] not in products:
+		raise QueryError('product must be one of '+', '.join(products))
+	if not isinstance(query.get('quality',False),bool):
+		raise QueryError('quality must be true or false')
+	files=query.get('files')
+	if files is not None and (not isinstance(files,list) or not all(isinstance(FILE_NAME,str) for FILE_NAME in files)):
+		raise QueryError('files must be a list of granule names')
+
+class SwathCache(object):
+	'''
+	Least-recently-used cache of read swaths and their indexes, limited in bytes.
+
+	Parameters
+	----------
+	max_bytes : float
+		Memory the cached granules may hold; the least recently used are dropped beyond it
+	'''
+	def __init__(self,max_bytes=CACHE_MB*1e6):
+		self.max_bytes=max_bytes
+		self.entries=OrderedDict()
+		self.lock=threading.Lock()
+		self.bytes=0
+		self.hits=0
+		self.misses=0
+		self.evictions=0
+
+	def get(self,FILE_NAME,quality=False):
+		'''
+		The cache entry of a granule (reading it on a miss): a dict of swath (read_swath
+		output), index (SwathIndex, built on first use) and extents (per-scanline lat/lon
+		range, built on first use).
+
+		Returns
+		-------
+		entry : dict
+		hit : bool
+		'''
+		key=(FILE_NAME,bool(quality))
+		with self.lock:
+			if key in self.entries:
+				self.entries.move_to_end(key)
+				self.hits+=1
+				return self.entries[key],True
+			self.misses+=1
+		#read outside the lock so that queries on cached granules are not held up
+		from omi_reader import read_swath
+		with granule_label(FILE_NAME),stage('load'):
+			swath=read_swath(FILE_NAME,quality=quality)
+		entry={'swath':swath,'index':None,'extents':None,'bytes':result_bytes(swath)}
+		with self.lock:
+			if key in self.entries:
+				#another request read it at the same time
+				return self.entries[key],False
+			self.entries[key]=entry
+			self.bytes+=entry['bytes']
+			self._evict()
+		return entry,False
+
+	def grow(self,entry,nbytes):
+		'''Adds the memory of an index built for a cached entry.'''
+		with self.lock:
+			entry['bytes']+=nbytes
+			if any(cached is entry for cached in self.entries.values()):
+				self.bytes+=nbytes
+				self._evict()
+
+	def _evict(self):
+		#drops the least recently used entries, but always keeps the newest one
+		while self.bytes > self.max_bytes and len(self.entries) > 1:
+			key,entry=self.entries.popitem(last=False)
+			self.bytes-=entry['bytes']
+			self.evictions+=1
+
+	def metrics(self):
+		with self.lock:
+			requests=self.hits+self.misses
+			return {'entries':len(self.entries),'bytes':self.bytes,'max_bytes':self.max_bytes,'hits':self.hits,
+				'misses':self.misses,'evictions':self.evictions,'hit_rate':self.hits/requests if requests else None}
+
+class QueryService(object):
+	'''
+	Answers point, neighborhood and bbox queries on a set of granules.
+
+	Parameters
+	----------
+	file_names : list of str
+		Granules the service answers from
+	catalog : str
+		Footprint catalog database (built or refreshed for file_names at start up)
+	max_bytes : float
+		Size cap of the granule cache
+	'''
+	def __init__(self,file_names,catalog=CATALOG_FILE,max_bytes=CACHE_MB*1e6):
+		self.file_names=list(file_names)
+		self.served=set(self.file_names)
+		self.catalog=catalog
+		startup=Catalog(catalog)
+		startup.update(self.file_names)
+		startup.close()
+		self.cache=SwathCache(max_bytes)
+		self.lock=threading.Lock()
+		self.latencies=deque(maxlen=LATENCY_WINDOW)
+		self.requests=0
+		self.queries=0
+		self.errors=0
+
+	def candidates(self,query):
+		'''
+		Granules that can match a query, by start time (or the query's own files).
+
+		Raises
+		------
+		QueryError
+			If the query names files the service was not started with
+		'''
+		if query.get('files'):
+			#only the granules the service was started with are ever opened
+			unknown=[FILE_NAME for FILE_NAME in query['files'] if FILE_NAME not in self.served]
+			if unknown:
+				raise QueryError('not served: '+', '.join(unknown))
+			return list(query['files'])
+		#sqlite connections belong to one thread, so each request opens the catalog
+		catalog=Catalog(self.catalog)
+		try:
+			selected=catalog.query(None,query.get('points'),query.get('bbox'),query.get('start'),query.get('end'),query.get('product'))
+		finally:
+			catalog.close()
+		return [FILE_NAME for FILE_NAME in selected if FILE_NAME in self.served]
+
+	def _index(self,entry):
+		#the spatial index is built the first time a granule gets a point query
+		if entry['index'] is None:
+			from omi_spatial import SwathIndex
+			swath=entry['swath']
+			with stage('index'):
+				index=SwathIndex(swath['lat'],swath['lon'])
+			entry['index']=index
+			#unit vectors (3 float64) and tree/pixel indices per valid pixel
+			self.cache.grow(entry,index.pixels.size*(3*8+2*8))
+		return entry['index']
+
+	def _extents(self,entry):
+		if entry['extents'] is None:
+			extents=row_extents(entry['swath']['lat'],entry['swath']['lon'])
+			entry['extents']=extents
+			self.cache.grow(entry,extents.nbytes)
+		return entry['extents']
+
+	def point_query(self,entry,query):
+		from read_omi_no2_so2_at_a_location import sites_report
+		points=np.asarray(query['points'],dtype=np.float64).reshape(-1,2)
+		sizes=tuple(int(size) for size in query.get('windows',()))
+		return sites_report(entry['swath'],points[:,0],points[:,1],sizes,query.get('edge','shift'),self._index(entry))
+
+	def bbox_query(self,entry,query):
+		bbox=[float(bound) for bound in query['bbox']]
+		#only the scanlines whose lat/lon range overlaps the box are looked at
+		rows=np.flatnonzero(rows_in_bbox(self._extents(entry),bbox))
+		if rows.size == 0:
+			return {'count':0}
+		window=slice(rows[0],rows[-1]+1)
+		swath=entry['swath']
+		values=swath['dataArray'][window][in_bbox(swath['lat'][window],swath['lon'][window],bbox)]
+		count=int(np.count_nonzero(~np.isnan(values)))
+		if count == 0:
+			return {'count':0}
+		return {'count':count,'average':float(np.nanmean(values)),'median':float(np.nanmedian(values)),'stdev':float(np.nanstd(values))}
+
+	def answer(self,query):
+		'''
+		Answers one query.
+
+		Parameters
+		----------
+		query : dict
+			points ([lat, lon] pairs) with optional windows and edge, or bbox (min_lat,
+			max_lat, min_lon, max_lon); optionally start, end, product, files and quality
+
+		Returns
+		-------
+		answer : dict
+			results (one per granule: file, start (first scan time), SDS_NAME and sites or
+			region, or an error), cache_hits and cache_misses
+
+		Raises
+		------
+		QueryError
+			If the query is malformed (see check_query) or names files that are not served
+		'''
+		check_query(query)
+		results=[]
+		hits=0
+		misses=0
+		for FILE_NAME in self.candidates(query):
+			try:
+				entry,hit=self.cache.get(FILE_NAME,query.get('quality',False))
+			except Exception as error:
+				results.append({'file':FILE_NAME,'error':'{0}: {1}'.format(type(error).__name__,error)})
+				continue
+			hits+=hit
+			misses+=not hit
+			swath=entry['swath']
+			result={'file':FILE_NAME,'SDS_NAME':swath['SDS_NAME'],'start':str(np.min(swath['scan_dates'])) if swath['scan_dates'].size else None}
+			with granule_label(FILE_NAME),stage('query'):
+				if 'points' in query:
+					result['sites']=self.point_query(entry,query)
+				else:
+					result['region']=self.bbox_query(entry,query)
+			results.append(result)
+		return {'results':results,'cache_hits':hits,'cache_misses':misses}
+
+	def handle(self,request):
+		'''
+		Answers a batch of queries ({"queries": [...]}, or a single query).
+
+		Returns
+		-------
+		response : dict
+			answers (one per query, or an error), seconds, and the HTTP status: 400 if a
+			query was malformed, 500 if one failed in the service, 200 otherwise
+		'''
+		start=time.perf_counter()
+		queries=request.get('queries',[request]) if isinstance(request,dict) else None
+		if not isinstance(queries,list):
+			queries=[None]
+		answers=[]
+		errors=0
+		status=200
+		for query in queries:
+			try:
+				answers.append(self.answer(query))
+			except QueryError as error:
+				errors+=1
+				status=400
+				answers.append({'error':'{0}: {1}'.format(type(error).__name__,error)})
+			except Exception as error:
+				errors+=1
+				if status == 200:
+					status=500
+				answers.append({'error':'{0}: {1}'.format(type(error).__name__,error)})
+		seconds=time.perf_counter()-start
+		with self.lock:
+			self.requests+=1
+			self.queries+=len(queries)
+			self.errors+=errors
+			self.latencies.append(seconds)
+		return {'answers':answers,'seconds':seconds,'status':status}
+
+	def metrics(self):
+		'''Request counts, latency percentiles (seconds) and cache metrics.'''
+		with self.lock:
+			latencies=np.array(self.latencies)
+			metrics={'granules':len(self.file_names),'requests':self.requests,'queries':self.queries,'errors':self.errors}
+		if latencies.size:
+			metrics['latency']={'last':latencies[-1],'mean':latencies.mean(),'p50':np.percentile(latencies,50),
+				'p95':np.percentile(latencies,95),'max':latencies.max()}
+		metrics['cache']=self.cache.metrics()
+		return metrics
+
+class _Handler(BaseHTTPRequestHandler):
+	#the QueryService is attached to the server as server.service
+
+	def _send(self,status,body):
+		data=json.dumps(_json_value(body)).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type','application/json')
+		self.send_header('Content-Length',str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		if self.path == '/metrics':
+			self._send(200,self.server.service.metrics())
+		elif self.path == '/health':
+			self._send(200,{'ok':True})
+		else:
+			self._send(404,{'error':'unknown path '+self.path})
+
+	def do_POST(self):
+		if self.path != '/query':
+			self._send(404,{'error':'unknown path '+self.path})
+			return
+		try:
+			request=json.loads(self.rfile.read(int(self.headers.get('Content-Length',0))) or b'{}')
+		except ValueError as error:
+			self._send(400,{'error':'invalid JSON: {0}'.format(error)})
+			return
+		response=self.server.service.handle(request)
+		self._send(response['status'],response)
+
+	def log_message(self,format,*args):
+		if self.server.verbose:
+			BaseHTTPRequestHandler.log_message(self,format,*args)
+
+def serve(service,port=PORT,verbose=False):
+	'''
+	Answers HTTP requests on localhost until interrupted (each request in its own thread).
+	'''
+	server=ThreadingHTTPServer(('127.0.0.1',port),_Handler)
+	server.daemon_threads=True
+	server.service=service
+	server.verbose=verbose
+	print('Serving',len(service.file_names),'granules on http://127.0.0.1:{0}'.format(server.server_address[1]))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+def send_query(queries,port=PORT):
+	'''
+	Sends a batch of queries to a running service and returns its response.
+	'''
+	from urllib.error import HTTPError
+	from urllib.request import Request, urlopen
+	request=Request('http://127.0.0.1:{0}/query'.format(port),data=json.dumps({'queries':queries}).encode('utf-8'),
+		headers={'Content-Type':'application/json'})
+	try:
+		with urlopen(request) as response:
+			return json.loads(response.read().decode('utf-8'))
+	except HTTPError as error:
+		#failed queries come back with status 400 or 500 and the same JSON body
+		with error:
+			return json.loads(error.read().decode('utf-8'))
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Local HTTP service answering point and region queries on OMI NO2/SO2 granules.')
+	parser.add_argument('command',choices=('serve','query','metrics'),help='run the service, send it a query, or print its metrics')
+	parser.add_argument('lists',nargs='*',default=['fileList.txt'],help='serve: text files listing granules (default fileList.txt)')
+	parser.add_argument('--port',type=int,default=PORT,help='port on localhost (default {0})'.format(PORT))
+	parser.add_argument('--catalog',default=CATALOG_FILE,help='serve: footprint catalog database (default '+CATALOG_FILE+')')
+	parser.add_argument('--cache-mb',type=float,default=CACHE_MB,help='serve: memory for cached granules in megabytes (default {0})'.format(CACHE_MB))
+	parser.add_argument('--verbose','-v',action='store_true',help='serve: log every request')
+	parser.add_argument('--point',type=float,nargs=2,action='append',metavar=('LAT','LON'),help='query: location (repeatable)')
+	parser.add_argument('--bbox',type=float,nargs=4,metavar=('MIN_LAT','MAX_LAT','MIN_LON','MAX_LON'),help='query: region')
+	parser.add_argument('--windows',type=int,nargs='+',default=[],help='query: odd window sizes around each point (e.g. 3 5)')
+	parser.add_argument('--start',help='query: start of the time range (e.g. 2019-05-01)')
+	parser.add_argument('--end',help='query: end of the time range')
+	parser.add_argument('--quality',action='store_true',help='query: leave out pixels that fail the quality flags (see omi_quality.py)')
+	options=parser.parse_args(argv)
+
+	if options.command == 'serve':
+		file_names=[]
+		for list_file in options.lists:
+			with open(list_file,'r') as fileList:
+				file_names.extend(line.strip() for line in fileList if line.strip())
+		serve(QueryService(file_names,options.catalog,options.cache_mb*1e6),options.port,options.verbose)
+		return 0
+	if options.command == 'metrics':
+		from urllib.request import urlopen
+		with urlopen('http://127.0.0.1:{0}/metrics'.format(options.port)) as response:
+			print(json.dumps(json.loads(response.read().decode('utf-8')),indent=1))
+		return 0
+	if (options.point is None) == (options.bbox is None):
+		parser.error('query needs --point or --bbox')
+	query={'start':options.start,'end':options.end,'quality':options.quality}
+	if options.point is not None:
+		query.update({'points':options.point,'windows':options.windows})
+	else:
+		query['bbox']=options.bbox
+	response=send_query([query],options.port)
+	print(json.dumps(response,indent=1))
+	return 1 if any('error' in answer for answer in response['answers']) else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,416 @@
+#!/usr/bin/python
+'''
+Module: omi_reader.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To give every tool one shared way to open an OMI (or TROPOMI) NO2/SO2 granule,
+recognize its product from the file's contents and read decoded SDS
+
+A registry of ProductSchema objects describes where each product keeps its data and
+geolocation fields, which SDS the tools use, and how its values are decoded. A Granule
+finds its schema by looking inside the file (not at its name) and hands out SDSHandle
+objects that read each SDS's attributes (fill value, missing value, scale factor, offset,
+units, valid range) once and decode the data only when it is asked for.
+
+Example:
+	granule=Granule('OMI-Aura_L2-OMNO2_2019m0501t0001-o78468_v003.he5')
+	no2=granule['ColumnAmountNO2'].read()
+	lat,lon=granule.lat,granule.lon
+	granule.close()
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import h5py
+import numpy as np
+from omi_cache import default_cache
+from omi_decode import decode
+from omi_instrument import count_bytes, stage
+from omi_time import tai93_to_datetime64
+
+def _scalar(value):
+	#HDF-EOS attributes are stored as 1-element arrays; return them as plain Python values
+	value=np.asarray(value).ravel()
+	if value.size == 0:
+		return None
+	value=value[0]
+	if isinstance(value,bytes):
+		return value.decode()
+	return value.item() if hasattr(value,'item') else value
+
+class ProductSchema(object):
+	'''
+	Layout of one product.
+
+	Parameters
+	----------
+	name : str
+		Short product name (e.g. 'OMNO2')
+	instrument : str
+		'OMI' or 'TROPOMI'
+	product : str
+		'NO2' or 'SO2'
+	data_path, geolocation_path : str
+		HDF5 paths of the group holding the data fields and the one holding lat/lon/time
+	main_sds : str
+		SDS used by the map and location tools
+	dump_sds : list of str
+		SDS saved by the ascii dump
+	latitude, longitude, time : str
+		Names of the geolocation fields
+	convention : str
+		'omi' for scale*(value-offset) with ScaleFactor/Offset/_FillValue/MissingValue
+		attributes, 'cf' for value*scale_factor+add_offset with _FillValue
+	time_axis : bool
+		True if every variable has a leading time dimension of length 1 (TROPOMI)
+	'''
+	def __init__(self,name,instrument,product,data_path,geolocation_path,main_sds,dump_sds,
+		latitude='Latitude',longitude='Longitude',time='Time',convention='omi',time_axis=False):
+		self.name=name
+		self.instrument=instrument
+		self.product=product
+		self.data_path=data_path
+		self.geolocation_path=geolocation_path
+		self.main_sds=main_sds
+		self.dump_sds=list(dump_sds)
+		self.latitude=latitude
+		self.longitude=longitude
+		self.time=time
+		self.convention=convention
+		self.time_axis=time_axis
+
+	def __repr__(self):
+		return 'ProductSchema({0!r})'.format(self.name)
+
+	def detect(self,file):
+		'''
+		True if an open h5py.File has this product's layout.
+		'''
+		return (self.data_path in file and self.geolocation_path in file
+			and self.main_sds in file[self.data_path] and self.latitude in file[self.geolocation_path])
+
+#known products, tried in order by detect_schema
+PRODUCTS={}
+
+def register_product(schema):
+	'''
+	Adds a product to the registry (replacing any product with the same name).
+	'''
+	PRODUCTS[schema.name]=schema
+	return schema
+
+register_product(ProductSchema('OMNO2','OMI','NO2',
+	'HDFEOS/SWATHS/ColumnAmountNO2/Data Fields','HDFEOS/SWATHS/ColumnAmountNO2/Geolocation Fields',
+	'ColumnAmountNO2',['ColumnAmountNO2','ColumnAmountNO2Std','VcdQualityFlags']))
+register_product(ProductSchema('OMSO2','OMI','SO2',
+	'HDFEOS/SWATHS/OMI Total Column Amount SO2/Data Fields','HDFEOS/SWATHS/OMI Total Column Amount SO2/Geolocation Fields',
+	'ColumnAmountSO2_PBL',['ColumnAmountSO2_PBL','ColumnAmountO3','QualityFlags_PBL']))
+#Sentinel-5P TROPOMI Level 2 netCDF-4 files (read here through h5py)
+register_product(ProductSchema('S5P_NO2','TROPOMI','NO2','PRODUCT','PRODUCT',
+	'nitrogendioxide_tropospheric_column',['nitrogendioxide_tropospheric_column','nitrogendioxide_tropospheric_column_precision','qa_value'],
+	'latitude','longitude','delta_time','cf',True))
+register_product(ProductSchema('S5P_SO2','TROPOMI','SO2','PRODUCT','PRODUCT',
+	'sulfurdioxide_total_vertical_column',['sulfurdioxide_total_vertical_column','sulfurdioxide_total_vertical_column_precision','qa_value'],
+	'latitude','longitude','delta_time','cf',True))
+
+def detect_schema(file):
+	'''
+	Finds the registered product whose layout matches an open h5py.File (None if none does).
+	'''
+	for schema in PRODUCTS.values():
+		if schema.detect(file):
+			return schema
+	return None
+
+def _cached(cache,FILE_NAME,field,window,read):
+	#whole reads go through the cache; window reads use it only if the field is already there
+	if window is None:
+		return cache.get_or_compute(FILE_NAME,field,lambda: read(None))
+	array=cache.get(FILE_NAME,field)
+	if array is None:
+		return read(window)
+	return array[window]
+
+class SDSHandle(object):
+	'''
+	One SDS of a granule. Attributes are read once; data is read and decoded on request.
+
+	Parameters
+	----------
+	dataset : h5py.Dataset
+		The SDS
+	schema : ProductSchema
+		Product the SDS belongs to
+	cache : omi_cache.FieldCache, optional
+		Cache of decoded arrays (see read)
+	'''
+	def __init__(self,dataset,schema,cache=None):
+		self.dataset=dataset
+		self.schema=schema
+		self.cache=cache
+		self.name=dataset.name.split('/')[-1]
+		attrs=dataset.attrs
+		if schema.convention == 'omi':
+			self.fill_value=_scalar(attrs.get('_FillValue'))
+			self.missing_value=_scalar(attrs.get('MissingValue'))
+			self.scale=_scalar(attrs.get('ScaleFactor',1.0))
+			self.offset=_scalar(attrs.get('Offset',0.0))
+			self.units=_scalar(attrs.get('Units',b''))
+			valid_range=attrs.get('ValidRange')
+		else:
+			self.fill_value=_scalar(attrs.get('_FillValue'))
+			self.missing_value=None
+			self.scale=_scalar(attrs.get('scale_factor',1.0))
+			self.offset=_scalar(attrs.get('add_offset',0.0))
+			self.units=_scalar(attrs.get('units',b''))
+			valid_range=None
+			if 'valid_min' in attrs and 'valid_max' in attrs:
+				valid_range=(attrs['valid_min'],attrs['valid_max'])
+		self.valid_range=None if valid_range is None else (_scalar(valid_range[0]),_scalar(valid_range[1]))
+
+	@property
+	def shape(self):
+		return self.dataset.shape[1:] if self.schema.time_axis else self.dataset.shape
+
+	@property
+	def chunks(self):
+		chunks=self.dataset.chunks
+		if chunks is not None and self.schema.time_axis:
+			return chunks[1:]
+		return chunks
+
+	@property
+	def dtype(self):
+		return self.dataset.dtype
+
+	def _selection(self,window):
+		if window is None:
+			window=Ellipsis
+		if self.schema.time_axis:
+			return (0,)+(window if isinstance(window,tuple) else (window,))
+		return window
+
+	def raw(self,window=None):
+		'''
+		Reads the stored values (no decoding), optionally only a window (tuple of slices).
+		'''
+		data=self.dataset[self._selection(window)]
+		count_bytes(self.name,data.nbytes)
+		return data
+
+	def read_flags(self,window=None):
+		'''
+		Reads the stored values like raw, through the cache when there is one (whole reads
+		are stored, window reads are sliced from a stored field), for flag fields that are
+		tested bit by bit rather than decoded.
+		'''
+		if self.cache is None:
+			return self.raw(window)
+		return _cached(self.cache,self.dataset.file.filename,'raw:'+self.dataset.name,window,self.raw)
+
+	def read(self,window=None,dtype=np.float64,masked=False,invalid_value=np.nan):
+		'''
+		Reads and decodes the SDS (or a window of it): fill and missing values become NaN and
+		the scale factor and offset are applied (see omi_decode.decode).
+
+		With a cache, whole-SDS reads are stored and later served as read-only memory maps;
+		window reads are sliced from the cached array when it is there and decoded from the
+		file otherwise. Masked reads bypass the cache.
+
+		Parameters
+		----------
+		window : tuple of slice, optional
+			Part of the SDS to read
+		dtype : numpy dtype
+			float64 (default) or float32 to halve the memory used
+		masked : bool
+			Return a numpy.ma.MaskedArray instead of using NaN
+		invalid_value : float
+			Value for fill/missing pixels when not masked (NaN by default)
+
+		Returns
+		-------
+		dataArray : numpy.ndarray or numpy.ma.MaskedArray
+		'''
+		with stage('decode'):
+			if self.cache is None or masked:
+				return decode(self,window,dtype,masked=masked,invalid_value=invalid_value)
+			field='sds:{0}:{1}:{2!r}'.format(self.dataset.name,np.dtype(dtype).str,float(invalid_value))
+			return _cached(self.cache,self.dataset.file.filename,field,window,
+				lambda window: decode(self,window,dtype,invalid_value=invalid_value))
+
+class Granule(object):
+	'''
+	An open OMI/TROPOMI NO2 or SO2 granule.
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the he5 or nc file
+	schema : ProductSchema, optional
+		Layout to use instead of detecting it
+	cache : omi_cache.FieldCache, optional
+		Cache of decoded SDS and geolocation arrays (omi_cache.default_cache(), i.e.
+		$OMI_CACHE_DIR, by default; no caching if that is not set)
+
+	Raises
+	------
+	ValueError
+		If the file does not match any registered product
+	'''
+	def __init__(self,FILE_NAME,schema=None,cache=None):
+		self.FILE_NAME=FILE_NAME
+		self.cache=default_cache() if cache is None else cache
+		with stage('open'):
+			self.file=h5py.File(FILE_NAME,'r')   # 'r' means that hdf5 file is open in read-only mode
+			self.schema=schema or detect_schema(self.file)
+		if self.schema is None:
+			self.file.close()
+			raise ValueError('The file named : '+FILE_NAME+' is not a valid OMI file.')
+		self.dataFields=self.file[self.schema.data_path]
+		self.geolocation=self.file[self.schema.geolocation_path]
+		self._handles={}
+		self._lat=None
+		self._lon=None
+		self._quality={}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc_info):
+		self.close()
+
+	def close(self):
+		self.file.close()
+
+	@property
+	def product(self):
+		return self.schema.product
+
+	@property
+	def sds_names(self):
+		'''Names of the SDS in the data fields group.'''
+		return [name for name in self.dataFields if isinstance(self.dataFields[name],h5py.Dataset)]
+
+	def __contains__(self,SDS_NAME):
+		return SDS_NAME in self.dataFields
+
+	def __getitem__(self,SDS_NAME):
+		'''
+		SDSHandle of one SDS (KeyError if the file does not contain it).
+		'''
+		if SDS_NAME not in self._handles:
+			if SDS_NAME not in self.dataFields:
+				raise KeyError('Sorry, your '+self.schema.instrument+' file does not contain the SDS: '+SDS_NAME+'. Please try again with the correct file type.')
+			self._handles[SDS_NAME]=SDSHandle(self.dataFields[SDS_NAME],self.schema,self.cache)
+		return self._handles[SDS_NAME]
+
+	def read_geolocation(self,name,window=None):
+		'''
+		Reads a geolocation field (or a window of it), without its leading time axis.
+		'''
+		with stage('geolocation'):
+			if self.cache is not None:
+				return _cached(self.cache,self.FILE_NAME,'geo:'+name,window,lambda window: self._read_geolocation(name,window))
+			return self._read_geolocation(name,window)
+
+	def _read_geolocation(self,name,window):
+		dataset=self.geolocation[name]
+		if window is None:
+			window=Ellipsis
+		if self.schema.time_axis:
+			window=(0,)+(window if isinstance(window,tuple) else (window,))
+		data=dataset[window]
+		count_bytes(name,data.nbytes)
+		return data
+
+	@property
+	def lat(self):
+		'''Pixel latitudes (read once).'''
+		if self._lat is None:
+			self._lat=self.read_geolocation(self.schema.latitude)
+		return self._lat
+
+	@property
+	def lon(self):
+		'''Pixel longitudes (read once).'''
+		if self._lon is None:
+			self._lon=self.read_geolocation(self.schema.longitude)
+		return self._lon
+
+	def quality_mask(self,window=None):
+		'''
+		True for the pixels (of a window) that pass the product's quality rules (see
+		omi_quality). Computed once per window and reused for every SDS of the granule.
+		'''
+		from omi_quality import quality_mask
+		key=None if window is None else tuple((part.start,part.stop,part.step) for part in window)
+		if key not in self._quality:
+			self._quality[key]=quality_mask(self,window)
+		return self._quality[key]
+
+	def scan_dates(self,rows=None):
+		'''
+		datetime64[s] time of each scanline (or of a slice of scanlines); NaT for fill values.
+		'''
+		rows=slice(None) if rows is None else rows
+		with stage('time'):
+			if self.schema.instrument == 'OMI':
+				return tai93_to_datetime64(self.read_geolocation(self.schema.time,rows))
+			#TROPOMI: reference time (seconds since 2010-01-01) plus a per-scanline offset in milliseconds
+			reference=np.datetime64('2010-01-01T00:00:00','s')+np.timedelta64(int(self.file['PRODUCT']['time'][0]),'s')
+			delta=self.read_geolocation(self.schema.time,rows)
+			if delta.ndim > 1:
+				delta=delta[:,0]
+			return (reference+delta.astype('timedelta64[ms]')).astype('datetime64[s]')
+
+def read_swath(FILE_NAME,SDS_NAME=None,dtype=np.float64,cache=None,quality=False):
+	'''
+	Reads the lat/lon, scan dates and one decoded SDS (the product's main SDS by default).
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the granule
+	SDS_NAME : str, optional
+		SDS to read instead of the product's main SDS
+	dtype : numpy dtype
+		float64 (default) or float32 for the decoded data
+	cache : omi_cache.FieldCache, optional
+		Cache to use instead of the default one (see Granule)
+	quality : bool
+		Also set the pixels that fail the product's quality rules to NaN (see omi_quality)
+
+	Returns
+	-------
+	swath : dict
+		product ('NO2' or 'SO2'), instrument, SDS_NAME, map_label (units), valid_range
+		(None if the SDS has none), fv, lat, lon, their min/max, scan_dates (datetime64 per
+		scanline), the decoded dataArray (fill/missing values set to NaN) and quality_mask
+		(True for good pixels; None unless quality is set)
+
+	Raises
+	------
+	ValueError
+		If the file is not a recognized NO2/SO2 granule
+	KeyError
+		If the file does not contain the SDS (or a required quality field)
+	'''
+	with Granule(FILE_NAME,cache=cache) as granule:
+		sds=granule[SDS_NAME or granule.schema.main_sds]
+		lat=granule.lat
+		lon=granule.lon
+		dataArray=sds.read(dtype=dtype)
+		mask=None
+		if quality:
+			from omi_quality import apply_mask
+			mask=granule.quality_mask()
+			dataArray=apply_mask(dataArray,mask)
+		swath={'product':granule.product,'instrument':granule.schema.instrument,'SDS_NAME':sds.name,
+			'map_label':sds.units,'valid_range':sds.valid_range,'fv':sds.fill_value,
+			'lat':lat,'lon':lon,'scan_dates':granule.scan_dates(),'dataArray':dataArray,'quality_mask':mask}
+	swath.update({'min_lat':np.min(lat),'max_lat':np.max(lat),'min_lon':np.min(lon),'max_lon':np.max(lon)})
+	return swath
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+'''
+Module: omi_regions.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To compute the mean, median, standard deviation and number of valid pixels of the
+NO2/SO2 columns in each of a set of polygons (cities, administrative regions, ...) given as
+GeoJSON, for every granule
+
+The polygons of a GeoJSON file (Polygon and MultiPolygon features, holes included) are
+turned into a RegionSet. For a swath, each region first keeps only the pixels inside its
+lat/lon bounding box (found with a binary search on the pixels sorted by latitude), and
+then tests those against its polygon edges with a vectorized even-odd (ray crossing) rule.
+The result, a list of (pixel, region) pairs, is the pixel-to-region assignment. It depends
+only on the swath geometry, so it is kept in memory keyed by a hash of the lat/lon arrays
+(the NO2 and SO2 granules of the same orbit share it), and, when the cache directory of
+omi_cache.py is set up, on disk for later runs. The statistics of every region are then
+computed from the decoded field with one gather, one sort and a few np.bincount calls.
+
+A pixel belongs to every region that contains its centre, so overlapping regions (a city
+and its state) each get it. Polygons are taken in plain lon/lat degrees and must not cross
+the antimeridian.
+
+Examples:
+	python omi_regions.py counties.geojson fileList.txt --name-property NAME
+	python omi_regions.py cities.geojson fileList.txt --quality --csv city_no2.csv
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import csv
+import hashlib
+import json
+import sys
+from collections import OrderedDict
+import numpy as np
+from omi_cache import default_cache
+from omi_instrument import granule_label, stage
+
+#number of swath geometries whose assignment is kept in memory
+ASSIGNMENT_CACHE=32
+
+#largest number of (pixel, edge) pairs tested at once in the point-in-polygon test
+_BLOCK=4000000
+
+def _rings(geometry):
+	#lists of [lon, lat] rings of a Polygon or MultiPolygon geometry
+	if geometry['type'] == 'Polygon':
+		return [np.asarray(ring,dtype=np.float64)[:,:2] for ring in geometry['coordinates']]
+	if geometry['type'] == 'MultiPolygon':
+		return [np.asarray(ring,dtype=np.float64)[:,:2] for polygon in geometry['coordinates'] for ring in polygon]
+	raise ValueError('Only Polygon and MultiPolygon geometries can be regions, not '+geometry['type'])
+
+def polygon_contains(edges,lat,lon):
+	'''
+	Even-odd test of which points are inside a polygon.
+
+	Parameters
+	----------
+	edges : numpy.ndarray
+		(n, 4) array of x0, y0, x1, y1 (lon, lat) of every edge of every ring of the polygon
+	lat, lon : numpy.ndarray
+		1-D point locations
+
+	Returns
+	-------
+	inside : numpy.ndarray
+		Boolean array, True for the points inside (holes and the parts of a multipolygon
+		follow from the even-odd rule)
+	'''
+	x0,y0,x1,y1=[column[np.newaxis,:] for column in edges.T]
+	#edges that are not horizontal, and where a horizontal ray from the point would cross them
+	with np.errstate(divide='ignore',invalid='ignore'):
+		slope=(x1-x0)/(y1-y0)
+	inside=np.zeros(lat.size,dtype=bool)
+	step=max(1,_BLOCK//max(1,edges.shape[0]))
+	for start in range(0,lat.size,step):
+		y=lat[start:start+step,np.newaxis]
+		x=lon[start:start+step,np.newaxis]
+		crossing=((y0>y)!=(y1>y))&(x<x0+(y-y0)*slope)
+		inside[start:start+step]=np.count_nonzero(crossing,axis=1)%2 == 1
+	return inside
+
+class RegionAssignment(object):
+	'''
+	Which swath pixels are in which region.
+
+	Parameters
+	----------
+	pixels, regions : numpy.ndarray
+		Flat pixel index and region index of every (pixel, region) pair, sorted by region
+	count : int
+		Number of regions
+	'''
+	def __init__(self,pixels,regions,count):
+		self.pixels=pixels
+		self.regions=regions
+		self.count=count
+
+	def statistics(self,dataArray):
+		'''
+		Count, mean, median and standard deviation of the valid values in every region.
+
+		Parameters
+		----------
+		dataArray : numpy.ndarray
+			Decoded field of the swath the assignment was made for (NaN where missing)
+
+		Returns
+		-------
+		stats : dict
+			count, average, median and stdev: 1-D arrays with one value per region (NaN
+			for regions without a valid pixel; stdev is the population standard deviation,
+			like np.nanstd)
+		'''
+		with stage('regions'):
+			values=np.asarray(dataArray,dtype=np.float64).ravel()[self.pixels]
+			valid=~np.isnan(values)
+			values=values[valid]
+			regions=self.regions[valid]
+			count=np.bincount(regions,minlength=self.count)
+			with np.errstate(invalid='ignore',divide='ignore'):
+				average=np.bincount(regions,weights=values,minlength=self.count)/count
+				deviation=values-average[regions]
+				stdev=np.sqrt(np.bincount(regions,weights=deviation*deviation,minlength=self.count)/count)
+			#the values of each region in order, so the median is the middle one (or two)
+			ordered=values[np.lexsort((values,regions))]
+			start=np.r_[0,np.cumsum(count)[:-1]]
+			median=np.full(self.count,np.nan)
+			has=count>0
+			median[has]=(ordered[start[has]+(count[has]-1)//2]+ordered[start[has]+count[has]//2])/2
+		return {'count':count,'average':average,'median':median,'stdev':stdev}
+
+class RegionSet(object):
+	'''
+	Polygons to aggregate swath pixels over.
+
+	Parameters
+	----------
+	names : list of str
+		Name of each region
+	rings : list of list of numpy.ndarray
+		Rings ((n, 2) arrays of lon, lat) of each region, outer boundaries and holes alike
+	'''
+	def __init__(self,names,rings):
+		self.names=list(names)
+		self.edges=[]
+		bboxes=[]
+		digest=hashlib.sha1()
+		for name,region_rings in zip(self.names,rings):
+			self.edges.append(np.concatenate([np.column_stack((ring,np.roll(ring,-1,axis=0))) for ring in region_rings]))
+			points=np.concatenate(region_rings)
+			bboxes.append((points[:,1].min(),points[:,1].max(),points[:,0].min(),points[:,0].max()))
+			digest.update(name.encode('utf-8'))
+			for ring in region_rings:
+				digest.update(np.ascontiguousarray(ring).tobytes())
+		#(min_lat, max_lat, min_lon, max_lon) of each region
+		self.bboxes=np.array(bboxes,dtype=np.float64).reshape(-1,4)
+		#changes whenever a name or a vertex changes, so cached assignments are never stale
+		self.signature=digest.hexdigest()
+		self._assignments=OrderedDict()
+
+	@classmethod
+	def from_geojson(cls,path,name_property='name'):
+		'''
+		Reads the Polygon and MultiPolygon features of a GeoJSON file (a FeatureCollection,
+		a Feature or a bare geometry). Each region is named by its name_property property,
+		or its id, or its position in the file.
+		'''
+		with open(path,'r') as infile:
+			document=json.load(infile)
+		if document.get('type') == 'FeatureCollection':
+			features=document['features']
+		elif document.get('type') == 'Feature':
+			features=[document]
+		else:
+			features=[{'type':'Feature','geometry':document,'properties':{}}]
+		names=[]
+		rings=[]
+		for i,feature in enumerate(features):
+			if not feature.get('geometry'):
+				continue
+			properties=feature.get('properties') or {}
+			names.append(str(properties.get(name_property,feature.get('id',i))))
+			rings.append(_rings(feature['geometry']))
+		if not names:
+			raise ValueError('No polygons in '+path)
+		return cls(names,rings)
+
+	def __len__(self):
+		return len(self.names)
+
+	def assign(self,lat,lon):
+		'''
+		Finds the pixels of a swath that are in each region (see RegionAssignment).
+
+		Parameters
+		----------
+		lat, lon : numpy.ndarray
+			2-D pixel latitudes and longitudes of the swath
+		'''
+		flat_lat=np.asarray(lat,dtype=np.float64).ravel()
+		flat_lon=np.asarray(lon,dtype=np.float64).ravel()
+		valid=np.flatnonzero(np.isfinite(flat_lat)&np.isfinite(flat_lon)&(np.abs(flat_lat)<=90))
+		#pixels sorted by latitude, so the latitude range of a bounding box is two binary searches
+		order=valid[np.argsort(flat_lat[valid],kind='stable')]
+		sorted_lat=flat_lat[order]
+		pixels=[]
+		regions=[]
+		with stage('assign'):
+			for i,(min_lat,max_lat,min_lon,max_lon) in enumerate(self.bboxes):
+				candidates=order[np.searchsorted(sorted_lat,min_lat,'left'):np.searchsorted(sorted_lat,max_lat,'right')]
+				candidates=candidates[(flat_lon[candidates]>=min_lon)&(flat_lon[candidates]<=max_lon)]
+				inside=np.sort(candidates[polygon_contains(self.edges[i],flat_lat[candidates],flat_lon[candidates])])
+				pixels.append(inside)
+				regions.append(np.full(inside.size,i,dtype=np.int64))
+		return RegionAssignment(np.concatenate(pixels).astype(np.int64),np.concatenate(regions),len(self))
+
+	def assignment(self,lat,lon,FILE_NAME=None,cache=None):
+		'''
+		assign() with caching: in memory by swath geometry and, given the granule's name and a
+		FieldCache (omi_cache.default_cache() if None), on disk.
+		'''
+		lat=np.ascontiguousarray(lat)
+		lon=np.ascontiguousarray(lon)
+		key=hashlib.sha1(lat.tobytes()+lon.tobytes()+str(lat.shape).encode()).hexdigest()
+		if key in self._assignments:
+			self._assignments.move_to_end(key)
+			return self._assignments[key]
+		cache=default_cache() if cache is None else cache
+		if FILE_NAME is not None and cache is not None:
+			def compute():
+				assignment=self.assign(lat,lon)
+				return np.column_stack((assignment.pixels,assignment.regions))
+			pairs=cache.get_or_compute(FILE_NAME,'regions:'+self.signature,compute)
+			assignment=RegionAssignment(np.array(pairs[:,0]),np.array(pairs[:,1]),len(self))
+		else:
+			assignment=self.assign(lat,lon)
+		self._assignments[key]=assignment
+		if len(self._assignments) > ASSIGNMENT_CACHE:
+			self._assignments.popitem(last=False)
+		return assignment
+
+def region_report(FILE_NAME,regions,quality=False):
+	'''
+	Reads a granule and computes the statistics of its main SDS in every region.
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the OMI he5 (or TROPOMI nc) file
+	regions : RegionSet
+		Regions to aggregate over
+	quality : bool
+		Leave out pixels that fail the product's quality rules (see omi_quality)
+
+	Returns
+	-------
+	results : list of dict
+		region (name), count, average, median and stdev per region, in the order of the
+		regions, plus SDS_NAME
+	'''
+	from omi_reader import read_swath
+	swath=read_swath(FILE_NAME,quality=quality)
+	assignment=regions.assignment(swath['lat'],swath['lon'],FILE_NAME)
+	stats=assignment.statistics(swath['dataArray'])
+	return [{'region':name,'SDS_NAME':swath['SDS_NAME'],'count':int(stats['count'][i]),'average':float(stats['average'][i]),
+		'median':float(stats['median'][i]),'stdev':float(stats['stdev'][i])} for i,name in enumerate(regions.names)]
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Average OMI NO2/SO2 granules over the polygons of a GeoJSON file.')
+	parser.add_argument('geojson',help='GeoJSON file of Polygon/MultiPolygon features')
+	parser.add_argument('lists',nargs='*',default=['fileList.txt'],help='text files listing granules (default fileList.txt)')
+	parser.add_argument('--name-property',default='name',help='feature property naming each region (default name)')
+	parser.add_argument('--quality',action='store_true',help='leave out pixels that fail the quality flags (see omi_quality.py)')
+	parser.add_argument('--csv',help='also write one row per granule and region to this CSV file')
+	parser.add_argument('--all',action='store_true',help='also print regions without valid pixels')
+	options=parser.parse_args(argv)
+	regions=RegionSet.from_geojson(options.geojson,options.name_property)
+	file_names=[]
+	for list_file in options.lists:
+		with open(list_file,'r') as fileList:
+			file_names.extend(line.strip() for line in fileList if line.strip())
+	rows=[]
+	failed=0
+	for FILE_NAME in file_names:
+		with granule_label(FILE_NAME):
+			try:
+				results=region_report(FILE_NAME,regions,options.quality)
+			except Exception as error:
+				failed+=1
+				print('FAILED',FILE_NAME,'{0}: {1}'.format(type(error).__name__,error))
+				continue
+		print('\n'+FILE_NAME)
+		for result in results:
+			result['file']=FILE_NAME
+			rows.append(result)
+			if result['count'] or options.all:
+				print('\t{0}: count={1} average={2:.6g} median={3:.6g} stdev={4:.6g}'.format(result['region'],result['count'],
+					result['average'],result['median'],result['stdev']))
+	if options.csv:
+		with open(options.csv,'w',newline='') as outfile:
+			writer=csv.DictWriter(outfile,('file','SDS_NAME','region','count','average','median','stdev'))
+			writer.writeheader()
+			writer.writerows(rows)
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,301 @@
+#!/usr/bin/python
+'''
+Module: omi_render.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To draw many maps of OMI NO2/SO2 granules, composites or cube time steps to PNG
+files without a display, several at a time in worker processes
+
+read_and_map_omi_no2_so2.py builds a new Basemap and draws every swath pixel as a
+quadrilateral with pcolormesh, which is slow for hundreds of maps. Here each process builds
+the figure, projection, coastlines and colorbar once (a MapCanvas) and reuses it for every
+map it draws. Swaths are first rasterized onto a regular image grid by binning their pixels
+with np.bincount (see omi_binning.GridAccumulator); empty image cells next to filled ones
+take the mean of their neighbours, so gaps between pixels do not show as holes. The image
+is then drawn with a single imshow.
+
+Inputs can be granules (he5/nc), composites saved by omi_binning.py (.npz), or the time
+steps of a cube made by omi_store.py (--store).
+
+Examples:
+	python omi_render.py --list fileList.txt --workers 8 --out maps
+	python omi_render.py omi_l3_2019-05-*.npz --vmax 1e16 --out maps
+	python omi_render.py --store omi_no2.h5 --workers 8 --vmax 1e16 --out daily_maps
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+from omi_binning import GridAccumulator, LatLonGrid
+from omi_instrument import add_records, enable, granule_label, reset, stage, take_records
+
+#cell size (degrees) of the image grid swaths are rasterized onto
+IMAGE_RESOLUTION=0.25
+
+#part of the largest value the colour scale ends at, when no vmax is given (as in read_and_map_omi_no2_so2.py)
+VMAX_FRACTION=0.35
+
+def _fill_gaps(image):
+	#empty cells with at least one filled neighbour (of 8) take the neighbours' mean
+	filled=np.isfinite(image)
+	values=np.pad(np.where(filled,image,0.0),1)
+	counts=np.pad(filled.astype(np.int32),1)
+	total=sliding_window_view(values,(3,3)).sum(axis=(2,3))
+	number=sliding_window_view(counts,(3,3)).sum(axis=(2,3))
+	gaps=~filled&(number>0)
+	image=image.copy()
+	image[gaps]=total[gaps]/number[gaps]
+	return image
+
+def rasterize(lat,lon,values,grid,fill=1):
+	'''
+	Resamples swath pixels onto a regular grid (mean of the pixels in each cell).
+
+	Parameters
+	----------
+	lat, lon, values : numpy.ndarray
+		Pixel locations and decoded values, all the same shape (NaN values are skipped)
+	grid : LatLonGrid
+		Image grid
+	fill : int
+		Number of times empty cells next to filled ones are filled in (0 for none)
+
+	Returns
+	-------
+	image : numpy.ndarray
+		2-D array of the grid's shape, row 0 at the southern edge, NaN where empty
+	'''
+	with stage('rasterize'):
+		image=GridAccumulator(grid).add(lat,lon,values).mean()
+		for i in range(fill):
+			image=_fill_gaps(image)
+	return image
+
+class MapCanvas(object):
+	'''
+	Off-screen figure with a map, an image and a colorbar, redrawn for each map.
+
+	Parameters
+	----------
+	bounds : (min_lat, max_lat, min_lon, max_lon)
+		Extent of the map
+	'''
+	def __init__(self,bounds=(-90.0,90.0,-180.0,180.0)):
+		import matplotlib
+		#draw without a display so that maps can be made in batch jobs and worker processes
+		matplotlib.use('Agg')
+		from mpl_toolkits.basemap import Basemap
+		import matplotlib.pyplot as plt
+		min_lat,max_lat,min_lon,max_lon=bounds
+		with stage('canvas'):
+			self.fig=plt.figure()
+			m = Basemap(projection='cyl', resolution='l',
+						llcrnrlat=min_lat, urcrnrlat = max_lat,
+						llcrnrlon=min_lon, urcrnrlon = max_lon)
+			m.drawcoastlines(linewidth=0.5)
+			m.drawparallels(np.arange(-90., 120., 30.), labels=[1, 0, 0, 0])
+			m.drawmeridians(np.arange(-180, 180., 45.), labels=[0, 0, 0, 1])
+			my_cmap = plt.get_cmap('gist_stern_r').copy()
+			my_cmap.set_under('w')
+			#in the cylindrical projection map coordinates are degrees, so the image is placed by its lat/lon extent
+			self.image=m.imshow(np.full((2,2),np.nan),cmap=my_cmap,vmin=0,vmax=1,interpolation='nearest')
+			self.colorbar=m.colorbar(self.image)
+			self.title=plt.title('')
+
+	def render(self,image,bounds,pngfile,title='',label='',vmax=None):
+		'''
+		Draws an image (row 0 at its southern edge) and saves the map to a PNG file.
+
+		Parameters
+		----------
+		image : numpy.ndarray
+			2-D values, NaN where missing
+		bounds : (min_lat, max_lat, min_lon, max_lon)
+			Extent of the image
+		pngfile : str
+			Where to save the map
+		title, label : str
+			Title of the map and label of the colorbar
+		vmax : float, optional
+			Top of the colour scale (VMAX_FRACTION of the largest value by default)
+		'''
+		if vmax is None:
+			vmax=np.nanmax(image)*VMAX_FRACTION if np.isfinite(image).any() else 1.0
+		with stage('plot'):
+			self.image.set_data(np.ma.masked_invalid(image))
+			self.image.set_extent((bounds[2],bounds[3],bounds[0],bounds[1]))
+			self.image.set_clim(0,vmax)
+			self.colorbar.update_normal(self.image)
+			self.colorbar.set_label(label)
+			self.title.set_text(title)
+			self.fig.savefig(pngfile)
+
+#one canvas per map extent, built the first time this process draws a map of that extent
+_canvases={}
+
+def get_canvas(bounds=(-90.0,90.0,-180.0,180.0)):
+	'''The MapCanvas of this process for a map extent.'''
+	bounds=tuple(float(bound) for bound in bounds)
+	if bounds not in _canvases:
+		_canvases[bounds]=MapCanvas(bounds)
+	return _canvases[bounds]
+
+def render_swath(FILE_NAME,pngfile,swath=None,resolution=IMAGE_RESOLUTION,vmax=None,quality=False):
+	'''
+	Rasterizes the main SDS of a granule and saves a global map of it to a PNG file.
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the OMI he5 (or TROPOMI nc) file
+	pngfile : str
+		Where to save the map
+	swath : dict, optional
+		Output of read_swath, if the file has already been read
+	resolution : float
+		Cell size of the image grid in degrees
+	vmax : float, optional
+		Top of the colour scale
+	quality : bool
+		Leave out pixels that fail the product's quality rules (see omi_quality)
+	'''
+	if swath is None:
+		from omi_reader import read_swath
+		swath=read_swath(FILE_NAME,quality=quality)
+	grid=LatLonGrid(resolution)
+	image=rasterize(swath['lat'],swath['lon'],swath['dataArray'],grid)
+	get_canvas().render(image,grid.bounds,pngfile,'{0}\n {1}'.format(FILE_NAME, swath['SDS_NAME']),swath['map_label'],vmax)
+
+def render_composite(path,pngfile,vmax=None):
+	'''Saves a map of the mean of a composite saved by omi_binning.py (.npz).'''
+	accumulator=GridAccumulator.load(path)
+	bounds=accumulator.grid.bounds
+	get_canvas().render(accumulator.mean(),bounds,pngfile,'{0}\n mean'.format(path),'',vmax)
+
+def render_store_step(path,index,pngfile,vmax=None):
+	'''Saves a map of the mean of one time step of a cube made by omi_store.py.'''
+	from omi_store import CubeStore
+	with CubeStore(path) as store:
+		image=store.step(index)['mean']
+		time=store.times[index].astype('datetime64[{0}]'.format('D' if store.period == 'day' else 'M'))
+		get_canvas().render(image,store.grid.bounds,pngfile,'{0}\n {1} {2}'.format(os.path.basename(path),store.SDS_NAME,time),store.SDS_NAME,vmax)
+
+def render_job(job,options):
+	'''
+	Draws one map, turning any error into a result instead of stopping the run.
+
+	Parameters
+	----------
+	job : tuple
+		(source, pngfile), the source being a granule, a .npz composite, or a (store, time
+		step index) pair
+	options : dict
+		resolution, vmax and quality
+
+	Returns
+	-------
+	pngfile : str
+	error : str or None
+	'''
+	source,pngfile=job
+	name=source[0] if isinstance(source,tuple) else source
+	with granule_label(name):
+		try:
+			if isinstance(source,tuple):
+				render_store_step(source[0],source[1],pngfile,options['vmax'])
+			elif source.lower().endswith('.npz'):
+				render_composite(source,pngfile,options['vmax'])
+			else:
+				render_swath(source,pngfile,None,options['resolution'],options['vmax'],options['quality'])
+		except Exception as error:
+			return pngfile,'{0}: {1}'.format(type(error).__name__,error)
+	return pngfile,None
+
+def _render_worker(arguments):
+	#the instrumentation records of the worker go back with its results
+	jobs,options=arguments
+	return [render_job(job,options) for job in jobs],take_records()
+
+def render_many(jobs,workers=1,resolution=IMAGE_RESOLUTION,vmax=None,quality=False):
+	'''
+	Draws many maps, in worker processes when workers > 1 (each worker builds its canvas once).
+
+	Parameters
+	----------
+	jobs : list of tuple
+		(source, pngfile) per map, as in render_job
+	workers : int
+		Number of worker processes
+	resolution, vmax, quality :
+		As in render_swath
+
+	Returns
+	-------
+	results : list of (str, str or None)
+		PNG file and error (None if it was saved) per job, in order
+	'''
+	options={'resolution':resolution,'vmax':vmax,'quality':quality}
+	if workers <= 1 or len(jobs) < 2:
+		return [render_job(job,options) for job in jobs]
+	#interleaved shares, so every worker builds its canvas once for a whole share of maps
+	shares=[(jobs[i::workers],options) for i in range(workers) if jobs[i::workers]]
+	results=[None]*len(jobs)
+	with ProcessPoolExecutor(max_workers=len(shares),initializer=reset) as pool:
+		for i,(share_results,records) in enumerate(pool.map(_render_worker,shares)):
+			add_records(records)
+			results[i::len(shares)]=share_results
+	return results
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Draw maps of OMI NO2/SO2 granules, composites or cube time steps to PNG files without a display.')
+	parser.add_argument('inputs',nargs='*',help='granules or .npz composites (paths or glob patterns)')
+	parser.add_argument('--list',action='append',default=[],help='text file listing granules (default: fileList.txt when no inputs or --store are given)')
+	parser.add_argument('--store',help='also draw every time step of this cube (see omi_store.py)')
+	parser.add_argument('--out',help='folder for the PNG files (default: next to each input)')
+	parser.add_argument('--workers','-j',type=int,default=1,help='number of worker processes (default 1)')
+	parser.add_argument('--resolution',type=float,default=IMAGE_RESOLUTION,help='image grid cell size in degrees for granules (default 0.25)')
+	parser.add_argument('--vmax',type=float,help='top of the colour scale, the same for every map (default: a fraction of each map\'s largest value)')
+	parser.add_argument('--quality',action='store_true',help='leave out pixels that fail the quality flags (see omi_quality.py)')
+	parser.add_argument('--instrument',help='write per-stage timing and memory records to this JSON (or .csv) file (see omi_instrument.py)')
+	options=parser.parse_args(argv)
+	if options.instrument:
+		os.environ['OMI_INSTRUMENT']=options.instrument
+		enable(options.instrument,os.environ.get('OMI_INSTRUMENT_MEMORY','1') != '0')
+	from omi_batch import expand_inputs
+	list_files=options.list or ([] if options.inputs or options.store else ['fileList.txt'])
+	try:
+		sources=expand_inputs(options.inputs,list_files)
+	except OSError:
+		print('Did not find a text file containing file names (perhaps name does not match)')
+		return 2
+	jobs=[(source,os.path.splitext(source)[0]+'.png') for source in sources]
+	if options.store:
+		from omi_store import CubeStore
+		with CubeStore(options.store) as store:
+			unit='D' if store.period == 'day' else 'M'
+			stem=os.path.splitext(options.store.rstrip('/\\'))[0]
+			jobs.extend(((options.store,i),'{0}_{1}.png'.format(stem,time.astype('datetime64[{0}]'.format(unit))))
+				for i,time in enumerate(store.times))
+	if options.out:
+		if not os.path.isdir(options.out):
+			os.makedirs(options.out)
+		jobs=[(source,os.path.join(options.out,os.path.basename(pngfile))) for source,pngfile in jobs]
+	failed=0
+	for pngfile,error in render_many(jobs,options.workers,options.resolution,options.vmax,options.quality):
+		if error:
+			failed+=1
+			print('FAILED',pngfile,error)
+		else:
+			print('Saved',pngfile)
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
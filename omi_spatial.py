@@ -0,0 +1,149 @@
+#!/usr/bin/python
+'''
+Module: omi_spatial.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To find the OMI pixel nearest to many lat/lon locations at once
+
+A SwathIndex is built once per granule from its 2-D Latitude/Longitude arrays: the pixel
+centres are placed on the unit sphere (x, y, z) and stored in a KD-tree, where straight
+line (chord) distance increases with great circle distance. Each query takes the few
+pixels the tree returns near the closest one and ranks them with the same haversine
+formula the location tool uses, so the chosen pixel is exactly the one the full haversine
+argmin would pick (including its first-index rule for ties).
+
+scipy is optional; without it the index falls back to the full haversine search.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import numpy as np
+
+try:
+	from scipy.spatial import cKDTree
+except ImportError:
+	cKDTree = None
+
+R=6371000#radius of the earth in meters
+
+#slack added to the KD-tree search radius so that every pixel whose (float32) haversine
+#distance could tie with or beat the closest chord distance is re-ranked
+_RTOL=1e-3
+_ATOL=1e-5
+
+def haversine(lat,lon,user_lat,user_lon):
+	'''
+	Great circle distance (m) from one location to every pixel, computed exactly as the
+	location tool has always done it (so that argmin results agree bit for bit).
+
+	Parameters
+	----------
+	lat, lon : numpy.ndarray
+		Pixel latitudes and longitudes (degrees)
+	user_lat, user_lon : float
+		Location (Deg. N, Deg. E)
+
+	Returns
+	-------
+	d : numpy.ndarray
+		Distance to each pixel in meters, same shape and float type as lat
+	'''
+	lat1=np.radians(user_lat)
+	lat2=np.radians(lat)
+	delta_lat=np.radians(lat-user_lat)
+	delta_lon=np.radians(lon-user_lon)
+	a=(np.sin(delta_lat/2))*(np.sin(delta_lat/2))+(np.cos(lat1))*(np.cos(lat2))*(np.sin(delta_lon/2))*(np.sin(delta_lon/2))
+	c=2*np.arctan2(np.sqrt(a),np.sqrt(1-a))
+	return R*c
+
+def nearest_pixel(lat,lon,user_lat,user_lon):
+	'''
+	Finds the (x, y) index of the pixel nearest to one location with a full haversine search.
+	'''
+	d=haversine(lat,lon,user_lat,user_lon)
+	x,y=np.unravel_index(d.argmin(),d.shape)
+	return x,y
+
+def _unit_vectors(lat,lon):
+	#lat/lon in degrees to points on the unit sphere
+	lat=np.radians(np.asarray(lat,dtype=np.float64))
+	lon=np.radians(np.asarray(lon,dtype=np.float64))
+	cos_lat=np.cos(lat)
+	return np.column_stack((cos_lat*np.cos(lon),cos_lat*np.sin(lon),np.sin(lat)))
+
+class SwathIndex(object):
+	'''
+	Nearest-pixel index over the 2-D lat/lon arrays of one granule.
+
+	Parameters
+	----------
+	lat, lon : numpy.ndarray
+		2-D pixel latitudes and longitudes (degrees), as read from the Geolocation Fields
+	'''
+	def __init__(self,lat,lon):
+		self.lat=lat
+		self.lon=lon
+		self.shape=lat.shape
+		#pixels with fill values or impossible coordinates are left out of the tree
+		flat_lat=lat.ravel()
+		flat_lon=lon.ravel()
+		valid=np.isfinite(flat_lat)&np.isfinite(flat_lon)&(np.abs(flat_lat)<=90)
+		self.pixels=np.flatnonzero(valid)
+		self.tree=None
+		if cKDTree is not None:
+			self.tree=cKDTree(_unit_vectors(flat_lat[valid],flat_lon[valid]))
+
+	def query(self,user_lats,user_lons):
+		'''
+		Finds the nearest pixel to each location.
+
+		Parameters
+		----------
+		user_lats, user_lons : array_like
+			Locations (Deg. N, Deg. E); scalars or 1-D arrays of the same length
+
+		Returns
+		-------
+		x, y : numpy.ndarray
+			Row (scanline) and column (cross-track) index of the nearest pixel to each location
+		d : numpy.ndarray
+			Haversine distance to that pixel (m)
+		'''
+		user_lats=np.atleast_1d(np.asarray(user_lats,dtype=np.float64))
+		user_lons=np.atleast_1d(np.asarray(user_lons,dtype=np.float64))
+		if self.tree is None or self.pixels.size == 0:
+			return self._query_full(user_lats,user_lons)
+		points=_unit_vectors(user_lats,user_lons)
+		chord,_=self.tree.query(points)
+		#gather the candidates of every location into one flat list, then rank them all at once
+		neighbours=self.tree.query_ball_point(points,chord*(1+_RTOL)+_ATOL)
+		counts=np.array([len(n) for n in neighbours])
+		site=np.repeat(np.arange(user_lats.size),counts)
+		flat=self.pixels[np.concatenate(neighbours).astype(np.intp)]
+		flat_lat=self.lat.ravel()
+		flat_lon=self.lon.ravel()
+		offsets=np.r_[0,np.cumsum(counts)]
+		d=np.empty(flat.size)
+		for i in range(user_lats.size):
+			#the formula is evaluated with a plain float location, as the location tool does, on that location's few candidates
+			members=slice(offsets[i],offsets[i+1])
+			d[members]=haversine(flat_lat[flat[members]],flat_lon[flat[members]],float(user_lats[i]),float(user_lons[i]))
+		#smallest distance first and, between equal distances, the lowest flat index (like argmin)
+		order=np.lexsort((flat,d,site))
+		first=order[offsets[:-1]]
+		x,y=np.unravel_index(flat[first],self.shape)
+		return x,y,d[first]
+
+	def _query_full(self,user_lats,user_lons):
+		#full haversine search, used when scipy is not installed
+		x=np.empty(user_lats.size,dtype=np.intp)
+		y=np.empty(user_lats.size,dtype=np.intp)
+		d=np.empty(user_lats.size)
+		for i in range(user_lats.size):
+			distance=haversine(self.lat,self.lon,float(user_lats[i]),float(user_lons[i]))
+			x[i],y[i]=np.unravel_index(distance.argmin(),distance.shape)
+			d[i]=distance[x[i],y[i]]
+		return x,y,d
@@ -0,0 +1,528 @@
+#!/usr/bin/python
+'''
+Module: omi_store.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To append daily or monthly gridded composites of many OMI NO2/SO2 granules to one
+compressed, chunked (time, lat, lon) data cube, stored as a single HDF5 file or a Zarr
+directory, so that later analyses read arrays instead of re-parsing text files
+
+The cube holds the mean, standard deviation and pixel count of the decoded (and, with
+--quality, quality-masked) main SDS in each grid cell and time step, with time (seconds
+since 1970-01-01), lat and lon coordinates and the list of granules already stored. Stores
+whose name ends in .zarr are Zarr directories (needs the optional zarr package); any other
+name is an HDF5 file.
+
+Appending granules first reads each granule's scan times to find its time step, adds the
+new time steps to the cube, and then bins the granules of each block of chunk-aligned time
+steps in a worker process. Blocks never share a chunk, so with Zarr every worker writes its
+own chunks straight into the store; an HDF5 file only takes one writer, so there the workers
+send their composites back and the main process writes them. Granules that fall in a time
+step already in the cube are merged into it (the stored mean and standard deviation are
+float32, so a merged step is as precise as float32). Only one append should run on a store
+at a time.
+
+The granules of each block are recorded as soon as its time steps are written. Before the
+blocks are binned, a journal listing the granules of every time step and that step's
+stored totals is saved in the store; if an append stops part way, the next append compares
+the totals with the journal, records the granules of the steps that were written and bins
+the others again, so no granule is counted twice.
+
+Chunks span a few time steps and a tile of grid cells, so the time series of one cell reads
+only the chunks of its tile and never the rest of the grid.
+
+Examples:
+	python omi_store.py append omi_no2.h5 fileList.txt --resolution 0.25 --period day --workers 4
+	python omi_store.py series omi_no2.h5 --lat 38.9 --lon -77.0
+	python omi_store.py info omi_no2.zarr
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from omi_binning import GridAccumulator, LatLonGrid, bin_granules, granule_period
+from omi_instrument import add_records, granule_label, reset, stage, take_records
+
+#(time, lat, lon) chunk shape; lat/lon chunks are cut down to the grid size
+DEFAULT_CHUNKS=(16,64,64)
+
+#time steps a cube can have, as in omi_binning.PERIODS
+STORE_PERIODS=('day','month')
+
+#gridded fields of the cube and their dtype
+CUBE_FIELDS={'mean':np.float32,'std':np.float32,'count':np.int32}
+
+TIME_UNITS='seconds since 1970-01-01 00:00:00'
+
+def store_backend(path):
+	'''Backend of a store: 'zarr' for names ending in .zarr, 'hdf5' otherwise.'''
+	return 'zarr' if path.rstrip('/\\').lower().endswith('.zarr') else 'hdf5'
+
+def _open_group(path,mode):
+	if store_backend(path) == 'zarr':
+		try:
+			import zarr
+		except ImportError:
+			raise ImportError('zarr is needed for .zarr stores (pip install zarr)')
+		return zarr.open_group(path,mode=mode)
+	import h5py
+	return h5py.File(path,mode)
+
+def _create_array(group,name,shape,maxshape,chunks,dtype,fill):
+	if hasattr(group,'id'):
+		#h5py
+		return group.create_dataset(name,shape=shape,maxshape=maxshape,chunks=chunks,dtype=dtype,fillvalue=fill,
+			compression='gzip',compression_opts=4,shuffle=True)
+	return group.create_dataset(name,shape=shape,chunks=chunks,dtype=dtype,fill_value=fill)
+
+class CubeStore(object):
+	'''
+	Appendable (time, lat, lon) cube of gridded composites in an HDF5 file or Zarr directory.
+
+	Parameters
+	----------
+	path : str
+		Store to open (made by CubeStore.create)
+	mode : str
+		'r' to read, 'r+' to append
+	'''
+	def __init__(self,path,mode='r'):
+		self.path=path
+		self.backend=store_backend(path)
+		self.group=_open_group(path,mode)
+		attrs=self.group.attrs
+		self.grid=LatLonGrid(float(attrs['resolution']),tuple(float(bound) for bound in attrs['bounds']))
+		self.period=str(attrs['period'])
+		self.SDS_NAME=str(attrs['SDS_NAME'])
+
+	@classmethod
+	def create(cls,path,grid,SDS_NAME,period='day',chunks=DEFAULT_CHUNKS):
+		'''
+		Makes an empty store (no time steps) and opens it for appending.
+
+		Parameters
+		----------
+		path : str
+			HDF5 file or .zarr directory to create
+		grid : LatLonGrid
+			Grid of the cube
+		SDS_NAME : str
+			SDS the cube holds (granules of other SDS are refused)
+		period : str
+			'day' or 'month', the length of a time step
+		chunks : (int, int, int)
+			Chunk shape along time, lat and lon
+		'''
+		if period not in STORE_PERIODS:
+			raise ValueError('period must be one of '+', '.join(STORE_PERIODS))
+		group=_open_group(path,'w')
+		nlat,nlon=grid.shape
+		chunks=(int(chunks[0]),min(int(chunks[1]),nlat),min(int(chunks[2]),nlon))
+		for name,dtype in CUBE_FIELDS.items():
+			_create_array(group,name,(0,nlat,nlon),(None,nlat,nlon),chunks,dtype,np.nan if dtype == np.float32 else 0)
+		_create_array(group,'time',(0,),(None,),(1024,),np.int64,0)
+		group['lat']=grid.lat
+		group['lon']=grid.lon
+		group.attrs['resolution']=grid.resolution
+		group.attrs['bounds']=list(grid.bounds)
+		group.attrs['period']=period
+		group.attrs['SDS_NAME']=SDS_NAME
+		group.attrs['time_units']=TIME_UNITS
+		if hasattr(group,'id'):
+			import h5py
+			_create_array(group,'granules',(0,),(None,),(1024,),h5py.string_dtype(),None)
+			group.close()
+		else:
+			#Zarr keeps the granule list in the attributes (its arrays have no portable string type)
+			group.attrs['granules']=[]
+		return cls(path,'r+')
+
+	def close(self):
+		if hasattr(self.group,'close'):
+			self.group.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc_info):
+		self.close()
+		return False
+
+	@property
+	def chunks(self):
+		'''Chunk shape of the cube along time, lat and lon.'''
+		return tuple(self.group['mean'].chunks)
+
+	@property
+	def times(self):
+		'''datetime64[s] start of each time step, in the order they were appended.'''
+		return self.group['time'][:].astype('datetime64[s]')
+
+	@property
+	def granules(self):
+		'''Names of the granules already in the cube.'''
+		if self.backend == 'zarr':
+			return list(self.group.attrs['granules'])
+		return [name.decode('utf-8') if isinstance(name,bytes) else name for name in self.group['granules'][:]]
+
+	def add_granules(self,names):
+		'''Records granules as stored, so a later append skips them.'''
+		if not names:
+			return
+		if self.backend == 'zarr':
+			self.group.attrs['granules']=list(self.group.attrs['granules'])+list(names)
+			return
+		granules=self.group['granules']
+		start=granules.shape[0]
+		granules.resize((start+len(names),))
+		granules[start:]=list(names)
+
+	def flush(self):
+		if hasattr(self.group,'flush'):
+			self.group.flush()
+
+	def _step_totals(self,index):
+		#pixel count and sum of the means of a time step, to tell whether it has been rewritten
+		count=int(self.group['count'][index].sum(dtype=np.int64))
+		mean=float(np.nansum(self.group['mean'][index],dtype=np.float64))
+		return count,mean
+
+	def _read_journal(self):
+		if self.backend == 'zarr':
+			text=self.group.attrs.get('journal')
+		elif 'journal' in self.group:
+			text=self.group['journal'][()]
+			text=text.decode('utf-8') if isinstance(text,bytes) else text
+		else:
+			text=None
+		return json.loads(text) if text else None
+
+	def _write_journal(self,journal):
+		text=json.dumps(journal) if journal else None
+		if self.backend == 'zarr':
+			self.group.attrs['journal']=text
+			return
+		import h5py
+		if 'journal' in self.group:
+			del self.group['journal']
+		if text:
+			self.group.create_dataset('journal',data=text,dtype=h5py.string_dtype())
+		self.flush()
+
+	def begin_append(self,steps):
+		'''
+		Saves the journal of an append before any of its time steps is written.
+
+		Parameters
+		----------
+		steps : dict
+			Names of the granules to be merged into each time step index
+		'''
+		journal={}
+		for index,names in steps.items():
+			count,mean=self._step_totals(index)
+			journal[str(index)]={'granules':list(names),'count':count,'mean':mean}
+		self._write_journal(journal)
+
+	def end_append(self):
+		'''Clears the journal once every written time step has its granules recorded.'''
+		self._write_journal(None)
+
+	def recover(self):
+		'''
+		Finishes the record of an append that stopped part way (see begin_append): the
+		granules of the time steps that were written are recorded, those of the others are
+		left to be binned again.
+
+		Returns
+		-------
+		recovered : int
+			Number of granules recorded
+
+		Raises
+		------
+		ValueError
+			If a time step was only partly written (its mean changed but not its count)
+		'''
+		journal=self._read_journal()
+		if not journal:
+			return 0
+		done=set(self.granules)
+		names=[]
+		for index,entry in sorted(journal.items(),key=lambda item: int(item[0])):
+			count,mean=self._step_totals(int(index))
+			if count != entry['count']:
+				#the count is written last, so a changed count means the whole step was written
+				names.extend(name for name in entry['granules'] if name not in done)
+			elif mean != entry['mean']:
+				raise ValueError('Time step {0} of {1} was only partly written; rebuild the store'.format(self.times[int(index)],self.path))
+		self.add_granules(names)
+		self.end_append()
+		return len(names)
+
+	def time_index(self,labels):
+		'''
+		Index of the time step of each period label ('2019-05-01' or '2019-05'), adding
+		the time steps the cube does not have yet at its end.
+		'''
+		times=list(self.group['time'][:])
+		index={}
+		for label in labels:
+			value=int(np.datetime64(label,'s').astype(np.int64))
+			if value not in times:
+				times.append(value)
+			index[label]=times.index(value)
+		if len(times) > self.group['time'].shape[0]:
+			for name in CUBE_FIELDS:
+				self.group[name].resize((len(times),)+self.grid.shape)
+			self.group['time'].resize((len(times),))
+			self.group['time'][:]=np.array(times,dtype=np.int64)
+		return index
+
+	def step(self,index):
+		'''
+		Mean, std and count (2-D arrays) of one time step.
+		'''
+		return dict((name,self.group[name][index]) for name in CUBE_FIELDS)
+
+	def write_steps(self,steps):
+		'''
+		Merges binned granules into time steps of the cube.
+
+		Parameters
+		----------
+		steps : dict
+			GridAccumulator per time step index
+		'''
+		with stage('store'):
+			for index,accumulator in sorted(steps.items()):
+				old=self.step(index)
+				count=old['count'].ravel().astype(np.int64)
+				if count.any():
+					#the stored step goes back into sum/sumsq form and is merged with the new granules
+					mean=np.where(count>0,old['mean'].ravel(),0).astype(np.float64)
+					std=np.where(count>0,old['std'].ravel(),0).astype(np.float64)
+					stored=GridAccumulator(self.grid)
+					stored.count[:]=count
+					stored.sum[:]=mean*count
+					stored.sumsq[:]=(std*std+mean*mean)*count
+					accumulator=stored.merge(accumulator)
+				self.group['mean'][index]=accumulator.mean().astype(np.float32)
+				self.group['std'][index]=np.where(accumulator.counts()>0,accumulator.std(),np.nan).astype(np.float32)
+				#written last, so the journal can tell a complete step from one that was not written
+				self.group['count'][index]=accumulator.counts().astype(np.int32)
+
+	def time_series(self,lat,lon):
+		'''
+		Time series of the cell holding one location, reading only that cell's chunks.
+
+		Parameters
+		----------
+		lat, lon : float
+			Location (degrees)
+
+		Returns
+		-------
+		series : dict
+			time (datetime64[s]), mean, std and count, sorted by time
+		'''
+		cell=int(self.grid.cell_index(np.array([lat]),np.array([lon]))[0])
+		if cell < 0:
+			raise ValueError('{0}, {1} is outside the grid of the store'.format(lat,lon))
+		row,col=divmod(cell,self.grid.shape[1])
+		with stage('store'):
+			series=dict((name,self.group[name][:,row,col]) for name in CUBE_FIELDS)
+		series['time']=self.times
+		order=np.argsort(series['time'],kind='stable')
+		return dict((name,values[order]) for name,values in series.items())
+
+def _plan(file_names,period,SDS_NAME,done):
+	#period label of every granule not in the store yet, from its scan times only
+	from omi_reader import Granule
+	labels={}
+	errors=[]
+	for FILE_NAME in file_names:
+		if os.path.basename(FILE_NAME) in done:
+			continue
+		with granule_label(FILE_NAME):
+			try:
+				with Granule(FILE_NAME) as granule:
+					main_sds=granule.schema.main_sds
+					label=granule_period(granule.scan_dates(),period)
+			except Exception as error:
+				errors.append((FILE_NAME,'{0}: {1}'.format(type(error).__name__,error)))
+				continue
+		if SDS_NAME is not None and main_sds != SDS_NAME:
+			errors.append((FILE_NAME,'holds '+main_sds+', not '+SDS_NAME))
+		elif label is None:
+			errors.append((FILE_NAME,'no valid scan time'))
+		else:
+			SDS_NAME=main_sds
+			labels[FILE_NAME]=label
+	return labels,SDS_NAME,errors
+
+def _store_worker(arguments):
+	#bins the granules of a block of time steps; writes them itself when given the store path
+	steps,grid,quality,depth,max_bytes,path=arguments
+	accumulators={}
+	errors=[]
+	for index,file_names in steps.items():
+		partial,partial_errors=bin_granules(file_names,grid,'all',quality,depth,max_bytes)
+		errors.extend(partial_errors)
+		if 'all' in partial:
+			accumulators[index]=partial['all']
+	if path is not None:
+		with CubeStore(path,'r+') as store:
+			store.write_steps(accumulators)
+		accumulators={}
+	return accumulators,errors,take_records()
+
+def append_granules(path,file_names,grid=None,period='day',workers=1,quality=False,chunks=DEFAULT_CHUNKS,depth=2,max_bytes=None):
+	'''
+	Bins granules into a store, creating it if it does not exist.
+
+	Parameters
+	----------
+	path : str
+		HDF5 file or .zarr directory
+	file_names : list of str
+		OMI (or TROPOMI) NO2/SO2 granules; those already in the store are skipped
+	grid : LatLonGrid, optional
+		Grid of a new store (global 0.25 degree by default); must match an existing store's
+	period : str
+		Time step of a new store, 'day' or 'month'
+	workers : int
+		Number of worker processes
+	quality : bool
+		Leave out pixels that fail the product's quality rules (see omi_quality)
+	chunks : (int, int, int)
+		Chunk shape of a new store
+	depth, max_bytes :
+		Read-ahead of each worker (see omi_prefetch.prefetch)
+
+	Returns
+	-------
+	added : int
+		Number of granules added
+	errors : list of (str, str)
+		Files that could not be added and why
+	'''
+	store=CubeStore(path,'r+') if os.path.exists(path) else None
+	if store is not None and grid is not None and grid != store.grid:
+		store.close()
+		raise ValueError('The grid does not match the grid of '+path)
+	if store is not None:
+		period=store.period
+		try:
+			store.recover()
+		except Exception:
+			store.close()
+			raise
+	labels,SDS_NAME,errors=_plan(file_names,period,store.SDS_NAME if store else None,set(store.granules) if store else set())
+	if not labels:
+		if store is not None:
+			store.close()
+		return 0,errors
+	if store is None:
+		store=CubeStore.create(path,grid or LatLonGrid(),SDS_NAME,period,chunks)
+	try:
+		index=store.time_index(sorted(set(labels.values())))
+		#granules grouped by time step, and time steps by the chunk they are in
+		blocks={}
+		for FILE_NAME,label in labels.items():
+			steps=blocks.setdefault(index[label]//store.chunks[0],{})
+			steps.setdefault(index[label],[]).append(FILE_NAME)
+		names={}
+		for steps in blocks.values():
+			for step,step_files in steps.items():
+				names[step]=[os.path.basename(FILE_NAME) for FILE_NAME in step_files]
+		store.begin_append(names)
+		#Zarr workers write their own chunks; HDF5 composites come back to be written here
+		direct=store.backend == 'zarr' and workers > 1
+		tasks=[(steps,store.grid,quality,depth,max_bytes,path if direct else None) for block,steps in sorted(blocks.items())]
+		if workers <= 1 or len(tasks) < 2:
+			results=map(_store_worker,tasks)
+			pool=None
+		else:
+			pool=ProcessPoolExecutor(max_workers=min(workers,len(tasks)),initializer=reset)
+			results=pool.map(_store_worker,tasks)
+		added=[]
+		try:
+			for (accumulators,block_errors,records),steps in zip(results,[task[0] for task in tasks]):
+				if pool is not None:
+					add_records(records)
+				errors.extend(block_errors)
+				store.write_steps(accumulators)
+				#the granules of a block are recorded as soon as its steps are written
+				failed=set(FILE_NAME for FILE_NAME,error in block_errors)
+				block_added=[os.path.basename(FILE_NAME) for step_files in steps.values() for FILE_NAME in step_files if FILE_NAME not in failed]
+				store.add_granules(block_added)
+				store.flush()
+				added.extend(block_added)
+		finally:
+			if pool is not None:
+				pool.shutdown()
+		store.end_append()
+	finally:
+		store.close()
+	if store.backend == 'zarr':
+		import zarr
+		zarr.consolidate_metadata(path)
+	return len(added),errors
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='Append gridded OMI NO2/SO2 composites to a chunked HDF5/Zarr cube, or read it back.')
+	parser.add_argument('command',choices=('append','series','info'),help='add granules, print the time series of a cell, or describe the store')
+	parser.add_argument('store',help='HDF5 file, or directory ending in .zarr')
+	parser.add_argument('lists',nargs='*',default=['fileList.txt'],help='append: text files listing granules (default fileList.txt)')
+	parser.add_argument('--resolution',type=float,default=0.25,help='grid cell size in degrees for a new store (default 0.25)')
+	parser.add_argument('--bbox',type=float,nargs=4,default=(-90.0,90.0,-180.0,180.0),metavar=('MIN_LAT','MAX_LAT','MIN_LON','MAX_LON'),help='grid extent for a new store (default global)')
+	parser.add_argument('--period',choices=STORE_PERIODS,default='day',help='time step of a new store (default day)')
+	parser.add_argument('--chunks',type=int,nargs=3,default=DEFAULT_CHUNKS,metavar=('TIME','LAT','LON'),help='chunk shape of a new store (default 16 64 64)')
+	parser.add_argument('--workers','-j',type=int,default=1,help='number of worker processes (default 1)')
+	parser.add_argument('--prefetch',type=int,default=2,help='granules read ahead in the background, per worker (default 2, 0 for none)')
+	parser.add_argument('--quality',action='store_true',help='leave out pixels that fail the quality flags (see omi_quality.py)')
+	parser.add_argument('--lat',type=float,help='series: latitude of the cell')
+	parser.add_argument('--lon',type=float,help='series: longitude of the cell')
+	options=parser.parse_args(argv)
+
+	if options.command == 'append':
+		file_names=[]
+		for list_file in options.lists:
+			with open(list_file,'r') as fileList:
+				file_names.extend(line.strip() for line in fileList if line.strip())
+		#the grid options only apply to a new store
+		grid=None if os.path.exists(options.store) else LatLonGrid(options.resolution,options.bbox)
+		added,errors=append_granules(options.store,file_names,grid,options.period,options.workers,options.quality,
+			options.chunks,options.prefetch)
+		for FILE_NAME,error in errors:
+			print('FAILED',FILE_NAME,error)
+		print('Added',added,'granules to',options.store)
+		return 1 if errors else 0
+
+	with CubeStore(options.store) as store:
+		if options.command == 'info':
+			times=np.sort(store.times)
+			print(options.store,'('+store.backend+')')
+			print('SDS:',store.SDS_NAME,' period:',store.period,' granules:',len(store.granules))
+			print('grid:',store.grid.resolution,'degrees',store.grid.bounds,' shape:',store.grid.shape,' chunks:',store.chunks)
+			print('time steps:',len(times),'' if not len(times) else '({0} to {1})'.format(times[0],times[-1]))
+			return 0
+		if options.lat is None or options.lon is None:
+			parser.error('series needs --lat and --lon')
+		series=store.time_series(options.lat,options.lon)
+		print('time,mean,std,count')
+		for i in range(series['time'].size):
+			print('{0},{1:.6g},{2:.6g},{3}'.format(series['time'][i],series['mean'][i],series['std'][i],series['count'][i]))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
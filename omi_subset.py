@@ -0,0 +1,157 @@
+#!/usr/bin/python
+'''
+Module: omi_subset.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To read only the part of an OMI (or TROPOMI) swath that covers a lat/lon box
+
+The scanline/cross-track window that covers the box is found from the lat/lon range of
+each scanline (its "row extents"). Row extents come from the footprint catalog when one is
+given (so not even the Latitude/Longitude arrays are read in full), otherwise from the
+Latitude/Longitude arrays. Only that window of each requested SDS is then read through
+h5py slicing, widened to the dataset's HDF5 chunk boundaries so that every chunk that has
+to be decompressed is used in full. As in omi_catalog, a box with max_lon < min_lon crosses
+the antimeridian.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import numpy as np
+from omi_catalog import row_extents
+from omi_quality import apply_mask
+from omi_reader import Granule
+
+def in_bbox(lat,lon,bbox):
+	'''
+	True for the pixels inside a lat/lon box (min_lat, max_lat, min_lon, max_lon); a box
+	with max_lon < min_lon crosses the antimeridian.
+	'''
+	min_lat,max_lat,min_lon,max_lon=bbox
+	if min_lon <= max_lon:
+		in_lon=(lon>=min_lon)&(lon<=max_lon)
+	else:
+		in_lon=(lon>=min_lon)|(lon<=max_lon)
+	return (lat>=min_lat)&(lat<=max_lat)&in_lon
+
+def rows_in_bbox(extents,bbox):
+	'''
+	True for the scanlines whose lat/lon range (see omi_catalog.row_extents) overlaps a box,
+	with the same antimeridian rule as in_bbox.
+	'''
+	min_lat,max_lat,min_lon,max_lon=bbox
+	with np.errstate(invalid='ignore'):
+		if min_lon <= max_lon:
+			in_lon=(extents[:,3]>=min_lon)&(extents[:,2]<=max_lon)
+		else:
+			in_lon=(extents[:,3]>=min_lon)|(extents[:,2]<=max_lon)
+		return (extents[:,1]>=min_lat)&(extents[:,0]<=max_lat)&in_lon
+
+def _rows_in_bbox(extents,bbox):
+	#first and last scanline whose lat/lon range overlaps the box (None if none does)
+	rows=np.flatnonzero(rows_in_bbox(extents,bbox))
+	if rows.size == 0:
+		return None
+	return rows[0],rows[-1]+1
+
+def _align(start,stop,chunk,size):
+	#widens [start, stop) to whole chunks
+	if not chunk:
+		return start,stop
+	return start//chunk*chunk,min(-(-stop//chunk)*chunk,size)
+
+def find_window(granule,bbox,extents=None,chunks=None):
+	'''
+	Finds the (scanline, cross-track) window of a swath that covers a lat/lon box.
+
+	Parameters
+	----------
+	granule : omi_reader.Granule
+		Open granule
+	bbox : (min_lat, max_lat, min_lon, max_lon)
+		Region of interest (crossing the antimeridian if max_lon < min_lon)
+	extents : numpy.ndarray, optional
+		Cached row extents (see omi_catalog.row_extents); computed from the full lat/lon
+		arrays if not given
+	chunks : tuple, optional
+		HDF5 chunk shape to align the window to
+
+	Returns
+	-------
+	window : tuple of slice or None
+		(scanline slice, cross-track slice), or None if no pixel is in the box
+	'''
+	if extents is None:
+		extents=row_extents(granule.lat,granule.lon)
+	rows=_rows_in_bbox(extents,bbox)
+	if rows is None:
+		return None
+	#only the candidate scanlines of lat/lon are read to find the cross-track range
+	lat=granule.read_geolocation(granule.schema.latitude,slice(rows[0],rows[1]))
+	lon=granule.read_geolocation(granule.schema.longitude,slice(rows[0],rows[1]))
+	inside=in_bbox(lat,lon,bbox)
+	if not inside.any():
+		return None
+	row_hits=np.flatnonzero(inside.any(axis=1))
+	col_hits=np.flatnonzero(inside.any(axis=0))
+	row0,row1=rows[0]+row_hits[0],rows[0]+row_hits[-1]+1
+	col0,col1=col_hits[0],col_hits[-1]+1
+	if chunks is not None:
+		row0,row1=_align(row0,row1,chunks[0],extents.shape[0])
+		col0,col1=_align(col0,col1,chunks[1],lat.shape[1])
+	return slice(int(row0),int(row1)),slice(int(col0),int(col1))
+
+def read_subset(FILE_NAME,bbox,sds_names=None,catalog=None,align=True,quality=False):
+	'''
+	Reads the lat/lon, scan time and decoded SDS of the part of a granule that covers a box.
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the OMI he5 file
+	bbox : (min_lat, max_lat, min_lon, max_lon)
+		Region of interest (crossing the antimeridian if max_lon < min_lon)
+	sds_names : list of str, optional
+		SDS to read (the product's main SDS otherwise)
+	catalog : omi_catalog.Catalog, optional
+		Catalog holding cached row extents for the file
+	align : bool
+		Widen the window to the HDF5 chunk boundaries of the first SDS
+	quality : bool
+		Also set the pixels that fail the product's quality rules to NaN in every SDS (the
+		quality mask of the window is computed once; see omi_quality)
+
+	Returns
+	-------
+	subset : dict or None
+		product, SDS_NAME (the first SDS), window (scanline and cross-track slices), lat, lon,
+		scan_dates, inside (True for pixels in the box), quality_mask (None unless quality is
+		set) and one decoded array per SDS name;
+		None if no pixel of the granule is in the box
+
+	Raises
+	------
+	ValueError
+		If the file is not a recognized NO2/SO2 granule
+	'''
+	extents=catalog.row_extents(FILE_NAME) if catalog is not None else None
+	with Granule(FILE_NAME) as granule:
+		schema=granule.schema
+		sds_names=sds_names or [schema.main_sds]
+		chunks=granule[sds_names[0]].chunks if align else None
+		window=find_window(granule,bbox,extents,chunks)
+		if window is None:
+			return None
+		subset={'product':schema.product,'SDS_NAME':sds_names[0],'window':window,
+			'lat':granule.read_geolocation(schema.latitude,window),'lon':granule.read_geolocation(schema.longitude,window),
+			'scan_dates':granule.scan_dates(window[0]),'quality_mask':None}
+		if quality:
+			subset['quality_mask']=granule.quality_mask(window)
+		for SDS_NAME in sds_names:
+			subset[SDS_NAME]=granule[SDS_NAME].read(window)
+			if quality:
+				subset[SDS_NAME]=apply_mask(subset[SDS_NAME],subset['quality_mask'])
+	subset['inside']=in_bbox(subset['lat'],subset['lon'],bbox)
+	return subset
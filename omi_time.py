@@ -0,0 +1,103 @@
+#!/usr/bin/python
+'''
+Module: omi_time.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To convert the OMI 'Time' geolocation field (seconds since the TAI93 epoch) into
+datetime64 values and Year/Month/Day/Hour/Minute/Second columns in one NumPy pass
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import numpy as np
+
+#OMI scan times are seconds counted from Dec 31, 1992 @ 23:59:59 UTC (leap seconds are not applied,
+#which matches the time.gmtime conversion the original scripts used)
+TAI93_EPOCH=np.datetime64('1992-12-31T23:59:59','s')
+
+#names of the date columns written by the ascii dump, in output order
+TIME_COLUMNS=('Year','Month','Day','Hour','Minute','Second')
+
+#largest offset (in seconds) that still fits in datetime64[s] without overflowing
+_MAX_SECONDS=2.0**62
+
+def tai93_to_datetime64(scan_time):
+	'''
+	Converts OMI scan times to datetime64[s].
+
+	Fractional seconds are floored exactly as time.gmtime does. Fill values and anything
+	that is not a finite, representable time become NaT.
+
+	Parameters
+	----------
+	scan_time : array_like
+		Seconds since the TAI93 epoch, any shape
+
+	Returns
+	-------
+	times : numpy.ndarray
+		datetime64[s] array with the same shape as scan_time
+	'''
+	scan_time=np.asarray(scan_time,dtype=np.float64)
+	valid=np.isfinite(scan_time)&(np.abs(scan_time)<_MAX_SECONDS)
+	seconds=np.zeros(scan_time.shape,dtype=np.int64)
+	seconds[valid]=np.floor(scan_time[valid])
+	times=TAI93_EPOCH+seconds.astype('timedelta64[s]')
+	times[~valid]=np.datetime64('NaT')
+	return times
+
+def calendar_columns(times):
+	'''
+	Splits datetime64 values into calendar columns.
+
+	Parameters
+	----------
+	times : numpy.ndarray
+		datetime64 array, any shape
+
+	Returns
+	-------
+	columns : dict
+		float64 arrays keyed by the names in TIME_COLUMNS (NaN where the time is NaT)
+	'''
+	times=times.astype('datetime64[s]')
+	valid=~np.isnat(times)
+	#truncate to each calendar unit once, then take differences between neighbouring units
+	years=times.astype('datetime64[Y]')
+	months=times.astype('datetime64[M]')
+	days=times.astype('datetime64[D]')
+	seconds_of_day=(times-days).astype(np.int64)
+	values=(years.astype(np.int64)+1970,
+		months.astype(np.int64)%12+1,
+		(days-months.astype('datetime64[D]')).astype(np.int64)+1,
+		seconds_of_day//3600,
+		seconds_of_day%3600//60,
+		seconds_of_day%60)
+	columns={}
+	for name,value in zip(TIME_COLUMNS,values):
+		column=value.astype(np.float64)
+		column[~valid]=np.nan
+		columns[name]=column
+	return columns
+
+def decode_scan_time(scan_time):
+	'''
+	Splits OMI scan times into calendar columns.
+
+	Parameters
+	----------
+	scan_time : array_like
+		Seconds since the TAI93 epoch, any shape
+
+	Returns
+	-------
+	times : numpy.ndarray
+		datetime64[s] array with the same shape as scan_time
+	columns : dict
+		float64 arrays keyed by the names in TIME_COLUMNS (NaN where the time is NaT)
+	'''
+	times=tai93_to_datetime64(scan_time)
+	return times,calendar_columns(times)
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+'''
+Module: omi_writers.py
+==========================================================================================
+Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
+
+Organization: NASA ARSET
+Purpose: To write per-pixel OMI columns to disk a block of scanlines at a time, either as
+comma separated text or as a typed columnar file (Parquet or Arrow IPC)
+
+Every column is passed as a 2-D (scanline, cross-track) array. Scanline values such as
+the date can be handed in as zero-copy np.broadcast_to views, so no full granule-sized
+output matrix (or matrix of strings) is ever built.
+
+See the README associated with this module for more information.
+==========================================================================================
+'''
+
+import numpy as np
+from omi_instrument import stage
+
+#supported output formats and the file extension each one is saved with
+OUTPUT_FORMATS={'txt':'.txt','csv':'.csv','parquet':'.parquet','arrow':'.arrow'}
+
+#number of scanlines formatted and written per block
+CHUNK_SCANLINES=256
+
+#default printf-style format for columns that are not listed in write_columns(formats=...)
+DEFAULT_FORMAT='%.9g'
+
+def _blocks(columns,chunk_scanlines):
+	#yields (start,stop) scanline ranges that cover every column
+	nscan=columns[0].shape[0]
+	for start in range(0,nscan,chunk_scanlines):
+		yield start,min(start+chunk_scanlines,nscan)
+
+def write_csv(outfilename,header,columns,formats=None,chunk_scanlines=CHUNK_SCANLINES):
+	'''
+	Streams the columns to a comma separated text file with a header line.
+
+	Parameters
+	----------
+	outfilename : str
+		Path of the text file to create
+	header : list of str
+		Column titles, one per column
+	columns : list of numpy.ndarray
+		2-D arrays that all share the same (scanline, cross-track) shape
+	formats : dict, optional
+		printf-style format per column title (DEFAULT_FORMAT otherwise)
+	chunk_scanlines : int
+		Number of scanlines formatted per write
+	'''
+	formats=formats or {}
+	row_format=','.join(formats.get(name,DEFAULT_FORMAT) for name in header)+'\n'
+	with open(outfilename,'w') as outfile:
+		outfile.write(','.join(header)+'\n')
+		for start,stop in _blocks(columns,chunk_scanlines):
+			#interleave the columns of this block into row order, then format it with one string operation
+			block=np.empty((columns[0][start:stop].size,len(columns)))
+			for i,column in enumerate(columns):
+				block[:,i]=column[start:stop].ravel()
+			outfile.write((row_format*block.shape[0]) % tuple(block.ravel().tolist()))
+
+def _arrow_column(pa,values,integer):
+	#date columns become nullable integers, everything else keeps its numeric dtype
+	if integer:
+		missing=np.isnan(values)
+		return pa.array(np.where(missing,0,values).astype(np.int32),mask=missing)
+	return pa.array(values)
+
+def write_arrow(outfilename,header,columns,output_format='parquet',integer_columns=(),chunk_scanlines=CHUNK_SCANLINES):
+	'''
+	Streams the columns to a Parquet or Arrow IPC file, one record batch per block of scanlines.
+
+	Arrow IPC files can be memory mapped by downstream jobs (pyarrow.ipc.open_file on a
+	pyarrow.memory_map) and read without copying. Requires the optional pyarrow package.
+
+	Parameters
+	----------
+	outfilename : str
+		Path of the file to create
+	header : list of str
+		Column titles, one per column
+	columns : list of numpy.ndarray
+		2-D arrays that all share the same (scanline, cross-track) shape
+	output_format : str
+		'parquet' or 'arrow'
+	integer_columns : sequence of str
+		Titles of columns to store as nullable int32 (NaN becomes null)
+	chunk_scanlines : int
+		Number of scanlines per record batch (Parquet row group)
+	'''
+	try:
+		import pyarrow as pa
+	except ImportError:
+		raise ImportError('Writing '+output_format+' files requires the pyarrow package (pip install pyarrow)')
+	writer=None
+	try:
+		for start,stop in _blocks(columns,chunk_scanlines):
+			arrays=[_arrow_column(pa,column[start:stop].ravel(),name in integer_columns) for name,column in zip(header,columns)]
+			batch=pa.RecordBatch.from_arrays(arrays,names=list(header))
+			if writer is None:
+				if output_format=='parquet':
+					import pyarrow.parquet as pq
+					writer=pq.ParquetWriter(outfilename,batch.schema)
+				else:
+					writer=pa.ipc.new_file(outfilename,batch.schema)
+			if output_format=='parquet':
+				writer.write_table(pa.Table.from_batches([batch]))
+			else:
+				writer.write_batch(batch)
+	finally:
+		#the file is closed even if a block fails part way through
+		if writer is not None:
+			writer.close()
+
+def write_columns(outfilename,header,columns,output_format='txt',formats=None,integer_columns=(),chunk_scanlines=CHUNK_SCANLINES):
+	'''
+	Writes the columns in the requested format (one of OUTPUT_FORMATS).
+
+	Parameters
+	----------
+	outfilename : str
+		Path of the file to create
+	header : list of str
+		Column titles, one per column
+	columns : list of numpy.ndarray
+		2-D arrays that all share the same (scanline, cross-track) shape
+	output_format : str
+		'txt' or 'csv' for text, 'parquet' or 'arrow' for columnar binary output
+	formats : dict, optional
+		printf-style format per column title, used by the text formats
+	integer_columns : sequence of str
+		Titles of columns holding whole numbers (formatted without decimals or stored as int32)
+	chunk_scanlines : int
+		Number of scanlines written per block
+	'''
+	if output_format not in OUTPUT_FORMATS:
+		raise ValueError('Unknown output format '+repr(output_format)+', expected one of '+', '.join(OUTPUT_FORMATS))
+	with stage('write'):
+		if output_format in ('parquet','arrow'):
+			write_arrow(outfilename,header,columns,output_format,integer_columns,chunk_scanlines)
+		else:
+			formats=dict(formats or {})
+			for name in integer_columns:
+				formats.setdefault(name,'%.0f')
+			write_csv(outfilename,header,columns,formats,chunk_scanlines)
@@ -12,108 +12,143 @@ See the README associated with this module for more information.
 ==========================================================================================
 '''
 
-import h5py
 import numpy as np
-from mpl_toolkits.basemap import Basemap
-import matplotlib.pyplot as plt
 import sys
+from omi_instrument import stage
+from omi_reader import read_swath
 
-#This finds the user's current path so that all hdf4 files can be found
-try:
-	fileList=open('fileList.txt','r')
-except:
-	print('Did not find a text file containing file names (perhaps name does not match)')
-	sys.exit()
+def granule_statistics(FILE_NAME,swath=None,quality=False):
+	'''
+	Computes the mean, standard deviation and median of the main SDS and the lat/lon range of a file.
 
-#loops through all files listed in the text file
-for FILE_NAME in fileList:
-	FILE_NAME=FILE_NAME.strip()
-	user_input=input('\nWould you like to process\n' + FILE_NAME + '\n\n(Y/N)')
-	if(user_input == 'N' or user_input == 'n'):
-		print('Skipping...')
-		continue
-	else:
-		file = h5py.File(FILE_NAME, 'r')   # 'r' means that hdf5 file is open in read-only mode
-		#checks if the file contains NO2 or SO2 data, and reacts accordingly
-		if 'NO2' in FILE_NAME:
-			print('This is an OMI NO2 file. Here is some information: ')
-			#this is how you access the data tree in an hdf5 file
-			dataFields=file['HDFEOS']['SWATHS']['ColumnAmountNO2']['Data Fields']
-			geolocation=file['HDFEOS']['SWATHS']['ColumnAmountNO2']['Geolocation Fields']
-			SDS_NAME='ColumnAmountNO2'
-			data=dataFields[SDS_NAME]
-			map_label=data.attrs['Units'].decode()
-		elif 'SO2' in FILE_NAME:
-			print('This is an OMI SO2 file. Here is some information: ')
-			dataFields=file['HDFEOS']['SWATHS']['OMI Total Column Amount SO2']['Data Fields']
-			geolocation=file['HDFEOS']['SWATHS']['OMI Total Column Amount SO2']['Geolocation Fields']
-			SDS_NAME='ColumnAmountSO2_PBL'
-			data=dataFields[SDS_NAME]
-			valid_min=data.attrs['ValidRange'][0]
-			valid_max=data.attrs['ValidRange'][1]
-			map_label=data.attrs['Units'].decode()
-			print('Valid Range is: ',valid_min,valid_max)
-		else:
-			print('The file named :',FILE_NAME, ' is not a valid OMI file. \n')
-			#if the program is unable to determine that it is an OMI SO2 or NO2 file, then it will skip to the next file
-			continue
-			
-		#get necessary attributes 
-		fv=data.attrs['_FillValue']
-		mv=data.attrs['MissingValue']
-		offset=data.attrs['Offset']
-		scale=data.attrs['ScaleFactor']
-		
-		#get lat and lon information 
-		lat=geolocation['Latitude'][:]
-		min_lat=np.min(lat)
-		max_lat=np.max(lat)
-		lon=geolocation['Longitude'][:]
-		min_lon=np.min(lon)
-		max_lon=np.max(lon)
-		
-		#get the data as an array and mask fill/missing values
-		dataArray=data[:]
-		dataArray[dataArray==fv]=np.nan
-		dataArray[dataArray==mv]=np.nan
-		dataArray = scale * (dataArray - offset)
-		
-		#get statistics about data
-		average=np.nanmean(dataArray)
-		print(average)
-		stdev=np.nanstd(dataArray)
-		median=np.nanmedian(dataArray)
-		
-		#print statistics 
-		print('The average of this data is: ',round(average,3),'\nThe standard deviation is: ',round(stdev,3),'\nThe median is: ',round(median,3))
-		print('The range of latitude in this file is: ',min_lat,' to ',max_lat, 'degrees \nThe range of longitude in this file is: ',min_lon, ' to ',max_lon,' degrees')
-		is_map=input('\nWould you like to create a map of this data? Please enter Y or N \n')
-		
-		#if user would like a map, view it
-		if is_map == 'Y' or is_map == 'y':
-			data = np.ma.masked_array(data, np.isnan(data))
-			m = Basemap(projection='cyl', resolution='l',
-						llcrnrlat=-90, urcrnrlat = 90,
-						llcrnrlon=-180, urcrnrlon = 180)
-			m.drawcoastlines(linewidth=0.5)
-			m.drawparallels(np.arange(-90., 120., 30.), labels=[1, 0, 0, 0])
-			m.drawmeridians(np.arange(-180, 180., 45.), labels=[0, 0, 0, 1])
-			my_cmap = plt.cm.get_cmap('gist_stern_r')
-			my_cmap.set_under('w')
-			m.pcolormesh(lon, lat, data, latlon=True, vmin=0, vmax=np.nanmax(data)*.35,cmap=my_cmap)
-			cb = m.colorbar()
-			cb.set_label(map_label)
-			plt.autoscale()
-			#title the plot
-			plt.title('{0}\n {1}'.format(FILE_NAME, SDS_NAME))
-			fig = plt.gcf()
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the OMI he5 file
+	swath : dict, optional
+		Output of read_swath, if the file has already been read
+	quality : bool
+		Leave out pixels that fail the product's quality rules (see omi_quality)
+
+	Returns
+	-------
+	stats : dict
+		SDS_NAME, average, stdev, median, min_lat, max_lat, min_lon and max_lon
+	'''
+	if swath is None:
+		swath=read_swath(FILE_NAME,quality=quality)
+	dataArray=swath['dataArray']
+	return {'SDS_NAME':swath['SDS_NAME'],
+		'average':float(np.nanmean(dataArray)),'stdev':float(np.nanstd(dataArray)),'median':float(np.nanmedian(dataArray)),
+		'min_lat':float(np.min(swath['lat'])),'max_lat':float(np.max(swath['lat'])),
+		'min_lon':float(np.min(swath['lon'])),'max_lon':float(np.max(swath['lon']))}
+
+def map_granule(FILE_NAME,swath=None,pngfile=None,show=False,quality=False,raster=False):
+	'''
+	Draws the main SDS of a file on a global map.
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the OMI he5 file
+	swath : dict, optional
+		Output of read_swath, if the file has already been read
+	pngfile : str, optional
+		Where to save the map (not saved if None)
+	show : bool
+		Whether to open the interactive plot window; when False the map is drawn off screen
+	quality : bool
+		Leave out pixels that fail the product's quality rules (see omi_quality)
+	raster : bool
+		Draw the swath rasterized onto an image grid, on a map reused for every call in this
+		process (much faster for many maps; see omi_render.py); needs pngfile and show=False
+
+	Returns
+	-------
+	fig : matplotlib.figure.Figure
+		The figure holding the map
+	'''
+	if raster and not show and pngfile is not None:
+		from omi_render import get_canvas, render_swath
+		render_swath(FILE_NAME,pngfile,swath,quality=quality)
+		return get_canvas().fig
+	import matplotlib
+	if not show:
+		#draw without a display so that the map can be made in batch jobs and worker processes
+		matplotlib.use('Agg')
+	from mpl_toolkits.basemap import Basemap
+	import matplotlib.pyplot as plt
+	if swath is None:
+		swath=read_swath(FILE_NAME,quality=quality)
+	lat=swath['lat']
+	lon=swath['lon']
+	data = np.ma.masked_array(swath['dataArray'], np.isnan(swath['dataArray']))
+	with stage('plot'):
+		plt.figure()
+		m = Basemap(projection='cyl', resolution='l',
+					llcrnrlat=-90, urcrnrlat = 90,
+					llcrnrlon=-180, urcrnrlon = 180)
+		m.drawcoastlines(linewidth=0.5)
+		m.drawparallels(np.arange(-90., 120., 30.), labels=[1, 0, 0, 0])
+		m.drawmeridians(np.arange(-180, 180., 45.), labels=[0, 0, 0, 1])
+		my_cmap = plt.cm.get_cmap('gist_stern_r')
+		my_cmap.set_under('w')
+		m.pcolormesh(lon, lat, data, latlon=True, vmin=0, vmax=np.nanmax(data)*.35,cmap=my_cmap)
+		cb = m.colorbar()
+		cb.set_label(swath['map_label'])
+		plt.autoscale()
+		#title the plot
+		plt.title('{0}\n {1}'.format(FILE_NAME, swath['SDS_NAME']))
+		fig = plt.gcf()
+		if show:
 			# Show the plot window.
 			plt.show()
-		#once you close the map it asks if you'd like to save it
-			is_save=str(input('\nWould you like to save this map? Please enter Y or N \n'))
-			if is_save == 'Y' or is_save == 'y':
-				#saves as a png if the user would like
-				pngfile = '{0}.png'.format(FILE_NAME[:-3])
-				fig.savefig(pngfile)
-		#close the hdf5 file 
-		file.close()
\ No newline at end of file
+		if pngfile is not None:
+			fig.savefig(pngfile)
+		if not show:
+			plt.close(fig)
+	return fig
+
+if __name__ == '__main__':
+	#This finds the user's current path so that all hdf4 files can be found
+	try:
+		fileList=open('fileList.txt','r')
+	except:
+		print('Did not find a text file containing file names (perhaps name does not match)')
+		sys.exit()
+
+	#loops through all files listed in the text file
+	for FILE_NAME in fileList:
+		FILE_NAME=FILE_NAME.strip()
+		user_input=input('\nWould you like to process\n' + FILE_NAME + '\n\n(Y/N)')
+		if(user_input == 'N' or user_input == 'n'):
+			print('Skipping...')
+			continue
+		else:
+			try:
+				swath=read_swath(FILE_NAME)
+			except (ValueError,KeyError) as error:
+				print(error.args[0],'\n')
+				continue
+			print('This is an',swath['instrument'],swath['product'],'file. Here is some information: ')
+			if swath['valid_range'] is not None:
+				print('Valid Range is: ',swath['valid_range'][0],swath['valid_range'][1])
+			
+			#get statistics about data
+			stats=granule_statistics(FILE_NAME,swath)
+			print(stats['average'])
+			
+			#print statistics 
+			print('The average of this data is: ',round(stats['average'],3),'\nThe standard deviation is: ',round(stats['stdev'],3),'\nThe median is: ',round(stats['median'],3))
+			print('The range of latitude in this file is: ',stats['min_lat'],' to ',stats['max_lat'], 'degrees \nThe range of longitude in this file is: ',stats['min_lon'], ' to ',stats['max_lon'],' degrees')
+			is_map=input('\nWould you like to create a map of this data? Please enter Y or N \n')
+			
+			#if user would like a map, view it
+			if is_map == 'Y' or is_map == 'y':
+				fig=map_granule(FILE_NAME,swath,show=True)
+			#once you close the map it asks if you'd like to save it
+				is_save=str(input('\nWould you like to save this map? Please enter Y or N \n'))
+				if is_save == 'Y' or is_save == 'y':
+					#saves as a png if the user would like
+					pngfile = '{0}.png'.format(FILE_NAME[:-3])
+					fig.savefig(pngfile)
\ No newline at end of file
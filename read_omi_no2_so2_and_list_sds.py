@@ -4,119 +4,255 @@ Module: read_omi_no2_so2_and_list_sds.py
 ==========================================================================================
 Disclaimer: The code is for demonstration purposes only. Users are responsible to check for accuracy and revise to fit their objective.
 
-Author: Justin Roberts-Pierel, 2015 
+Author: Justin Roberts-Pierel, 2015
 Organization: NASA ARSET
-Purpose: To print all SDS from an TROPOMI file
+Purpose: To list the groups and SDS (shape, data type, chunking, compression and
+attributes) of many OMI he5 and TROPOMI nc files, and to report SDS that differ between
+files of the same product (schema drift)
 
 Updated by Pawan Gupta, May 10 2019 to read TROPOMI data
+
+Only the file metadata is read (HDF5 files, which include netCDF-4 files, are walked with
+h5py's visititems; netCDF-3 files are read from their header with netCDF4, if installed),
+so thousands of files can be listed in seconds, several at a time in worker processes.
+
+Examples:
+	python read_omi_no2_so2_and_list_sds.py
+	python read_omi_no2_so2_and_list_sds.py 'data/*.he5' --workers 8 --json inventory.json
+	python read_omi_no2_so2_and_list_sds.py --list fileList.txt --verbose
+
+See the README associated with this module for more information.
 ==========================================================================================
 '''
-#-------------------------------------------------
-# This section of the code is adopted from colorstate univ.
-#http://schubert.atmos.colostate.edu/~cslocum/netcdf_example.html
-#-------------------------------------------------
-def ncdump(nc_fid, verb=True):
-    '''
-    ncdump outputs dimensions, variables and their attribute information.
-    The information is similar to that of NCAR's ncdump utility.
-    ncdump requires a valid instance of Dataset.
-
-    Parameters
-    ----------
-    nc_fid : netCDF4.Dataset
-        A netCDF4 dateset object
-    verb : Boolean
-        whether or not nc_attrs, nc_dims, and nc_vars are printed
-
-    Returns
-    -------
-    nc_attrs : list
-        A Python list of the NetCDF file global attributes
-    nc_dims : list
-        A Python list of the NetCDF file dimensions
-    nc_vars : list
-        A Python list of the NetCDF file variables
-    '''
-    def print_ncattr(key):
-        """
-        Prints the NetCDF file attributes for a given key
-
-        Parameters
-        ----------
-        key : unicode
-            a valid netCDF4.Dataset.variables key
-        """
-        try:
-            print "\t\ttype:", repr(nc_fid.variables[key].dtype)
-            for ncattr in nc_fid.variables[key].ncattrs():
-                print '\t\t%s:' % ncattr,\
-                      repr(nc_fid.variables[key].getncattr(ncattr))
-        except KeyError:
-            print "\t\tWARNING: %s does not contain variable attributes" % key
-
-    # NetCDF global attributes
-    nc_attrs = nc_fid.ncattrs()
-    if verb:
-        print "NetCDF Global Attributes:"
-        for nc_attr in nc_attrs:
-            print '\t%s:' % nc_attr, repr(nc_fid.getncattr(nc_attr))
-    nc_dims = [dim for dim in nc_fid.dimensions]  # list of nc dimensions
-    # Dimension shape information.
-    if verb:
-        print "NetCDF dimension information:"
-        for dim in nc_dims:
-            print "\tName:", dim 
-            print "\t\tsize:", len(nc_fid.dimensions[dim])
-            print_ncattr(dim)
-    # Variable information.
-    nc_vars = [var for var in nc_fid.variables]  # list of nc variables
-    if verb:
-        print "NetCDF variable information:"
-        for var in nc_vars:
-            if var not in nc_dims:
-                print '\tName:', var
-                print "\t\tdimensions:", nc_fid.variables[var].dimensions
-                print "\t\tsize:", nc_fid.variables[var].size
-                print_ncattr(var)
-    return nc_attrs, nc_dims, nc_vars
-#---------------------------------------------------------------------
+
 #import necessary modules
-import netCDF4
-from netCDF4 import Dataset
-
-#This finds the user's current path so that all nc files can be found
-try:
-	fileList=open('fileList.txt','r')
-except:
-	print('Did not find a text file containing file names (perhaps name does not match)')
-	sys.exit()
-
-#loops through all files listed in the text file
-for FILE_NAME in fileList:
-	FILE_NAME=FILE_NAME.strip()
-	user_input=input('\nWould you like to process\n' + FILE_NAME + '\n\n(Y/N)')
-	if(user_input == 'N' or user_input == 'n'):
-		print('Skipping...')
-		continue
-	else:
-		nc_file = Dataset(FILE_NAME, 'r')   # 'r' means that nc file is open in read-only mode	
-		nc_attrs,nc_dims,nc_vars = ncdump(nc_file)
-	nc_file.close()		
-#-------------
-'''
-		#checks if the file contains NO2 or SO2 data, and reacts accordingly
-	#	if 'NO2' in FILE_NAME:
-			print('\nThis is an OMI NO2 file. Here is a list of SDS in your file:\n')
-			dataFields=file['HDFEOS']['SWATHS']['ColumnAmountNO2']['Data Fields']            
-		elif 'SO2' in FILE_NAME:
-			print('\nThis is an OMI SO2 file. Here is a list of SDS in your file:\n')
-			dataFields=file['HDFEOS']['SWATHS']['OMI Total Column Amount SO2']['Data Fields']
+import argparse
+import json
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import h5py
+import numpy as np
+from omi_batch import expand_inputs
+from omi_reader import detect_schema
+
+#attributes with more values than this are summarized instead of listed
+MAX_ATTRIBUTE_VALUES=16
+
+def _attribute_value(value):
+	#attribute values as JSON-friendly Python values
+	if isinstance(value,bytes):
+		return value.decode('utf-8','replace')
+	value=np.asarray(value)
+	if value.dtype.kind == 'O' or value.dtype.names:
+		#object references (e.g. netCDF-4 dimension lists) and compound values
+		return '<{0} {1}>'.format(value.dtype,value.shape)
+	if value.size > MAX_ATTRIBUTE_VALUES:
+		return '<{0} values of {1}>'.format(value.size,value.dtype)
+	if value.dtype.kind == 'S':
+		value=np.char.decode(value,'utf-8','replace')
+	value=value.tolist()
+	if isinstance(value,list) and len(value) == 1:
+		return value[0]
+	return value
+
+def _attributes(attrs):
+	attributes={}
+	for name in attrs:
+		try:
+			attributes[name]=_attribute_value(attrs[name])
+		except (OSError,TypeError,ValueError) as error:
+			attributes[name]='<unreadable: {0}>'.format(error)
+	return attributes
+
+def _inventory_hdf5(FILE_NAME,entry):
+	with h5py.File(FILE_NAME,'r') as file:
+		schema=detect_schema(file)
+		entry['product']=schema.name if schema is not None else None
+		entry['attributes']=_attributes(file.attrs)
+		def visit(name,obj):
+			if isinstance(obj,h5py.Dataset):
+				entry['datasets'][name]={'shape':list(obj.shape),'dtype':str(obj.dtype),
+					'chunks':list(obj.chunks) if obj.chunks else None,'compression':obj.compression,
+					'attributes':_attributes(obj.attrs)}
+			elif isinstance(obj,h5py.Group):
+				entry['groups'].append(name)
+		file.visititems(visit)
+
+def _inventory_netcdf3(FILE_NAME,entry):
+	try:
+		from netCDF4 import Dataset
+	except ImportError:
+		raise ImportError('netCDF4 is needed to list netCDF-3 files (pip install netCDF4)')
+	with Dataset(FILE_NAME,'r') as nc_fid:
+		entry['product']=None
+		entry['attributes']=dict((name,_attribute_value(nc_fid.getncattr(name))) for name in nc_fid.ncattrs())
+		for name,variable in nc_fid.variables.items():
+			chunking=variable.chunking()
+			entry['datasets'][name]={'shape':list(variable.shape),'dtype':str(variable.dtype),
+				'chunks':None if chunking in (None,'contiguous') else list(chunking),'compression':None,
+				'attributes':dict((attr,_attribute_value(variable.getncattr(attr))) for attr in variable.ncattrs())}
+
+def inventory_file(FILE_NAME):
+	'''
+	Lists the groups and SDS of one file without reading any data.
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of an he5, nc or other HDF5/netCDF file
+
+	Returns
+	-------
+	entry : dict
+		file, format ('hdf5' or 'netcdf3'), product (registered product name, or None),
+		attributes (of the file), groups (paths), datasets (shape, dtype, chunks,
+		compression and attributes per path) and error (None, or why the file could
+		not be listed)
+	'''
+	entry={'file':FILE_NAME,'format':None,'product':None,'attributes':{},'groups':[],'datasets':{},'error':None}
+	try:
+		if h5py.is_hdf5(FILE_NAME):
+			entry['format']='hdf5'
+			_inventory_hdf5(FILE_NAME,entry)
 		else:
-			print('The file named :',FILE_NAME, ' is not a valid OMI file. \n')
-			continue	
-		#Print the list of SDS found in the file 
-		[print(' ' + i + ', dim='+ str(dataFields[i].shape) +' \n') for i in dataFields]
-		#close the hdf5 file 
-		file.close()
-#-------------
-'''
+			entry['format']='netcdf3'
+			_inventory_netcdf3(FILE_NAME,entry)
+	except Exception as error:
+		entry['error']='{0}: {1}'.format(type(error).__name__,error)
+	return entry
+
+def inventory(file_names,workers=1):
+	'''
+	Lists many files, several at a time in worker processes when workers > 1.
+
+	Returns
+	-------
+	entries : list of dict
+		inventory_file output per file, in input order
+	'''
+	if workers <= 1 or len(file_names) < 2:
+		return [inventory_file(FILE_NAME) for FILE_NAME in file_names]
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		#hand out files in batches so that thousands of small jobs are cheap to schedule
+		return list(pool.map(inventory_file,file_names,chunksize=max(1,len(file_names)//(workers*8))))
+
+def _signature(dataset):
+	#what should not change between granules of a product (the number of scanlines may)
+	return (dataset['dtype'],len(dataset['shape']),tuple(dataset['shape'][1:]),
+		tuple(dataset['chunks']) if dataset['chunks'] else None,dataset['compression'],tuple(sorted(dataset['attributes'])))
+
+def schema_drift(entries):
+	'''
+	Finds SDS that differ between files of the same product.
+
+	Parameters
+	----------
+	entries : list of dict
+		inventory_file output
+
+	Returns
+	-------
+	drift : list of dict
+		product, dataset (path), files (number of files of the product), present (number
+		of files with the dataset) and variants (one per distinct dtype, rank, shape after
+		the first axis, chunks, compression and attribute names, with the number of files
+		and one example file); only datasets missing from some files or with more than one
+		variant are listed
+	'''
+	products=defaultdict(list)
+	for entry in entries:
+		if entry['error'] is None:
+			products[entry['product'] or entry['format']].append(entry)
+	drift=[]
+	for product in sorted(products):
+		product_entries=products[product]
+		variants=defaultdict(Counter)
+		examples={}
+		for entry in product_entries:
+			for name,dataset in entry['datasets'].items():
+				signature=_signature(dataset)
+				variants[name][signature]+=1
+				examples.setdefault((name,signature),entry['file'])
+		for name in sorted(variants):
+			present=sum(variants[name].values())
+			if present == len(product_entries) and len(variants[name]) == 1:
+				continue
+			drift.append({'product':product,'dataset':name,'files':len(product_entries),'present':present,
+				'variants':[{'dtype':signature[0],'rank':signature[1],'shape_after_first_axis':list(signature[2]),
+					'chunks':list(signature[3]) if signature[3] else None,'compression':signature[4],
+					'attributes':list(signature[5]),'count':count,'example':examples[(name,signature)]}
+					for signature,count in variants[name].most_common()]})
+	return drift
+
+def print_inventory(entry):
+	'''Prints the groups and SDS of one file (in the spirit of ncdump -h).'''
+	print('\n'+entry['file'])
+	if entry['error']:
+		print('\tERROR:',entry['error'])
+		return
+	print('\tformat:',entry['format'],' product:',entry['product'])
+	for name,value in sorted(entry['attributes'].items()):
+		print('\t{0}: {1!r}'.format(name,value))
+	for name,dataset in sorted(entry['datasets'].items()):
+		print('\t{0}, dim={1} {2} chunks={3} {4}'.format(name,tuple(dataset['shape']),dataset['dtype'],
+			tuple(dataset['chunks']) if dataset['chunks'] else None,dataset['compression'] or ''))
+		for attr,value in sorted(dataset['attributes'].items()):
+			print('\t\t{0}: {1!r}'.format(attr,value))
+
+def print_table(entries,drift):
+	'''Prints one line per SDS (with the number of files it is in) and the schema drift.'''
+	rows=Counter()
+	for entry in entries:
+		for name,dataset in entry['datasets'].items():
+			rows[(entry['product'] or entry['format'],name,dataset['dtype'],
+				'x'.join(['*']+[str(size) for size in dataset['shape'][1:]]) if dataset['shape'] else '()',
+				'x'.join(str(size) for size in dataset['chunks']) if dataset['chunks'] else '-')]+=1
+	print('{0:<10}{1:<8}{2:<14}{3:<14}{4:<8}{5}'.format('product','dtype','shape','chunks','files','SDS'))
+	for (product,name,dtype,shape,chunks),count in sorted(rows.items()):
+		print('{0:<10}{1:<8}{2:<14}{3:<14}{4:<8}{5}'.format(str(product),dtype,shape,chunks,count,name))
+	failed=[entry for entry in entries if entry['error']]
+	for entry in failed:
+		print('FAILED',entry['file'],entry['error'])
+	if drift:
+		print('\nSchema drift:')
+		for item in drift:
+			print('{0} {1}: in {2} of {3} files, {4} variant(s)'.format(item['product'],item['dataset'],item['present'],item['files'],len(item['variants'])))
+			#attribute names that only some variants have
+			common=set.intersection(*[set(variant['attributes']) for variant in item['variants']])
+			for variant in item['variants']:
+				extra=sorted(set(variant['attributes'])-common)
+				print('\t{0} files: {1} rank {2} {3} chunks={4} compression={5}{6} e.g. {7}'.format(variant['count'],variant['dtype'],variant['rank'],
+					variant['shape_after_first_axis'],variant['chunks'],variant['compression'],
+					' attributes+='+','.join(extra) if extra else '',variant['example']))
+	else:
+		print('\nNo schema drift between files of the same product.')
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='List the SDS of many OMI/TROPOMI files and check them for schema drift.')
+	parser.add_argument('inputs',nargs='*',help='file paths or glob patterns')
+	parser.add_argument('--list',action='append',default=[],help='text file listing files (default: fileList.txt when no inputs are given)')
+	parser.add_argument('--workers','-j',type=int,default=1,help='number of worker processes (default 1)')
+	parser.add_argument('--json',help='write the full inventory and drift report to this JSON file')
+	parser.add_argument('--verbose','-v',action='store_true',help='also print every SDS and attribute of every file')
+	options=parser.parse_args(argv)
+	list_files=options.list or ([] if options.inputs else ['fileList.txt'])
+	try:
+		file_names=expand_inputs(options.inputs,list_files)
+	except OSError:
+		print('Did not find a text file containing file names (perhaps name does not match)')
+		return 2
+	entries=inventory(file_names,options.workers)
+	drift=schema_drift(entries)
+	if options.verbose:
+		for entry in entries:
+			print_inventory(entry)
+		print('')
+	print_table(entries,drift)
+	if options.json:
+		with open(options.json,'w') as outfile:
+			json.dump({'files':entries,'drift':drift},outfile,indent=1)
+	return 1 if any(entry['error'] for entry in entries) else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
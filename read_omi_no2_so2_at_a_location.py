@@ -13,156 +13,212 @@ See the README associated with this module for more information.
 '''
 
 #import necessary modules
-import h5py
 import numpy as np
 import sys
-from numpy import unravel_index
-
-#This finds the user's current path so that all hdf4 files can be found
-try:
-	fileList=open('fileList.txt','r')
-except:
-	print('Did not find a text file containing file names (perhaps name does not match)')
-	sys.exit()
-
-#loops through all files listed in the text file
-for FILE_NAME in fileList:
-	FILE_NAME=FILE_NAME.strip()
-	user_input=input('\nWould you like to process\n' + FILE_NAME + '\n\n(Y/N)')
-	if(user_input == 'N' or user_input == 'n'):
-		print('Skipping...')
-		continue
+from omi_spatial import nearest_pixel, SwathIndex
+from omi_reader import read_swath
+from omi_neighborhood import neighborhood_statistics, site_statistics
+from omi_instrument import stage
+
+def value_at_location(swath,user_lat,user_lon,sizes=(3,5),edge='shift'):
+	'''
+	Finds the pixel nearest to a location and the statistics of the 3x3 and 5x5 grids around it.
+
+	Parameters
+	----------
+	swath : dict
+		Output of read_swath
+	user_lat, user_lon : float
+		Location to analyze (Deg. N, Deg. E)
+	sizes, edge :
+		Window sizes and edge handling (see pixel_statistics)
+
+	Returns
+	-------
+	result : dict
+		See pixel_statistics
+	'''
+	#find nearest point in data to entered location (haversine formula)
+	with stage('search'):
+		x,y=nearest_pixel(swath['lat'],swath['lon'],user_lat,user_lon)
+	return pixel_statistics(swath,x,y,sizes,edge)
+
+def pixel_statistics(swath,x,y,sizes=(3,5),edge='shift'):
+	'''
+	Gets the value of one pixel and the statistics of the 3x3 and 5x5 grids around it.
+
+	Parameters
+	----------
+	swath : dict
+		Output of read_swath
+	x, y : int
+		Scanline and cross-track index of the pixel
+	sizes : sequence of int
+		Odd window sizes (3 and 5 by default)
+	edge : str
+		How windows at the edge of the swath are handled, 'shift' or 'pad' (see omi_neighborhood)
+
+	Returns
+	-------
+	result : dict
+		x, y (pixel indices), lat, lon (of the pixel), value (NaN if there is no value),
+		and for each window size a dict of count, average, median and stdev (keyed
+		three_by_three, five_by_five, 7x7, ...)
+	'''
+	return _site_results(swath,[x],[y],sizes,edge)[0]
+
+def _site_results(swath,xs,ys,sizes,edge):
+	#pixel values and window statistics of many sites in one vectorized pass
+	stats=neighborhood_statistics(swath['dataArray'],xs,ys,sizes,edge,swath['fv'])
+	results=[]
+	for i,(x,y) in enumerate(zip(xs,ys)):
+		result={'x':int(x),'y':int(y),'lat':swath['lat'][x,y],'lon':swath['lon'][x,y],'value':swath['dataArray'][x,y]}
+		result.update(site_statistics(stats,i))
+		results.append(result)
+	return results
+
+def _in_range(swath,user_lat,user_lon):
+	return swath['min_lat'] <= user_lat <= swath['max_lat'] and swath['min_lon'] <= user_lon <= swath['max_lon']
+
+def location_report(FILE_NAME,user_lat,user_lon,sizes=(3,5),edge='shift',quality=False):
+	'''
+	Reads a file and analyzes one location in it without any prompts (see value_at_location).
+	With quality set, pixels that fail the product's quality rules count as missing.
+
+	Raises
+	------
+	ValueError
+		If the file is not a recognized NO2/SO2 granule or the location is outside the file's lat/lon range
+	'''
+	swath=read_swath(FILE_NAME,quality=quality)
+	if not _in_range(swath,user_lat,user_lon):
+		raise ValueError('The location '+str((user_lat,user_lon))+' is out of the range of '+FILE_NAME)
+	result=value_at_location(swath,user_lat,user_lon,sizes,edge)
+	result['SDS_NAME']=swath['SDS_NAME']
+	return result
+
+def locations_report(FILE_NAME,user_lats,user_lons,sizes=(3,5),edge='shift',quality=False):
+	'''
+	Reads a file once and analyzes many locations in it, using a spatial index for the
+	nearest-pixel search (see omi_spatial.SwathIndex).
+
+	Parameters
+	----------
+	FILE_NAME : str
+		Path of the OMI he5 file
+	user_lats, user_lons : sequence of float
+		Locations to analyze (Deg. N, Deg. E)
+	sizes, edge :
+		Window sizes and edge handling (see pixel_statistics)
+	quality : bool
+		Treat pixels that fail the product's quality rules as missing (see omi_quality)
+
+	Returns
+	-------
+	results : list of dict
+		One pixel_statistics result per location (with the location's user_lat/user_lon),
+		or just user_lat, user_lon and an error for locations outside the file's range
+	'''
+	swath=read_swath(FILE_NAME,quality=quality)
+	return sites_report(swath,user_lats,user_lons,sizes,edge)
+
+def sites_report(swath,user_lats,user_lons,sizes=(3,5),edge='shift',index=None):
+	'''
+	Analyzes many locations in a swath that has already been read (see locations_report).
+
+	Parameters
+	----------
+	swath : dict
+		Output of read_swath
+	user_lats, user_lons : sequence of float
+		Locations to analyze (Deg. N, Deg. E)
+	sizes, edge :
+		Window sizes and edge handling (see pixel_statistics)
+	index : omi_spatial.SwathIndex, optional
+		Index of the swath's pixels, if one has already been built
+
+	Returns
+	-------
+	results : list of dict
+		As for locations_report
+	'''
+	with stage('search'):
+		if index is None:
+			index=SwathIndex(swath['lat'],swath['lon'])
+		xs,ys,distances=index.query(user_lats,user_lons)
+	inside=np.array([_in_range(swath,user_lat,user_lon) for user_lat,user_lon in zip(user_lats,user_lons)],dtype=bool)
+	sites=iter(_site_results(swath,xs[inside],ys[inside],sizes,edge))
+	results=[]
+	for user_lat,user_lon,in_range in zip(user_lats,user_lons,inside):
+		if not in_range:
+			results.append({'user_lat':user_lat,'user_lon':user_lon,'error':'out of range'})
+			continue
+		result=next(sites)
+		result.update({'user_lat':user_lat,'user_lon':user_lon,'SDS_NAME':swath['SDS_NAME']})
+		results.append(result)
+	return results
+
+def print_grid_statistics(stats,size,end=''):
+	#prints the statistics of a 3x3 or 5x5 grid the way the interactive tool always has
+	nnan=stats['count']
+	if nnan == 0:
+		print ('There are no valid pixels in a '+size+' grid centered at your entered location.'+end)
 	else:
-		file = h5py.File(FILE_NAME, 'r')   # 'r' means that hdf5 file is open in read-only mode	
-		if 'NO2' in FILE_NAME:
-			print('This is an OMI NO2 file. Here is some information: ')
-			#this is how you access the data tree in an hdf5 file
-			dataFields=file['HDFEOS']['SWATHS']['ColumnAmountNO2']['Data Fields']
-			geolocation=file['HDFEOS']['SWATHS']['ColumnAmountNO2']['Geolocation Fields']
-			SDS_NAME='ColumnAmountNO2'
-			data=dataFields[SDS_NAME]
-			map_label=data.attrs['Units'].decode()
-		elif 'SO2' in FILE_NAME:
-			print('This is an OMI SO2 file. Here is some information: ')
-			dataFields=file['HDFEOS']['SWATHS']['OMI Total Column Amount SO2']['Data Fields']
-			geolocation=file['HDFEOS']['SWATHS']['OMI Total Column Amount SO2']['Geolocation Fields']
-			SDS_NAME='ColumnAmountSO2_PBL'
-			data=dataFields[SDS_NAME]
-			valid_min=data.attrs['ValidRange'][0]
-			valid_max=data.attrs['ValidRange'][1]
-			map_label=data.attrs['Units'].decode()
-			print('Valid Range is: ',valid_min,valid_max)
+		if nnan == 1:
+			npixels='is'
+			mpixels='pixel'
 		else:
-			print('The file named :',FILE_NAME, ' is not a valid OMI file. \n')
-			#if the program is unable to determine that it is an OMI SO2 or NO2 file, then it will skip to the next file
-			continue		
-		# Get lat and lon info
-		lat=geolocation['Latitude'][:]
-		min_lat=np.min(lat)
-		max_lat=np.max(lat)
-		lon=geolocation['Longitude'][:]
-		min_lon=np.min(lon)
-		max_lon=np.max(lon)
-		
-		#get SDS, or exit program if SDS is not in the file
-		try:
-			sds=dataFields[SDS_NAME]
-		except:
-			print('Sorry, your OMI file does not contain the SDS:',SDS_NAME,'. Please try again with the correct file type.')
+			npixels='are'
+			mpixels='pixels'
+		print('There',npixels,nnan,'valid',mpixels,'in a '+size+' grid centered at your entered location.'+end)
+		print('The average value in this grid is: ',round(stats['average'],3),' \nThe median value in this grid is: ',round(stats['median'],3),'\nThe standard deviation in this grid is: ',round(stats['stdev'],3))
+
+if __name__ == '__main__':
+	#This finds the user's current path so that all hdf4 files can be found
+	try:
+		fileList=open('fileList.txt','r')
+	except:
+		print('Did not find a text file containing file names (perhaps name does not match)')
+		sys.exit()
+
+	#loops through all files listed in the text file
+	for FILE_NAME in fileList:
+		FILE_NAME=FILE_NAME.strip()
+		user_input=input('\nWould you like to process\n' + FILE_NAME + '\n\n(Y/N)')
+		if(user_input == 'N' or user_input == 'n'):
+			print('Skipping...')
 			continue
-		#get scale factor and fill value for data field
-		scale=sds.attrs['ScaleFactor']
-		fv=sds.attrs['_FillValue']
-		mv=sds.attrs['MissingValue']
-		offset=sds.attrs['Offset']
-		
-		#get SDS data
-		data=dataFields[SDS_NAME]
-		dataArray=data[:].astype(float)
-		dataArray[dataArray==float(fv)]=np.nan
-		dataArray[dataArray==float(mv)]=np.nan
-		dataArray = scale * (dataArray - offset)
-		
-		#Print the range of latitude and longitude found in the file, then ask for a lat and lon
-		print('The range of latitude in this file is: ',min_lat,' to ',max_lat, 'degrees \nThe range of longitude in this file is: ',min_lon, ' to ',max_lon,' degrees')
-		user_lat=float(input('\nPlease enter the latitude you would like to analyze (Deg. N): '))
-		user_lon=float(input('Please enter the longitude you would like to analyze (Deg. E): '))
-		#Continues to ask for lat and lon until the user enters valid values
-		while user_lat < min_lat or user_lat > max_lat:
-			user_lat=float(input('The latitude you entered is out of range. Please enter a valid latitude: '))
-		while user_lon < min_lon or user_lon > max_lon:
-			user_lon=float(input('The longitude you entered is out of range. Please enter a valid longitude: '))
-			
-		#calculation to find nearest point in data to entered location (haversine formula)
-		R=6371000#radius of the earth in meters
-		lat1=np.radians(user_lat)
-		lat2=np.radians(lat)
-		delta_lat=np.radians(lat-user_lat)
-		delta_lon=np.radians(lon-user_lon)
-		a=(np.sin(delta_lat/2))*(np.sin(delta_lat/2))+(np.cos(lat1))*(np.cos(lat2))*(np.sin(delta_lon/2))*(np.sin(delta_lon/2))
-		c=2*np.arctan2(np.sqrt(a),np.sqrt(1-a))
-		d=R*c
-		#gets (and then prints) the x,y location of the nearest point in data to entered location, accounting for no data values
-		x,y=np.unravel_index(d.argmin(),d.shape)
-		print(x,y)
-		print('\nThe nearest pixel to your entered location is at: \nLatitude:',lat[x,y],' Longitude:',lon[x,y])
-		if np.isnan(dataArray[x,y]):
-			print('The value of ',SDS_NAME,'at this pixel is',fv[0],',(No Value)\n')
-		elif dataArray[x,y] != fv:
-			print('The value of ', SDS_NAME, 'at this pixel is ',round(dataArray[x,y],3))
-			
-		#calculates mean, median, stdev in a 3x3 grid around nearest point to entered location
-		if x < 1:
-			x+=1
-		if x > dataArray.shape[0]-2:
-			x-=2
-		if y < 1:
-			y+=1
-		if y > dataArray.shape[1]-2:
-			y-=2
-		three_by_three=dataArray[x-1:x+2,y-1:y+2]
-		three_by_three=three_by_three.astype(float)
-		three_by_three[three_by_three==float(fv)]=np.nan
-		nnan=np.count_nonzero(~np.isnan(three_by_three))
-		if nnan == 0:
-			print ('There are no valid pixels in a 3x3 grid centered at your entered location.')
-		else:
-			three_by_three_average=np.nanmean(three_by_three)
-			three_by_three_std=np.nanstd(three_by_three)
-			three_by_three_median=np.nanmedian(three_by_three)
-			if nnan == 1:
-				npixels='is'
-				mpixels='pixel'
-			else:
-				npixels='are'
-				mpixels='pixels'
-			print('There',npixels,nnan,'valid',mpixels,'in a 3x3 grid centered at your entered location.')
-			print('The average value in this grid is: ',round(three_by_three_average,3),' \nThe median value in this grid is: ',round(three_by_three_median,3),'\nThe standard deviation in this grid is: ',round(three_by_three_std,3))
-		
-		#calculates mean, median, stdev in a 5x5 grid around nearest point to entered location
-		if x < 2:
-			x+=1
-		if x > dataArray.shape[0]-3:
-			x-=1
-		if y < 2:
-			y+=1
-		if y > dataArray.shape[1]-3:
-			y-=1
-		five_by_five=dataArray[x-2:x+3,y-2:y+3]
-		five_by_five=five_by_five.astype(float)
-		five_by_five[five_by_five==float(fv)]=np.nan
-		nnan=np.count_nonzero(~np.isnan(five_by_five))
-		if nnan == 0:
-			print ('There are no valid pixels in a 5x5 grid centered at your entered location. \n')
 		else:
-			five_by_five_average=np.nanmean(five_by_five)
-			five_by_five_std=np.nanstd(five_by_five)
-			five_by_five_median=np.nanmedian(five_by_five)
-			if nnan == 1:
-				npixels='is'
-				mpixels='pixel'
-			else:
-				npixels='are'
-				mpixels='pixels'
-			print('\nThere',npixels,nnan,' valid',mpixels,' in a 5x5 grid centered at your entered location. \n')
-			print('The average value in this grid is: ',round(five_by_five_average,3),' \nThe median value in this grid is: ',round(five_by_five_median,3),'\nThe standard deviation in this grid is: ',round(five_by_five_std,3))
\ No newline at end of file
+			try:
+				swath=read_swath(FILE_NAME)
+			except (ValueError,KeyError) as error:
+				print(error.args[0],'\n')
+				continue
+			print('This is an',swath['instrument'],swath['product'],'file. Here is some information: ')
+			if swath['valid_range'] is not None:
+				print('Valid Range is: ',swath['valid_range'][0],swath['valid_range'][1])
+			min_lat=swath['min_lat']
+			max_lat=swath['max_lat']
+			min_lon=swath['min_lon']
+			max_lon=swath['max_lon']
+			
+			#Print the range of latitude and longitude found in the file, then ask for a lat and lon
+			print('The range of latitude in this file is: ',min_lat,' to ',max_lat, 'degrees \nThe range of longitude in this file is: ',min_lon, ' to ',max_lon,' degrees')
+			user_lat=float(input('\nPlease enter the latitude you would like to analyze (Deg. N): '))
+			user_lon=float(input('Please enter the longitude you would like to analyze (Deg. E): '))
+			#Continues to ask for lat and lon until the user enters valid values
+			while user_lat < min_lat or user_lat > max_lat:
+				user_lat=float(input('The latitude you entered is out of range. Please enter a valid latitude: '))
+			while user_lon < min_lon or user_lon > max_lon:
+				user_lon=float(input('The longitude you entered is out of range. Please enter a valid longitude: '))
+				
+			result=value_at_location(swath,user_lat,user_lon)
+			SDS_NAME=swath['SDS_NAME']
+			print(result['x'],result['y'])
+			print('\nThe nearest pixel to your entered location is at: \nLatitude:',result['lat'],' Longitude:',result['lon'])
+			if np.isnan(result['value']):
+				print('The value of ',SDS_NAME,'at this pixel is',swath['fv'],',(No Value)\n')
+			elif result['value'] != swath['fv']:
+				print('The value of ', SDS_NAME, 'at this pixel is ',round(result['value'],3))
+			print_grid_statistics(result['three_by_three'],'3x3')
+			print_grid_statistics(result['five_by_five'],'5x5',' \n')
\ No newline at end of file
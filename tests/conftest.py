@@ -0,0 +1,18 @@
+'''
+Shared fixtures for the tests of the OMI tools. The modules live at the top of the
+repository, so it is put on the import path; granules are made with
+generate_synthetic_omi_he5.py, so no real data is needed.
+'''
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def granules(tmp_path_factory):
+	'''Fifteen consecutive synthetic OMNO2 orbits (100 scanlines each), a little more than
+	once around the globe.'''
+	from generate_synthetic_omi_he5 import generate_granules
+	return generate_granules(str(tmp_path_factory.mktemp('granules')),15,('NO2',),100,60)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from omi_binning import GridAccumulator, LatLonGrid, composite
+
+def _direct(grid,lat,lon,values):
+	#mean, std and count of every cell computed cell by cell with numpy
+	min_lat,max_lat,min_lon,max_lon=grid.bounds
+	mean=np.full(grid.shape,np.nan)
+	std=np.full(grid.shape,np.nan)
+	count=np.zeros(grid.shape,dtype=np.int64)
+	lat=np.asarray(lat,dtype=np.float64).ravel()
+	lon=np.asarray(lon,dtype=np.float64).ravel()
+	values=np.asarray(values,dtype=np.float64).ravel()
+	keep=np.isfinite(values)&(lat>=min_lat)&(lat<=max_lat)&(lon>=min_lon)&(lon<=max_lon)
+	rows=np.minimum(((lat[keep]-min_lat)//grid.resolution).astype(int),grid.shape[0]-1)
+	cols=np.minimum(((lon[keep]-min_lon)//grid.resolution).astype(int),grid.shape[1]-1)
+	for row,col in set(zip(rows,cols)):
+		cell=values[keep][(rows==row)&(cols==col)]
+		mean[row,col]=np.mean(cell)
+		std[row,col]=np.std(cell)
+		count[row,col]=cell.size
+	return mean,std,count
+
+def _assert_matches(accumulator,expected):
+	mean,std,count=expected
+	np.testing.assert_array_equal(accumulator.counts(),count)
+	np.testing.assert_allclose(accumulator.mean(),mean,rtol=1e-10)
+	#the one-pass variance loses precision when the spread is small next to the mean
+	np.testing.assert_allclose(accumulator.std(),std,rtol=1e-5,atol=1e-6*np.nanmax(std))
+
+@pytest.fixture
+def pixels():
+	rng=np.random.default_rng(5)
+	lat=rng.uniform(-30,30,20000)
+	lon=rng.uniform(-40,40,20000)
+	values=rng.normal(3e15,1e15,20000)
+	values[rng.random(20000)<0.1]=np.nan
+	return lat,lon,values
+
+def test_cell_index_edges():
+	grid=LatLonGrid(1.0,(-10.0,10.0,20.0,30.0))
+	lat=np.array([-10.0,10.0,-9.0,-9.5,0.0,9.999,10.0001,-10.0001,np.nan,5.0])
+	lon=np.array([20.0,30.0,21.0,29.5,25.0,29.999,25.0,25.0,25.0,np.nan])
+	expected=[0,19*10+9,1*10+1,0*10+9,10*10+5,19*10+9,-1,-1,-1,-1]
+	np.testing.assert_array_equal(grid.cell_index(lat,lon),expected)
+	#a value on an interior cell boundary belongs to the cell above it
+	assert grid.cell_index(np.array([0.0]),np.array([21.0]))[0] == 10*10+1
+
+def test_accumulator_matches_direct_computation(pixels):
+	grid=LatLonGrid(5.0,(-30.0,30.0,-40.0,40.0))
+	lat,lon,values=pixels
+	_assert_matches(GridAccumulator(grid).add(lat,lon,values),_direct(grid,lat,lon,values))
+	#a mask leaves pixels out like NaN values do
+	mask=lat>0
+	_assert_matches(GridAccumulator(grid).add(lat,lon,values,mask),_direct(grid,lat,lon,np.where(mask,values,np.nan)))
+
+def test_merge_equals_single_pass(pixels):
+	grid=LatLonGrid(5.0,(-30.0,30.0,-40.0,40.0))
+	lat,lon,values=pixels
+	single=GridAccumulator(grid).add(lat,lon,values)
+	merged=GridAccumulator(grid)
+	for part in np.array_split(np.arange(lat.size),4):
+		merged.merge(GridAccumulator(grid).add(lat[part],lon[part],values[part]))
+	np.testing.assert_array_equal(merged.count,single.count)
+	np.testing.assert_allclose(merged.sum,single.sum,rtol=1e-12)
+	np.testing.assert_allclose(merged.sumsq,single.sumsq,rtol=1e-12)
+	with pytest.raises(ValueError):
+		merged.merge(GridAccumulator(LatLonGrid(1.0)))
+
+def test_save_and_load(tmp_path,pixels):
+	grid=LatLonGrid(5.0,(-30.0,30.0,-40.0,40.0))
+	accumulator=GridAccumulator(grid).add(*pixels)
+	accumulator.save(str(tmp_path/'grid.npz'))
+	loaded=GridAccumulator.load(str(tmp_path/'grid.npz'))
+	assert loaded.grid == grid
+	np.testing.assert_array_equal(loaded.counts(),accumulator.counts())
+	np.testing.assert_array_equal(loaded.mean(),accumulator.mean())
+
+@pytest.mark.parametrize('bounds',[(-90.0,90.0,-180.0,180.0),(-40.0,40.0,-60.0,60.0)])
+def test_composite_matches_direct_computation(granules,bounds):
+	from omi_reader import read_swath
+	grid=LatLonGrid(2.0,bounds)
+	swaths=[read_swath(FILE_NAME) for FILE_NAME in granules[:6]]
+	expected=_direct(grid,np.concatenate([swath['lat'].ravel() for swath in swaths]),np.concatenate([swath['lon'].ravel() for swath in swaths]),
+		np.concatenate([swath['dataArray'].ravel() for swath in swaths]))
+	for workers in (1,3):
+		accumulators,errors=composite(granules[:6],grid,'all',workers,depth=0)
+		assert errors == [] and list(accumulators) == ['all']
+		_assert_matches(accumulators['all'],expected)
+
+def test_composite_by_day(granules):
+	accumulators,errors=composite(granules,LatLonGrid(5.0),'day',2,depth=0)
+	assert errors == [] and list(accumulators) == ['2019-05-01']
+	total,errors=composite(granules,LatLonGrid(5.0),'all',depth=0)
+	np.testing.assert_array_equal(accumulators['2019-05-01'].count,total['all'].count)
@@ -0,0 +1,109 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from omi_cache import FieldCache
+from omi_reader import Granule, SDSHandle
+
+@pytest.fixture
+def cache(tmp_path):
+	return FieldCache(str(tmp_path/'cache'))
+
+@pytest.fixture
+def raw_reads(monkeypatch):
+	#names of the datasets read from the file
+	reads=[]
+	raw=SDSHandle.raw
+	def counting(self,window=None):
+		reads.append(self.name)
+		return raw(self,window)
+	monkeypatch.setattr(SDSHandle,'raw',counting)
+	return reads
+
+def test_quality_flags_come_from_the_cache(cache,granules,raw_reads):
+	with Granule(granules[0],cache=cache) as granule:
+		mask=granule.quality_mask()
+		dataArray=granule[granule.schema.main_sds].read()
+	assert 'VcdQualityFlags' in raw_reads and 'XTrackQualityFlags' in raw_reads
+	del raw_reads[:]
+	with Granule(granules[0],cache=cache) as granule:
+		np.testing.assert_array_equal(granule.quality_mask(),mask)
+		np.testing.assert_array_equal(granule[granule.schema.main_sds].read(),dataArray)
+	assert raw_reads == []
+
+def test_changed_file_is_not_served_stale(cache,granules,tmp_path):
+	FILE_NAME=str(tmp_path/'granule.he5')
+	shutil.copy(granules[0],FILE_NAME)
+	key=cache.key(FILE_NAME,'geo:Longitude')
+	with Granule(FILE_NAME,cache=cache) as granule:
+		first=np.array(granule.lon)
+	#a new modification time alone gives a new key
+	stat=os.stat(FILE_NAME)
+	os.utime(FILE_NAME,ns=(stat.st_atime_ns,stat.st_mtime_ns+10**9))
+	assert cache.key(FILE_NAME,'geo:Longitude') != key
+	assert cache.get(FILE_NAME,'geo:Longitude') is None
+	#so does a new size with the same modification time
+	other=str(tmp_path/'other.he5')
+	shutil.copy(FILE_NAME,other)
+	stat=os.stat(other)
+	key=cache.key(other,'geo:Longitude')
+	with open(other,'ab') as outfile:
+		outfile.write(b'\0')
+	os.utime(other,ns=(stat.st_atime_ns,stat.st_mtime_ns))
+	assert cache.key(other,'geo:Longitude') != key
+	#another granule copied over the file is read afresh
+	shutil.copy(granules[3],FILE_NAME)
+	with Granule(FILE_NAME,cache=cache) as granule:
+		lon=granule.lon
+	with Granule(granules[3]) as granule:
+		np.testing.assert_array_equal(lon,granule.lon)
+	assert not np.array_equal(lon,first)
+
+def test_least_recently_used_fields_are_evicted(tmp_path,granules):
+	cache=FieldCache(str(tmp_path/'cache'),max_bytes=2500)
+	arrays={}
+	for age,name in ((300,'a'),(200,'b')):
+		arrays[name]=cache.put(granules[0],name,np.full(100,ord(name),dtype=np.float64))
+		path=os.path.join(cache.directory,cache.key(granules[0],name))
+		os.utime(path,(os.path.getmtime(path)-age,)*2)
+	#reading a marks it as recently used, so b is the one deleted when c is added
+	assert cache.get(granules[0],'a') is not None
+	cache.put(granules[0],'c',np.zeros(100))
+	assert cache.get(granules[0],'b') is None
+	assert cache.get(granules[0],'a') is not None
+	assert cache.get(granules[0],'c') is not None
+	assert cache.size() <= 2500
+	#a field larger than the cap is returned but not stored
+	big=cache.put(granules[0],'big',np.zeros(1000))
+	assert big.shape == (1000,) and cache.get(granules[0],'big') is None
+
+def test_cached_reads_are_read_only_memory_maps(cache,granules):
+	with Granule(granules[1]) as granule:
+		expected=granule[granule.schema.main_sds].read()
+		lat=granule.lat
+	for run in range(2):
+		with Granule(granules[1],cache=cache) as granule:
+			dataArray=granule[granule.schema.main_sds].read()
+			cached_lat=granule.read_geolocation(granule.schema.latitude)
+		for array in (dataArray,cached_lat):
+			assert isinstance(array,np.memmap)
+			assert not array.flags.writeable
+			with pytest.raises(ValueError):
+				array[0,0]=0
+		np.testing.assert_array_equal(dataArray,expected)
+		np.testing.assert_array_equal(cached_lat,lat)
+
+def test_window_reads(cache,granules,raw_reads):
+	window=(slice(10,40),slice(5,25))
+	with Granule(granules[2]) as granule:
+		expected=granule[granule.schema.main_sds].read()
+	with Granule(granules[2],cache=cache) as granule:
+		sds=granule[granule.schema.main_sds]
+		#before the field is cached, a window is decoded from the file and not stored
+		np.testing.assert_array_equal(sds.read(window),expected[window])
+		assert cache.get(granules[2],'sds:{0}:<f8:nan'.format(sds.dataset.name)) is None
+		sds.read()
+		del raw_reads[:]
+		np.testing.assert_array_equal(sds.read(window),expected[window])
+		np.testing.assert_array_equal(granule.read_geolocation(granule.schema.latitude,window),np.asarray(granule.lat)[window])
+	assert sds.name not in raw_reads
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from omi_catalog import CELL_SIZE, Catalog, _NCOLS, _cells
+from omi_reader import Granule
+from omi_subset import read_subset
+
+def _has_pixels(FILE_NAME,min_lat,max_lat,min_lon,max_lon):
+	#whether a granule has pixels in a box (crossing the antimeridian if max_lon < min_lon)
+	with Granule(FILE_NAME) as granule:
+		lat=granule.lat
+		lon=granule.lon
+	if min_lon <= max_lon:
+		in_lon=(lon>=min_lon)&(lon<=max_lon)
+	else:
+		in_lon=(lon>=min_lon)|(lon<=max_lon)
+	return bool(((lat>=min_lat)&(lat<=max_lat)&in_lon).any())
+
+@pytest.fixture
+def catalog(tmp_path,granules):
+	catalog=Catalog(str(tmp_path/'catalog.sqlite'))
+	catalog.update(granules)
+	yield catalog
+	catalog.close()
+
+def test_cells_at_longitude_edges():
+	rows,cols=_cells(np.array([0.0,0.0,0.0,90.0]),np.array([-180.0,180.0,179.9,0.0]))
+	assert cols.tolist() == [0,_NCOLS-1,_NCOLS-1,_NCOLS//2]
+	assert rows[3] == 180/CELL_SIZE-1
+
+def test_whole_globe_bbox_selects_every_granule(catalog,granules):
+	assert catalog.query(granules,bbox=(-90,90,-180,180)) == granules
+	assert catalog.query(bbox=(-90,90,-180,180)) == catalog.query(bbox=(-90,90,-180,179.9))
+
+def test_bbox_ending_at_180(catalog,granules):
+	expected=[FILE_NAME for FILE_NAME in granules if _has_pixels(FILE_NAME,-10,10,170,180)]
+	selected=catalog.query(granules,bbox=(-10,10,170,180))
+	assert expected and set(expected) <= set(selected)
+	assert len(selected) < len(granules)
+
+def test_points_on_the_antimeridian(catalog,granules):
+	assert catalog.query(granules,points=[(0.0,180.0)]) == catalog.query(granules,points=[(0.0,-180.0)])
+
+def test_bbox_across_the_antimeridian(catalog,granules):
+	box=(-10,10,170,-170)
+	selected=catalog.query(granules,bbox=box)
+	expected=[FILE_NAME for FILE_NAME in granules if _has_pixels(FILE_NAME,*box)]
+	assert expected and set(expected) <= set(selected)
+	#footprints are grown by one cell, so only granules within that margin of the box may be added
+	margin=2*CELL_SIZE
+	nearby=[FILE_NAME for FILE_NAME in granules if _has_pixels(FILE_NAME,box[0]-margin,box[1]+margin,box[2]-margin,box[3]+margin)]
+	assert set(selected) <= set(nearby)
+	assert len(nearby) < len(granules)
+
+@pytest.mark.parametrize('box',[(-10,10,170,-170),(-10,10,-30,30)])
+def test_subset_matches_a_full_read(catalog,granules,box):
+	min_lat,max_lat,min_lon,max_lon=box
+	total=0
+	for FILE_NAME in catalog.query(granules,bbox=box):
+		with Granule(FILE_NAME) as granule:
+			lat=granule.lat
+			lon=granule.lon
+			in_lon=(lon>=min_lon)|(lon<=max_lon) if min_lon > max_lon else (lon>=min_lon)&(lon<=max_lon)
+			inside=(lat>=min_lat)&(lat<=max_lat)&in_lon
+			expected=granule[granule.schema.main_sds].read()[inside]
+		for cached in (None,catalog):
+			subset=read_subset(FILE_NAME,box,catalog=cached)
+			if not inside.any():
+				assert subset is None
+				continue
+			np.testing.assert_array_equal(subset[subset['SDS_NAME']][subset['inside']],expected)
+		total+=inside.sum()
+	assert total > 0
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from omi_binning import LatLonGrid
+from omi_climatology import Climatology, update
+
+@pytest.fixture
+def saves(monkeypatch):
+	#number of granules in the climatology at each checkpoint
+	saves=[]
+	monkeypatch.setattr(Climatology,'save',lambda self,FILE_NAME: saves.append(len(self.granules)))
+	return saves
+
+def test_checkpoint_every_few_added_granules(granules,saves):
+	climatology=Climatology(LatLonGrid(5.0),(-1e15,2e16),8)
+	added,errors=update(climatology,granules,'climatology.npz',4,depth=0)
+	assert (added,errors) == (15,[])
+	assert saves == [4,8,12,15]
+
+def test_skipped_granules_do_not_trigger_checkpoints(granules,saves):
+	#the synthetic orbits are all in May
+	climatology=Climatology(LatLonGrid(5.0),(-1e15,2e16),8,months=[6])
+	added,errors=update(climatology,granules,'climatology.npz',4,depth=0)
+	assert (added,errors) == (0,[])
+	assert len(climatology.granules) == 15
+	assert saves == [15]
+
+def test_no_checkpoint_for_each_skipped_granule_after_a_save(granules,saves):
+	#the first four granules are added and the rest are outside the chosen months
+	climatology=Climatology(LatLonGrid(5.0),(-1e15,2e16),8)
+	wanted=iter([True]*4+[False]*11)
+	climatology.wants=lambda scan_dates: next(wanted)
+	added,errors=update(climatology,granules,'climatology.npz',4,depth=0)
+	assert added == 4
+	assert saves == [4,15]
+
+@pytest.fixture
+def batches():
+	#four batches of pixels on a small grid, with a large mean next to their spread and some NaN values
+	rng=np.random.default_rng(6)
+	batches=[]
+	for i in range(4):
+		lat=rng.uniform(-20,20,5000)
+		lon=rng.uniform(-20,20,5000)
+		values=rng.normal(4e15+i*5e14,1e15,5000)
+		values[rng.random(5000)<0.1]=np.nan
+		batches.append((lat,lon,values))
+	return batches
+
+def _cells(grid,batches):
+	#all finite values of every cell, gathered directly
+	lat=np.concatenate([batch[0] for batch in batches])
+	lon=np.concatenate([batch[1] for batch in batches])
+	values=np.concatenate([batch[2] for batch in batches])
+	index=grid.cell_index(lat,lon)
+	keep=(index>=0)&np.isfinite(values)
+	return index[keep],values[keep]
+
+def test_running_mean_and_std_match_numpy(batches):
+	grid=LatLonGrid(5.0,(-20.0,20.0,-20.0,20.0))
+	climatology=Climatology(grid,(0.0,1e16),64)
+	for batch in batches[:2]:
+		climatology.add(*batch)
+	other=Climatology(grid,(0.0,1e16),64)
+	for batch in batches[2:]:
+		other.add(*batch)
+	climatology.merge(other)
+	index,values=_cells(grid,batches)
+	mean=climatology.means().ravel()
+	std=climatology.std().ravel()
+	for cell in range(grid.shape[0]*grid.shape[1]):
+		cell_values=values[index == cell]
+		assert climatology.count[cell] == cell_values.size
+		assert mean[cell] == pytest.approx(np.mean(cell_values),rel=1e-12)
+		assert std[cell] == pytest.approx(np.std(cell_values),rel=1e-9)
+
+def test_median_within_one_bin(batches):
+	grid=LatLonGrid(10.0,(-20.0,20.0,-20.0,20.0))
+	climatology=Climatology(grid,(-2e15,1.2e16),128)
+	for batch in batches:
+		climatology.add(*batch)
+	index,values=_cells(grid,batches)
+	width=climatology.edges[1]-climatology.edges[0]
+	median=climatology.median().ravel()
+	for cell in range(grid.shape[0]*grid.shape[1]):
+		assert abs(median[cell]-np.median(values[index == cell])) <= width
+
+def test_anomaly_needs_enough_samples():
+	grid=LatLonGrid(10.0,(-20.0,20.0,-20.0,20.0))
+	climatology=Climatology(grid,(0.0,10.0),8)
+	#one value in the cell at (5, 5) and three in the cell at (-5, -5)
+	climatology.add(np.array([5.0,-5.0,-5.0,-5.0]),np.array([5.0,-5.0,-5.0,-5.0]),np.array([2.0,1.0,2.0,3.0]))
+	lat=np.array([5.0,-5.0,15.0,-5.0,40.0])
+	lon=np.array([5.0,-5.0,15.0,-5.0,0.0])
+	anomaly,zscore=climatology.anomaly(lat,lon,np.array([4.0,4.0,4.0,np.nan,4.0]),min_count=2)
+	np.testing.assert_array_equal(np.isnan(anomaly),[True,False,True,True,True])
+	assert anomaly[1] == 2.0
+	assert zscore[1] == pytest.approx(2.0/np.std([1.0,2.0,3.0]))
+	anomaly,zscore=climatology.anomaly(lat,lon,np.full(5,4.0),min_count=1)
+	assert anomaly[0] == 2.0
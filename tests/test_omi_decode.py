@@ -0,0 +1,64 @@
+import h5py
+import numpy as np
+import pytest
+import omi_decode
+from benchmark_omi_decode import SDS_NAMES, original_decode
+from generate_synthetic_omi_he5 import write_granule
+from omi_decode import decode, decode_many
+from omi_reader import Granule
+
+WINDOWS=[(slice(0,1),),(slice(17,183),slice(5,41)),(slice(250,300),slice(59,60)),(slice(-40,None),),(slice(100,100),)]
+
+@pytest.fixture(scope='module')
+def FILE_NAME(tmp_path_factory):
+	FILE_NAME=str(tmp_path_factory.mktemp('decode')/'OMI-Aura_L2-OMNO2_decode.he5')
+	write_granule(FILE_NAME,'NO2',300,60)
+	#a scale factor and offset that are not 1 and 0, so the arithmetic is exercised too
+	with h5py.File(FILE_NAME,'r+') as f:
+		sds=f['HDFEOS/SWATHS/ColumnAmountNO2/Data Fields/ColumnAmountNO2Std']
+		sds.attrs['ScaleFactor']=np.array([2.5])
+		sds.attrs['Offset']=np.array([1e13])
+	return FILE_NAME
+
+@pytest.fixture(autouse=True,params=[omi_decode.CHUNK_BYTES,60*4*7])
+def block_size(request,monkeypatch):
+	#the default blocks, and blocks much smaller than an HDF5 chunk
+	monkeypatch.setattr(omi_decode,'CHUNK_BYTES',request.param)
+
+def test_float64_matches_the_original_decode(FILE_NAME):
+	with Granule(FILE_NAME) as granule:
+		for SDS_NAME in SDS_NAMES:
+			expected=original_decode(granule.dataFields[SDS_NAME])
+			dataArray=decode(granule[SDS_NAME])
+			assert dataArray.dtype == np.float64
+			assert np.isnan(expected).any()
+			np.testing.assert_array_equal(dataArray,expected)
+
+def test_windows_match_the_original_decode(FILE_NAME):
+	with Granule(FILE_NAME) as granule:
+		for SDS_NAME in SDS_NAMES:
+			expected=original_decode(granule.dataFields[SDS_NAME])
+			for window in WINDOWS:
+				np.testing.assert_array_equal(decode(granule[SDS_NAME],window=window),expected[window])
+
+def test_float32_and_masked(FILE_NAME):
+	with Granule(FILE_NAME) as granule:
+		expected=original_decode(granule.dataFields['ColumnAmountNO2Std'])
+		dataArray=decode(granule['ColumnAmountNO2Std'],dtype=np.float32)
+		assert dataArray.dtype == np.float32
+		np.testing.assert_array_equal(np.isnan(dataArray),np.isnan(expected))
+		np.testing.assert_allclose(dataArray,expected,rtol=1e-6)
+		masked=decode(granule['ColumnAmountNO2Std'],masked=True)
+		np.testing.assert_array_equal(masked.mask,np.isnan(expected))
+		np.testing.assert_array_equal(masked.filled(np.nan),expected)
+
+def test_decode_many_shares_the_mask(FILE_NAME):
+	with Granule(FILE_NAME) as granule:
+		expected={SDS_NAME:original_decode(granule.dataFields[SDS_NAME]) for SDS_NAME in SDS_NAMES}
+		arrays,invalid=decode_many([granule[SDS_NAME] for SDS_NAME in SDS_NAMES],window=WINDOWS[1])
+	missing=np.any([np.isnan(expected[SDS_NAME][WINDOWS[1]]) for SDS_NAME in SDS_NAMES],axis=0)
+	np.testing.assert_array_equal(invalid,missing)
+	for SDS_NAME in SDS_NAMES:
+		values=expected[SDS_NAME][WINDOWS[1]].copy()
+		values[missing]=np.nan
+		np.testing.assert_array_equal(arrays[SDS_NAME],values)
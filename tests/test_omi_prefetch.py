@@ -0,0 +1,78 @@
+import threading
+import time
+import numpy as np
+import pytest
+from omi_prefetch import prefetch, result_bytes
+
+class FakeLoad(object):
+	#stands in for read_swath: records which names were started and returns 1000 bytes per name
+	def __init__(self,delay=0.0,fail=()):
+		self.started=[]
+		self.delay=delay
+		self.fail=set(fail)
+		self.lock=threading.Lock()
+
+	def __call__(self,FILE_NAME):
+		with self.lock:
+			self.started.append(FILE_NAME)
+		time.sleep(self.delay*(1+hash(FILE_NAME)%3))
+		if FILE_NAME in self.fail:
+			raise IOError('cannot read '+FILE_NAME)
+		return {'name':FILE_NAME,'dataArray':np.zeros(125)}
+
+NAMES=['granule{0:02d}'.format(i) for i in range(30)]
+
+def _wait(load,count):
+	#lets the background thread finish the reads it was given
+	for i in range(200):
+		if len(load.started) >= count:
+			return
+		time.sleep(0.005)
+
+def test_result_bytes():
+	assert result_bytes(np.zeros(10)) == 80
+	assert result_bytes({'a':np.zeros(10),'b':np.zeros(5,dtype=np.float32),'c':'text'}) == 100
+	assert result_bytes(None) == 0
+
+@pytest.mark.parametrize('depth,threads',[(0,1),(1,1),(4,1),(4,3)])
+def test_results_come_in_order(depth,threads):
+	load=FakeLoad(delay=0.001)
+	results=list(prefetch(NAMES,load,depth,threads=threads))
+	assert [FILE_NAME for FILE_NAME,result,error in results] == NAMES
+	assert all(result['name'] == FILE_NAME and error is None for FILE_NAME,result,error in results)
+	assert sorted(load.started) == NAMES
+
+@pytest.mark.parametrize('depth',[0,1,3])
+def test_depth_limit(depth):
+	load=FakeLoad()
+	for i,(FILE_NAME,result,error) in enumerate(prefetch(NAMES,load,depth)):
+		expected=min(len(NAMES),i+1+depth)
+		_wait(load,expected)
+		#never more than depth granules read ahead of the one in use, and that many when there are
+		assert len(load.started) == expected
+
+def test_memory_ceiling():
+	load=FakeLoad()
+	for i,(FILE_NAME,result,error) in enumerate(prefetch(NAMES,load,depth=10,max_bytes=2500)):
+		time.sleep(0.002)
+		if i >= 12:
+			#the first reads are made before any size is known; after that about 2500 bytes are held
+			assert len(load.started)-(i+1) <= 3
+	assert len(load.started) == len(NAMES)
+
+def test_granule_larger_than_the_ceiling_is_still_read():
+	load=FakeLoad()
+	results=list(prefetch(NAMES[:5],load,depth=2,max_bytes=10))
+	assert [FILE_NAME for FILE_NAME,result,error in results] == NAMES[:5]
+	assert all(result is not None for FILE_NAME,result,error in results)
+
+@pytest.mark.parametrize('depth',[0,2])
+def test_errors_are_passed_through(depth):
+	load=FakeLoad(fail=[NAMES[1],NAMES[4]])
+	results=list(prefetch(NAMES[:6],load,depth))
+	assert [FILE_NAME for FILE_NAME,result,error in results] == NAMES[:6]
+	for FILE_NAME,result,error in results:
+		if FILE_NAME in load.fail:
+			assert result is None and isinstance(error,IOError) and FILE_NAME in str(error)
+		else:
+			assert error is None and result['name'] == FILE_NAME
@@ -0,0 +1,99 @@
+import h5py
+import numpy as np
+import pytest
+from generate_synthetic_omi_he5 import write_granule
+from omi_quality import FlagRule, QUALITY_RULES, apply_mask, quality_fields, quality_mask, register_quality_rules
+from omi_reader import Granule, read_swath
+
+SHAPE=(20,12)
+
+def _flags():
+	#summary flags: bit 0 set on every third pixel, other bits (which do not matter) everywhere, a few fill values
+	index=np.arange(SHAPE[0]*SHAPE[1]).reshape(SHAPE)
+	flags=((index%3 == 0).astype(np.uint16))|((index%8).astype(np.uint16)<<1)
+	flags[index%17 == 5]=65535
+	#row anomaly: rows 2 and 7 affected, a few fill values
+	xtrack=np.zeros(SHAPE,dtype=np.uint8)
+	xtrack[:,[2,7]]=4
+	xtrack[index%19 == 3]=255
+	good=(index%3 != 0)&(index%17 != 5)
+	return flags,xtrack,good,good&(xtrack == 0)
+
+def _granule(path,product,xtrack_in=None):
+	#a synthetic granule whose flags are set to _flags(); the row anomaly field is kept with
+	#the data fields, moved to the geolocation fields, or removed (xtrack_in None, 'geo', 'none')
+	FILE_NAME=str(path/'OMI-Aura_L2-OM{0}_test.he5'.format(product))
+	write_granule(FILE_NAME,product,*SHAPE)
+	flags,xtrack,good,expected=_flags()
+	swath='ColumnAmountNO2' if product == 'NO2' else 'OMI Total Column Amount SO2'
+	field='VcdQualityFlags' if product == 'NO2' else 'QualityFlags_PBL'
+	with h5py.File(FILE_NAME,'r+') as f:
+		group=f['HDFEOS/SWATHS/'+swath]
+		group['Data Fields/'+field][...]=flags
+		group['Data Fields/XTrackQualityFlags'][...]=xtrack
+		if xtrack_in == 'geo':
+			group.move('Data Fields/XTrackQualityFlags','Geolocation Fields/XTrackQualityFlags')
+		elif xtrack_in == 'none':
+			del group['Data Fields/XTrackQualityFlags']
+	return FILE_NAME,(good if xtrack_in == 'none' else expected)
+
+@pytest.mark.parametrize('product',['NO2','SO2'])
+@pytest.mark.parametrize('xtrack_in',[None,'geo','none'])
+def test_product_rules(tmp_path,product,xtrack_in):
+	FILE_NAME,expected=_granule(tmp_path,product,xtrack_in)
+	with Granule(FILE_NAME) as granule:
+		assert quality_fields(granule.schema)[-1] == 'XTrackQualityFlags'
+		np.testing.assert_array_equal(granule.quality_mask(),expected)
+		#the mask is computed once per window and reused
+		assert granule.quality_mask() is granule.quality_mask()
+		window=(slice(3,15),slice(1,9))
+		np.testing.assert_array_equal(granule.quality_mask(window),expected[window])
+
+def test_required_field_missing(tmp_path):
+	FILE_NAME,expected=_granule(tmp_path,'NO2')
+	with h5py.File(FILE_NAME,'r+') as f:
+		del f['HDFEOS/SWATHS/ColumnAmountNO2/Data Fields/VcdQualityFlags']
+	with Granule(FILE_NAME) as granule:
+		with pytest.raises(KeyError,match='VcdQualityFlags'):
+			granule.quality_mask()
+
+def test_minimum_rule_and_custom_rules(tmp_path):
+	FILE_NAME,expected=_granule(tmp_path,'NO2')
+	with Granule(FILE_NAME) as granule:
+		values=granule['ColumnAmountNO2Std'].read()
+		rules=[FlagRule('ColumnAmountNO2Std',minimum=5e14)]
+		#fill values are NaN after decoding, so they fail a minimum too
+		np.testing.assert_array_equal(quality_mask(granule,rules=rules),np.nan_to_num(values,nan=-np.inf) >= 5e14)
+		assert quality_mask(granule,rules=[]).all()
+	with pytest.raises(ValueError):
+		FlagRule('VcdQualityFlags')
+	with pytest.raises(ValueError):
+		FlagRule('VcdQualityFlags',bad_bits=1,minimum=0.5)
+
+def test_registered_rules_can_be_replaced(tmp_path,monkeypatch):
+	FILE_NAME,expected=_granule(tmp_path,'NO2')
+	monkeypatch.setitem(QUALITY_RULES,'OMNO2',QUALITY_RULES['OMNO2'])
+	register_quality_rules('OMNO2',[FlagRule('XTrackQualityFlags',bad_bits=0xff)])
+	flags,xtrack,good,both=_flags()
+	with Granule(FILE_NAME) as granule:
+		np.testing.assert_array_equal(granule.quality_mask(),xtrack == 0)
+
+def test_apply_mask():
+	dataArray=np.arange(6,dtype=np.float32).reshape(2,3)
+	mask=np.array([[True,False,True],[False,True,True]])
+	masked=apply_mask(dataArray,mask)
+	assert masked.dtype == np.float32
+	np.testing.assert_array_equal(np.isnan(masked),~mask)
+	np.testing.assert_array_equal(masked[mask],dataArray[mask])
+	assert not np.isnan(dataArray).any()
+	np.testing.assert_array_equal(apply_mask(dataArray,mask,-1.0)[~mask],[-1.0,-1.0])
+	result=apply_mask(np.ma.MaskedArray(dataArray,mask=[[False,False,True],[False,False,False]]),mask)
+	np.testing.assert_array_equal(result.mask,[[False,True,True],[True,False,False]])
+
+def test_read_swath_with_quality(tmp_path):
+	FILE_NAME,expected=_granule(tmp_path,'NO2')
+	plain=read_swath(FILE_NAME)
+	checked=read_swath(FILE_NAME,quality=True)
+	assert plain['quality_mask'] is None
+	np.testing.assert_array_equal(checked['quality_mask'],expected)
+	np.testing.assert_array_equal(checked['dataArray'],np.where(expected,plain['dataArray'],np.nan))
@@ -0,0 +1,97 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import numpy as np
+import pytest
+from omi_query_service import QueryService, _Handler, send_query
+
+@pytest.fixture(scope='module')
+def service(tmp_path_factory,granules):
+	return QueryService(granules[:-1],str(tmp_path_factory.mktemp('service')/'catalog.sqlite'))
+
+@pytest.fixture(scope='module')
+def port(service):
+	server=ThreadingHTTPServer(('127.0.0.1',0),_Handler)
+	server.daemon_threads=True
+	server.service=service
+	server.verbose=False
+	thread=threading.Thread(target=server.serve_forever)
+	thread.daemon=True
+	thread.start()
+	yield server.server_address[1]
+	server.shutdown()
+	server.server_close()
+
+def _post(port,body):
+	request=Request('http://127.0.0.1:{0}/query'.format(port),data=json.dumps(body).encode('utf-8'))
+	try:
+		with urlopen(request) as response:
+			return response.status,json.loads(response.read().decode('utf-8'))
+	except HTTPError as error:
+		with error:
+			return error.code,json.loads(error.read().decode('utf-8'))
+
+def test_files_must_be_served(service,granules,tmp_path):
+	outside=str(tmp_path/'secret.he5')
+	for files in ([outside],[granules[0],outside],[granules[-1]]):
+		response=service.handle({'points':[[0.0,0.0]],'files':files})
+		assert response['status'] == 400
+		assert 'not served' in response['answers'][0]['error']
+	assert service.cache.metrics()['misses'] == 0
+
+def test_served_files(service,granules):
+	response=service.handle({'points':[[0.0,0.0]],'files':[granules[1]]})
+	assert response['status'] == 200
+	assert [result['file'] for result in response['answers'][0]['results']] == [granules[1]]
+
+@pytest.mark.parametrize('query',[{},{'points':[[0,0]],'bbox':[0,1,0,1]},{'points':[[0,0,1]]},{'points':'here'},
+	{'points':[[0,0]],'windows':[4]},{'points':[[0,0]],'edge':'wrap'},{'bbox':[0,1,0]},{'bbox':[0,1,0,1],'files':'x.he5'},
+	{'points':[[0,0]],'start':'not-a-date'},{'points':[[0,0]],'end':[2019]},{'points':[[0,0]],'product':'O3'},
+	{'points':[[0,0]],'quality':'yes'},{'bbox':[0,1,0,1],'quality':1}])
+def test_malformed_queries(service,query):
+	response=service.handle({'queries':[{'bbox':[-10,10,-180,180]},query]})
+	assert response['status'] == 400
+	assert 'error' not in response['answers'][0]
+	assert response['answers'][1]['error'].startswith('QueryError')
+
+@pytest.mark.parametrize('box',[(-10,10,170,-170),(-60,60,-180,180)])
+def test_bbox_matches_the_pixels(service,granules,box):
+	from omi_reader import read_swath
+	min_lat,max_lat,min_lon,max_lon=box
+	answer=service.handle({'bbox':list(box)})['answers'][0]
+	regions=dict((result['file'],result['region']) for result in answer['results'])
+	total=0
+	for FILE_NAME in granules[:-1]:
+		swath=read_swath(FILE_NAME)
+		lat=swath['lat']
+		lon=swath['lon']
+		in_lon=(lon>=min_lon)|(lon<=max_lon) if min_lon > max_lon else (lon>=min_lon)&(lon<=max_lon)
+		values=swath['dataArray'][(lat>=min_lat)&(lat<=max_lat)&in_lon]
+		count=int(np.count_nonzero(~np.isnan(values)))
+		total+=count
+		if count:
+			assert regions[FILE_NAME]['count'] == count
+			assert regions[FILE_NAME]['average'] == pytest.approx(float(np.nanmean(values)))
+		else:
+			assert regions.get(FILE_NAME,{'count':0})['count'] == 0
+	assert total > 0
+
+def test_internal_errors(service,monkeypatch):
+	def fail(entry,query):
+		raise RuntimeError('broken')
+	monkeypatch.setattr(service,'bbox_query',fail)
+	response=service.handle({'bbox':[-90,90,-180,180]})
+	assert response['status'] == 500
+	assert response['answers'][0]['error'] == 'RuntimeError: broken'
+
+def test_http_status(port,service,granules,monkeypatch,tmp_path):
+	status,response=_post(port,{'queries':[{'points':[[0.0,0.0]],'files':[granules[0]]}]})
+	assert status == 200 and response['status'] == 200
+	status,response=_post(port,{'queries':[{'points':[[0.0,0.0]],'files':[str(tmp_path/'secret.he5')]}]})
+	assert status == 400
+	status,response=_post(port,['not','a','request'])
+	assert status == 400
+	monkeypatch.setattr(service,'point_query',lambda entry,query: 1/0)
+	assert send_query([{'points':[[0.0,0.0]],'files':[granules[0]]}],port)['status'] == 500
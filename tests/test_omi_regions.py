@@ -0,0 +1,111 @@
+import json
+import numpy as np
+import pytest
+import omi_regions
+from omi_cache import FieldCache
+from omi_regions import RegionSet, polygon_contains, region_report
+
+def _square(min_lon,min_lat,max_lon,max_lat):
+	return [[min_lon,min_lat],[max_lon,min_lat],[max_lon,max_lat],[min_lon,max_lat],[min_lon,min_lat]]
+
+def _in_square(lat,lon,min_lon,min_lat,max_lon,max_lat):
+	return (lon>min_lon)&(lon<max_lon)&(lat>min_lat)&(lat<max_lat)
+
+#a square with a hole, a multipolygon of two squares, a region overlapping both, and one with no pixels
+FEATURES=[('holed',{'type':'Polygon','coordinates':[_square(0,0,10,10),_square(3,3,6,6)]}),
+	('multi',{'type':'MultiPolygon','coordinates':[[_square(-15,-15,-5,-5)],[_square(12,-10,18,-2)]]}),
+	('overlap',{'type':'Polygon','coordinates':[_square(-8,-8,8,8)]}),
+	('empty',{'type':'Polygon','coordinates':[_square(100,60,110,70)]})]
+
+def _expected_masks(lat,lon):
+	return {'holed':_in_square(lat,lon,0,0,10,10)&~_in_square(lat,lon,3,3,6,6),
+		'multi':_in_square(lat,lon,-15,-15,-5,-5)|_in_square(lat,lon,12,-10,18,-2),
+		'overlap':_in_square(lat,lon,-8,-8,8,8),
+		'empty':np.zeros(lat.shape,dtype=bool)}
+
+@pytest.fixture
+def regions(tmp_path):
+	path=tmp_path/'regions.geojson'
+	features=[{'type':'Feature','properties':{'NAME':name},'geometry':geometry} for name,geometry in FEATURES]
+	path.write_text(json.dumps({'type':'FeatureCollection','features':features}))
+	return RegionSet.from_geojson(str(path),'NAME')
+
+@pytest.fixture
+def swath():
+	#random pixel centres (never exactly on an edge) with about 10% missing values
+	rng=np.random.default_rng(3)
+	lat=rng.uniform(-20,20,(120,60))
+	lon=rng.uniform(-20,20,(120,60))
+	dataArray=rng.normal(5e15,1e15,(120,60))
+	dataArray[rng.random((120,60))<0.1]=np.nan
+	return lat,lon,dataArray
+
+def test_polygon_contains(monkeypatch):
+	rng=np.random.default_rng(4)
+	lat=rng.uniform(-2,12,5000)
+	lon=rng.uniform(-2,12,5000)
+	rings=[np.array(_square(0,0,10,10),dtype=np.float64),np.array(_square(3,3,6,6),dtype=np.float64)]
+	edges=np.concatenate([np.column_stack((ring,np.roll(ring,-1,axis=0))) for ring in rings])
+	expected=_in_square(lat,lon,0,0,10,10)&~_in_square(lat,lon,3,3,6,6)
+	np.testing.assert_array_equal(polygon_contains(edges,lat,lon),expected)
+	#a triangle, tested in small blocks
+	triangle=np.array([[0,0],[10,0],[0,10],[0,0]],dtype=np.float64)
+	edges=np.column_stack((triangle,np.roll(triangle,-1,axis=0)))
+	expected=(lon>0)&(lat>0)&(lon+lat<10)
+	monkeypatch.setattr(omi_regions,'_BLOCK',50)
+	np.testing.assert_array_equal(polygon_contains(edges,lat,lon),expected)
+
+def test_statistics_match_brute_force(regions,swath):
+	lat,lon,dataArray=swath
+	stats=regions.assign(lat,lon).statistics(dataArray)
+	masks=_expected_masks(lat,lon)
+	assert masks['holed'].any() and masks['multi'].any() and (masks['overlap']&masks['holed']).any()
+	for i,name in enumerate(regions.names):
+		values=dataArray[masks[name]]
+		count=np.count_nonzero(~np.isnan(values))
+		assert stats['count'][i] == count
+		if count == 0:
+			assert name == 'empty'
+			assert np.isnan([stats['average'][i],stats['median'][i],stats['stdev'][i]]).all()
+			continue
+		assert stats['average'][i] == pytest.approx(np.nanmean(values),rel=1e-12)
+		assert stats['median'][i] == np.nanmedian(values)
+		assert stats['stdev'][i] == pytest.approx(np.nanstd(values),rel=1e-9)
+
+def test_assignment_is_cached_in_memory(regions,swath,monkeypatch):
+	lat,lon,dataArray=swath
+	calls=[]
+	assign=RegionSet.assign
+	monkeypatch.setattr(RegionSet,'assign',lambda self,lat,lon: calls.append(1) or assign(self,lat,lon))
+	first=regions.assignment(lat,lon)
+	assert regions.assignment(lat.copy(),lon.copy()) is first
+	assert len(calls) == 1
+	#another geometry gets its own assignment
+	other=regions.assignment(lat[::-1],lon)
+	assert other is not first and len(calls) == 2
+
+def test_assignment_is_cached_on_disk(tmp_path,granules,regions,monkeypatch):
+	from omi_reader import read_swath
+	cache=FieldCache(str(tmp_path/'cache'))
+	swath=read_swath(granules[0])
+	expected=regions.assign(swath['lat'],swath['lon'])
+	regions.assignment(swath['lat'],swath['lon'],granules[0],cache)
+	#a new RegionSet of the same polygons (a later run) reads the pairs back instead of assigning again
+	again=RegionSet(regions.names,[omi_regions._rings(geometry) for name,geometry in FEATURES])
+	monkeypatch.setattr(RegionSet,'assign',lambda self,lat,lon: pytest.fail('assigned again'))
+	assignment=again.assignment(swath['lat'],swath['lon'],granules[0],cache)
+	np.testing.assert_array_equal(assignment.pixels,expected.pixels)
+	np.testing.assert_array_equal(assignment.regions,expected.regions)
+
+def test_region_report(granules,regions):
+	from omi_reader import read_swath
+	swath=read_swath(granules[0])
+	masks=_expected_masks(swath['lat'],swath['lon'])
+	results=region_report(granules[0],regions)
+	assert [result['region'] for result in results] == regions.names
+	assert sum(result['count'] for result in results) > 0
+	for result in results:
+		values=swath['dataArray'][masks[result['region']]]
+		assert result['count'] == np.count_nonzero(~np.isnan(values))
+		if result['count']:
+			assert result['median'] == pytest.approx(float(np.nanmedian(values)))
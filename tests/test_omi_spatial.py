@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import omi_spatial
+from omi_reader import Granule
+from omi_spatial import SwathIndex, haversine
+
+def _brute_force(lat,lon,user_lats,user_lons):
+	#the haversine argmin the location tool has always used, one location at a time
+	x=[]
+	y=[]
+	d=[]
+	for user_lat,user_lon in zip(user_lats,user_lons):
+		distance=haversine(lat,lon,float(user_lat),float(user_lon))
+		i,j=np.unravel_index(distance.argmin(),distance.shape)
+		x.append(i)
+		y.append(j)
+		d.append(distance[i,j])
+	return np.array(x),np.array(y),np.array(d)
+
+def _assert_exact(index,lat,lon,user_lats,user_lons):
+	x,y,d=index.query(user_lats,user_lons)
+	expected_x,expected_y,expected_d=_brute_force(lat,lon,user_lats,user_lons)
+	np.testing.assert_array_equal(x,expected_x)
+	np.testing.assert_array_equal(y,expected_y)
+	np.testing.assert_array_equal(d,expected_d)
+
+@pytest.fixture(params=['tree','full'])
+def use_tree(request,monkeypatch):
+	#every test runs with the KD-tree and with the full search used when scipy is missing
+	if request.param == 'tree':
+		pytest.importorskip('scipy.spatial')
+	else:
+		monkeypatch.setattr(omi_spatial,'cKDTree',None)
+	return request.param == 'tree'
+
+@pytest.fixture(scope='module')
+def swaths(granules):
+	swaths=[]
+	for FILE_NAME in granules:
+		with Granule(FILE_NAME) as granule:
+			swaths.append((granule.lat,granule.lon))
+	return swaths
+
+def test_fallback_has_no_tree(use_tree):
+	lat=np.zeros((2,2),dtype=np.float32)
+	index=SwathIndex(lat,lat)
+	assert (index.tree is not None) == use_tree
+
+def test_random_points(use_tree,swaths):
+	rng=np.random.default_rng(1)
+	for lat,lon in swaths[:4]:
+		#points scattered over the swath and its surroundings, plus anywhere on the globe
+		row=rng.integers(0,lat.shape[0],200)
+		column=rng.integers(0,lat.shape[1],200)
+		user_lats=np.clip(lat[row,column]+rng.normal(0,2,200),-90,90)
+		user_lons=lon[row,column]+rng.normal(0,2,200)
+		user_lats=np.r_[user_lats,rng.uniform(-90,90,50)]
+		user_lons=np.r_[user_lons,rng.uniform(-180,180,50)]
+		_assert_exact(SwathIndex(lat,lon),lat,lon,user_lats,user_lons)
+
+def test_near_the_poles_and_the_antimeridian(use_tree,swaths):
+	crossing=[(lat,lon) for lat,lon in swaths if (lon.max()-lon.min()) > 180]
+	assert crossing
+	user_lats=np.r_[89.99,-89.99,90.0,-90.0,85.0,-85.0,0.0,0.0,30.0,-30.0,0.0]
+	user_lons=np.r_[0.0,45.0,-120.0,170.0,180.0,-180.0,180.0,-180.0,179.99,-179.99,540.0]
+	for lat,lon in crossing[:2]+swaths[:1]:
+		_assert_exact(SwathIndex(lat,lon),lat,lon,user_lats,user_lons)
+
+def test_equidistant_ties(use_tree):
+	#a regular float32 grid symmetric about the equator and the prime meridian: points on the
+	#mid-lines are exactly equidistant from two (or four) pixels, and argmin keeps the first
+	lat,lon=np.meshgrid(np.arange(-2.5,3,1,dtype=np.float32),np.arange(-2.5,3,1,dtype=np.float32),indexing='ij')
+	user_lats=np.r_[0.0,0.0,1.0,-1.0,0.0,0.5,2.0]
+	user_lons=np.r_[0.0,1.0,0.0,-1.0,2.0,0.0,-2.0]
+	d=haversine(lat,lon,0.0,0.0)
+	assert (d == d.min()).sum() == 4
+	_assert_exact(SwathIndex(lat,lon),lat,lon,user_lats,user_lons)
@@ -0,0 +1,88 @@
+import sys
+import numpy as np
+import pytest
+import omi_store
+from omi_binning import LatLonGrid
+from omi_store import CubeStore, append_granules
+
+GRID=LatLonGrid(5.0)
+
+@pytest.fixture(scope='module')
+def granules(tmp_path_factory):
+	#six orbits around midnight, so that they fall in two daily time steps
+	from generate_synthetic_omi_he5 import generate_granules
+	return generate_granules(str(tmp_path_factory.mktemp('orbits')),6,('NO2',),40,30,start='2019-05-01T20:00:00')
+
+def _cube(path):
+	with CubeStore(path) as store:
+		order=np.argsort(store.times)
+		return dict((name,store.group[name][:][order]) for name in ('mean','count')),sorted(store.granules)
+
+@pytest.fixture(scope='module')
+def reference(tmp_path_factory,granules):
+	#the cube made by one uninterrupted append
+	path=str(tmp_path_factory.mktemp('store')/'reference.h5')
+	added,errors=append_granules(path,granules,GRID,chunks=(1,16,16),depth=0)
+	assert (added,errors) == (len(granules),[])
+	return _cube(path)
+
+def _assert_same_cube(path,reference):
+	cube,names=_cube(path)
+	assert names == reference[1]
+	np.testing.assert_array_equal(cube['count'],reference[0]['count'])
+	np.testing.assert_allclose(cube['mean'],reference[0]['mean'],rtol=1e-6)
+
+def test_append_is_split_into_time_steps(reference,granules):
+	cube,names=reference
+	#the synthetic orbits cover two days, one chunk each
+	assert cube['count'].shape[0] == 2
+	assert len(names) == len(granules)
+
+def test_appending_again_adds_nothing(tmp_path,granules,reference):
+	path=str(tmp_path/'cube.h5')
+	append_granules(path,granules[:2],GRID,chunks=(1,16,16),depth=0)
+	assert append_granules(path,granules,depth=0) == (len(granules)-2,[])
+	assert append_granules(path,granules,depth=0) == (0,[])
+	_assert_same_cube(path,reference)
+
+def test_rerun_after_a_crash_counts_each_granule_once(tmp_path,monkeypatch,granules,reference):
+	#the first block is written, then the append dies before its granules are recorded
+	path=str(tmp_path/'cube.h5')
+	def crash(self,names):
+		raise RuntimeError('crash')
+	with monkeypatch.context() as patch:
+		patch.setattr(CubeStore,'add_granules',crash)
+		with pytest.raises(RuntimeError):
+			append_granules(path,granules,GRID,chunks=(1,16,16),depth=0)
+	with CubeStore(path) as store:
+		assert store.granules == []
+		assert store.group['count'][:].sum() > 0
+	added,errors=append_granules(path,granules,depth=0)
+	assert errors == []
+	assert 0 < added < len(granules)
+	_assert_same_cube(path,reference)
+
+def test_partly_written_step_is_refused(tmp_path,granules):
+	path=str(tmp_path/'cube.h5')
+	append_granules(path,granules[:3],GRID,chunks=(1,16,16),depth=0)
+	with CubeStore(path,'r+') as store:
+		store.begin_append({0:['OMI-Aura_L2-OMNO2_missing.he5']})
+		mean=store.group['mean'][0]
+		mean*=2
+		store.group['mean'][0]=mean
+	with pytest.raises(ValueError):
+		append_granules(path,granules,depth=0)
+
+def test_zarr_store_needs_zarr(tmp_path,monkeypatch):
+	monkeypatch.setitem(sys.modules,'zarr',None)
+	with pytest.raises(ImportError,match='zarr is needed'):
+		CubeStore.create(str(tmp_path/'cube.zarr'),GRID,'ColumnAmountNO2')
+
+@pytest.mark.parametrize('workers',[1,2])
+def test_zarr_store_matches_hdf5(tmp_path,granules,reference,workers):
+	pytest.importorskip('zarr')
+	path=str(tmp_path/'cube.zarr')
+	added,errors=append_granules(path,granules,GRID,workers=workers,chunks=(1,16,16),depth=0)
+	assert (added,errors) == (len(granules),[])
+	assert omi_store.store_backend(path) == 'zarr'
+	_assert_same_cube(path,reference)
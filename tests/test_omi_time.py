@@ -0,0 +1,55 @@
+import calendar
+import time
+import h5py
+import numpy as np
+from omi_time import TIME_COLUMNS, decode_scan_time
+
+#offset the original dump script added to every scan time before calling time.gmtime
+_OFFSET=calendar.timegm(time.strptime('Dec 31, 1992 @ 23:59:59 UTC', '%b %d, %Y @ %H:%M:%S UTC'))
+
+def _gmtime_columns(scan_time):
+	#the per-scanline loop from the original read_omi_no2_so2_and_dump_ascii.py, with NaN
+	#wherever time.gmtime cannot convert the value (fill and NaN times)
+	columns=np.full((scan_time.shape[0],len(TIME_COLUMNS)),np.nan)
+	for i in range(scan_time.shape[0]):
+		try:
+			temp=time.gmtime(scan_time[i]+_OFFSET)
+		except (ValueError,OverflowError,OSError):
+			continue
+		columns[i]=temp[0:6]
+	return columns
+
+def _assert_matches_loop(scan_time):
+	times,columns=decode_scan_time(scan_time)
+	expected=_gmtime_columns(scan_time)
+	np.testing.assert_array_equal(np.column_stack([columns[name] for name in TIME_COLUMNS]),expected)
+	assert (np.isnat(times) == np.isnan(expected[:,0])).all()
+
+def test_matches_gmtime_loop_on_random_times():
+	rng=np.random.default_rng(0)
+	#2004 to 2030, with fractional seconds, plus exact day, month and year boundaries
+	scan_time=rng.uniform(3.5e8,1.2e9,20000)
+	boundaries=(np.array([np.datetime64('2008-03-01'),np.datetime64('2012-02-29'),np.datetime64('2017-01-01')])
+		-np.datetime64('1992-12-31T23:59:59')).astype('timedelta64[s]').astype(np.float64)
+	scan_time=np.concatenate([scan_time,boundaries,boundaries-0.25,boundaries+0.999])
+	_assert_matches_loop(scan_time)
+
+def test_matches_gmtime_loop_on_a_granule(granules):
+	with h5py.File(granules[0],mode='r') as f:
+		scan_time=f['HDFEOS/SWATHS/ColumnAmountNO2/Geolocation Fields/Time'][:].ravel()
+	_assert_matches_loop(scan_time)
+
+def test_fill_and_nan_times():
+	scan_time=np.array([4.7e8,-1.0e30,np.nan,4.7e8+86400.5,np.inf])
+	_assert_matches_loop(scan_time)
+	times,columns=decode_scan_time(scan_time)
+	assert np.isnat(times[[1,2,4]]).all()
+	for name in TIME_COLUMNS:
+		assert np.isnan(columns[name][[1,2,4]]).all()
+		assert np.isfinite(columns[name][[0,3]]).all()
+
+def test_keeps_the_input_shape():
+	scan_time=np.full((3,4),4.7e8)
+	times,columns=decode_scan_time(scan_time)
+	assert times.shape == (3,4)
+	assert all(columns[name].shape == (3,4) for name in TIME_COLUMNS)
@@ -0,0 +1,106 @@
+import builtins
+import h5py
+import numpy as np
+import pytest
+import omi_writers
+from benchmark_omi_decode import original_decode
+from generate_synthetic_omi_he5 import write_granule
+from omi_time import TIME_COLUMNS
+from omi_writers import write_columns, write_csv
+from read_omi_no2_so2_and_dump_ascii import dump_granule
+
+DATA_FIELDS='HDFEOS/SWATHS/ColumnAmountNO2/Data Fields/'
+GEOLOCATION_FIELDS='HDFEOS/SWATHS/ColumnAmountNO2/Geolocation Fields/'
+
+@pytest.fixture(scope='module')
+def FILE_NAME(tmp_path_factory):
+	FILE_NAME=str(tmp_path_factory.mktemp('writers')/'OMI-Aura_L2-OMNO2_writers.he5')
+	write_granule(FILE_NAME,'NO2',70,60)
+	return FILE_NAME
+
+def _columns():
+	rng=np.random.default_rng(1)
+	values=rng.uniform(-1e16,1e16,(23,5)).astype(np.float32)
+	values[3,2]=np.nan
+	days=np.broadcast_to(np.arange(23,dtype=float)[:,None],values.shape)
+	return ['Day','Value'],[days,values]
+
+def test_text_dump_matches_the_original_decode(FILE_NAME):
+	outfilename=dump_granule(FILE_NAME,'txt')
+	with open(outfilename) as f:
+		header=f.readline().strip().split(',')
+	table=np.loadtxt(outfilename,delimiter=',',skiprows=1)
+	assert header == list(TIME_COLUMNS)+['Latitude','Longitude','ColumnAmountNO2','ColumnAmountNO2Std','VcdQualityFlags']
+	assert table.shape == (70*60,len(header))
+	column=dict(zip(header,table.T))
+	with h5py.File(FILE_NAME,'r') as f:
+		#nine significant digits read back to the same float32
+		np.testing.assert_array_equal(column['Latitude'].astype(np.float32),f[GEOLOCATION_FIELDS+'Latitude'][:].ravel())
+		np.testing.assert_array_equal(column['Longitude'].astype(np.float32),f[GEOLOCATION_FIELDS+'Longitude'][:].ravel())
+		for SDS_NAME in ['ColumnAmountNO2','ColumnAmountNO2Std']:
+			sds=f[DATA_FIELDS+SDS_NAME]
+			expected=original_decode(sds).ravel()
+			missing=np.isnan(expected)
+			assert missing.any()
+			#fill and missing values are written as the fill value
+			np.testing.assert_array_equal(column[SDS_NAME][missing].astype(np.float32),sds.attrs['_FillValue'][0])
+			np.testing.assert_allclose(column[SDS_NAME][~missing],expected[~missing],rtol=1e-7)
+		np.testing.assert_array_equal(column['VcdQualityFlags'],f[DATA_FIELDS+'VcdQualityFlags'][:].ravel())
+		#every scanline's date is repeated across its pixels and written without decimals
+		assert (column['Year'] == 2019).all()
+		np.testing.assert_array_equal(column['Day'].reshape(70,60),column['Day'].reshape(70,60)[:,:1].repeat(60,axis=1))
+
+def test_block_size_does_not_change_the_text(tmp_path):
+	header,columns=_columns()
+	write_csv(str(tmp_path/'one.csv'),header,columns,{'Day':'%.0f'})
+	write_csv(str(tmp_path/'blocks.csv'),header,columns,{'Day':'%.0f'},chunk_scanlines=4)
+	with open(str(tmp_path/'one.csv')) as one, open(str(tmp_path/'blocks.csv')) as blocks:
+		text=one.read()
+		assert text == blocks.read()
+	assert text.splitlines()[1+3*5+2] == '3,nan'
+
+def test_text_file_is_closed_when_a_block_fails(tmp_path,monkeypatch):
+	opened=[]
+	def recording_open(*args,**kwargs):
+		opened.append(builtins.open(*args,**kwargs))
+		return opened[-1]
+	monkeypatch.setattr(omi_writers,'open',recording_open,raising=False)
+	header,columns=_columns()
+	#the second column is too short for the last block
+	columns[1]=columns[1][:20]
+	with pytest.raises(ValueError):
+		write_csv(str(tmp_path/'broken.csv'),header,columns,chunk_scanlines=8)
+	assert len(opened) == 1 and opened[0].closed
+
+def test_unknown_format(tmp_path):
+	header,columns=_columns()
+	with pytest.raises(ValueError,match='Unknown output format'):
+		write_columns(str(tmp_path/'out.xls'),header,columns,'xls')
+
+@pytest.mark.parametrize('output_format',['parquet','arrow'])
+def test_columnar_round_trip(tmp_path,output_format):
+	pa=pytest.importorskip('pyarrow')
+	header,columns=_columns()
+	days=columns[0].copy()
+	days[5,:]=np.nan
+	columns[0]=days
+	outfilename=str(tmp_path/('out'+omi_writers.OUTPUT_FORMATS[output_format]))
+	write_columns(outfilename,header,columns,output_format,integer_columns=('Day',),chunk_scanlines=4)
+	if output_format == 'parquet':
+		import pyarrow.parquet as pq
+		parquet=pq.ParquetFile(outfilename)
+		#one row group per block of scanlines
+		assert parquet.metadata.num_row_groups == 6
+		table=parquet.read()
+	else:
+		reader=pa.ipc.open_file(pa.memory_map(outfilename))
+		assert reader.num_record_batches == 6
+		table=reader.read_all()
+	assert table.column_names == header
+	assert table.schema.field('Day').type == pa.int32()
+	assert table.schema.field('Value').type == pa.float32()
+	day=table.column('Day')
+	#NaN in an integer column becomes null
+	assert day.null_count == 5
+	np.testing.assert_array_equal(day.to_numpy(zero_copy_only=False),days.ravel())
+	np.testing.assert_array_equal(table.column('Value').to_numpy(),columns[1].ravel())